@@ -4,21 +4,38 @@ import sys
 import io
 import json
 import re
+import copy
 import requests
 import logging
 import signal
 import traceback
+import hashlib
+import hmac
+import zlib
+import threading
+import contextvars
+import math
+import tempfile
+import sqlite3
+import importlib.util
+import shutil
+import subprocess
+import wave
+import mmap
 import pytz
+from array import array
 
-from datetime import datetime
-from time import time
-from typing import Dict, Any, List, Optional, Callable, Tuple, Set, Union
+from datetime import datetime, timedelta
+from time import time, sleep
+from typing import Dict, Any, List, Optional, Callable, Tuple, Set, Union, Iterable, Iterator, BinaryIO, ContextManager
 from flask import Flask, request, jsonify
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 from tenacity import retry, stop_after_attempt, wait_exponential
 from difflib import SequenceMatcher
 from collections import defaultdict
 from collections import deque
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -26,12 +43,18 @@ from reportlab.lib.units import inch, cm
 from reportlab.lib import colors
 from decouple import config
 from functools import lru_cache
-from reportlab.platypus.flowables import HRFlowable
+from reportlab.platypus.flowables import HRFlowable, Flowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.platypus import KeepTogether, PageBreak
 from reportlab.pdfgen import canvas
-from functools import wraps
+from functools import wraps, partial
+from contextlib import contextmanager, ExitStack
+from abc import ABC, abstractmethod
 from collections import defaultdict
+try:
+    from re import _parser as re_parser
+except ImportError:  # Python < 3.11
+    import sre_parse as re_parser
 
 # Rate limiting decorator
 def rate_limit(max_calls, time_window):
@@ -145,45 +168,79 @@ CONFIG = {
     "NLP_FALLBACK_TO_REGEX": config("NLP_FALLBACK_TO_REGEX", default=True, cast=bool),
     "NLP_COMMAND_PATTERN_WEIGHT": config("NLP_COMMAND_PATTERN_WEIGHT", default=0.7, cast=float),
     "NLP_FREE_FORM_WEIGHT": config("NLP_FREE_FORM_WEIGHT", default=0.3, cast=float),
+    "EXTRACTION_MODE": config("EXTRACTION_MODE", default="sequential"),  # or "speculative"
+    "NLP_LATENCY_BUDGET": config("NLP_LATENCY_BUDGET", default=3.0, cast=float),
+    "SPECULATIVE_NLP_WORKERS": config("SPECULATIVE_NLP_WORKERS", default=4, cast=int),
+    "ENABLE_INTENT_CLASSIFIER": config("ENABLE_INTENT_CLASSIFIER", default=True, cast=bool),
+    "INTENT_MODEL_PATH": config("INTENT_MODEL_PATH", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_model.json")),
+    "INTENT_MIN_CONFIDENCE": config("INTENT_MIN_CONFIDENCE", default=0.7, cast=float),
+    "ENABLE_COMMAND_GRAMMAR": config("ENABLE_COMMAND_GRAMMAR", default=True, cast=bool),
+    "NLP_BATCH_MIN_CONFIDENCE": config("NLP_BATCH_MIN_CONFIDENCE", default=0.5, cast=float),
+    "OPENAI_TIMEOUT": config("OPENAI_TIMEOUT", default=30, cast=float),
+    "CIRCUIT_FAILURE_THRESHOLD": config("CIRCUIT_FAILURE_THRESHOLD", default=3, cast=int),
+    "CIRCUIT_RESET_TIMEOUT": config("CIRCUIT_RESET_TIMEOUT", default=30, cast=float),
+    "CIRCUIT_MAX_PROBE_INTERVAL": config("CIRCUIT_MAX_PROBE_INTERVAL", default=300, cast=float),
+    "USAGE_WINDOW_SECONDS": config("USAGE_WINDOW_SECONDS", default=3600, cast=int),
+    "USAGE_WINDOW_COUNT": config("USAGE_WINDOW_COUNT", default=48, cast=int),
+    "ADMIN_TOKEN": config("ADMIN_TOKEN", default=""),
+    "NLP_STRUCTURED_OUTPUTS": config("NLP_STRUCTURED_OUTPUTS", default=True, cast=bool),
+    "NLP_PROMPT_PRUNING": config("NLP_PROMPT_PRUNING", default=True, cast=bool),
+    "NLP_MIN_TOKENS": config("NLP_MIN_TOKENS", default=256, cast=int),
+    "NLP_OUTPUT_TOKENS_PER_INPUT_TOKEN": config("NLP_OUTPUT_TOKENS_PER_INPUT_TOKEN", default=3.0, cast=float),
+    "NLP_STREAMING": config("NLP_STREAMING", default=False, cast=bool),
+    "NLP_STREAM_UPDATE_INTERVAL": config("NLP_STREAM_UPDATE_INTERVAL", default=1.0, cast=float),
+    "NLP_CACHE_ENTRIES": config("NLP_CACHE_ENTRIES", default=512, cast=int),
+    "NLP_CACHE_TTL": config("NLP_CACHE_TTL", default=7 * 24 * 3600, cast=int),
+    "NLP_CACHE_FILE": config("NLP_CACHE_FILE", default="/tmp/nlp_cache.sqlite3"),
+    "TRANSCRIPTION_CACHE_ENTRIES": config("TRANSCRIPTION_CACHE_ENTRIES", default=256, cast=int),
+    "TRANSCRIPTION_CACHE_TTL": config("TRANSCRIPTION_CACHE_TTL", default=30 * 24 * 3600, cast=int),
+    "TRANSCRIPTION_CACHE_FILE": config("TRANSCRIPTION_CACHE_FILE", default="/tmp/transcription_cache.sqlite3"),
+    "TRANSCRIPTION_CHUNK_SECONDS": config("TRANSCRIPTION_CHUNK_SECONDS", default=30, cast=float),
+    "TRANSCRIPTION_CHUNK_MIN_SECONDS": config("TRANSCRIPTION_CHUNK_MIN_SECONDS", default=45, cast=float),
+    "TRANSCRIPTION_SILENCE_SEARCH_SECONDS": config("TRANSCRIPTION_SILENCE_SEARCH_SECONDS", default=5, cast=float),
+    "TRANSCRIPTION_WORKERS": config("TRANSCRIPTION_WORKERS", default=4, cast=int),
+    "VOICE_IO_WORKERS": config("VOICE_IO_WORKERS", default=8, cast=int),
+    "TRANSCRIPTION_BACKEND": config("TRANSCRIPTION_BACKEND", default="openai"),  # openai, local or fixture
+    "TRANSCRIPTION_CHAT_BACKENDS": config("TRANSCRIPTION_CHAT_BACKENDS", default=""),  # "chat_id=backend,..."
+    "TRANSCRIPTION_SMALL_BACKEND": config("TRANSCRIPTION_SMALL_BACKEND", default="local"),
+    "TRANSCRIPTION_SMALL_MAX_BYTES": config("TRANSCRIPTION_SMALL_MAX_BYTES", default=0, cast=int),  # 0 disables size routing
+    "LOCAL_WHISPER_MODEL": config("LOCAL_WHISPER_MODEL", default="base"),
+    "TRANSCRIPTION_FIXTURE_FILE": config("TRANSCRIPTION_FIXTURE_FILE", default="transcription_fixtures.json"),
+    "TRANSCRIPTION_FIXTURE_DEFAULT": config("TRANSCRIPTION_FIXTURE_DEFAULT", default=""),
+    # Telegram file downloads
+    "TELEGRAM_API_URL": config("TELEGRAM_API_URL", default="https://api.telegram.org"),  # or a self-hosted Bot API server
+    "TELEGRAM_LOCAL_MODE": config("TELEGRAM_LOCAL_MODE", default=False, cast=bool),  # server runs with --local
+    "DOWNLOAD_TIMEOUT": config("DOWNLOAD_TIMEOUT", default=30, cast=float),
+    "DOWNLOAD_CHUNK_BYTES": config("DOWNLOAD_CHUNK_BYTES", default=64 * 1024, cast=int),
+    "DOWNLOAD_SPOOL_MAX_BYTES": config("DOWNLOAD_SPOOL_MAX_BYTES", default=1024 * 1024, cast=int),
+    "MAX_VOICE_BYTES": config("MAX_VOICE_BYTES", default=20 * 1024 * 1024, cast=int),
+    "MAX_VOICE_SECONDS": config("MAX_VOICE_SECONDS", default=600, cast=int),
+    "MAX_PHOTO_BYTES": config("MAX_PHOTO_BYTES", default=10 * 1024 * 1024, cast=int),
     # PDF settings
     "PDF_LOGO_PATH": config("PDF_LOGO_PATH", default=""),
     "PDF_LOGO_WIDTH": config("PDF_LOGO_WIDTH", default=2, cast=float),
     "ENABLE_PDF_PHOTOS": config("ENABLE_PDF_PHOTOS", default=True, cast=bool),
     "MAX_PHOTO_WIDTH": config("MAX_PHOTO_WIDTH", default=4, cast=float),
-    "MAX_PHOTO_HEIGHT": config("MAX_PHOTO_HEIGHT", default=3, cast=float)
+    "MAX_PHOTO_HEIGHT": config("MAX_PHOTO_HEIGHT", default=3, cast=float),
+    "PDF_CACHE_MAX_BYTES": config("PDF_CACHE_MAX_BYTES", default=20 * 1024 * 1024, cast=int),
+    "PDF_FILE_ID_HISTORY": config("PDF_FILE_ID_HISTORY", default=5, cast=int),
+    # Digest settings
+    "REPORT_ARCHIVE_DIR": config("REPORT_ARCHIVE_DIR", default="/tmp/report_archive"),
+    "DIGEST_DAYS": config("DIGEST_DAYS", default=7, cast=int),
+    "DIGEST_SPOOL_MAX_BYTES": config("DIGEST_SPOOL_MAX_BYTES", default=5 * 1024 * 1024, cast=int)
 }
 
 # --- Enhanced GPT Prompt for Construction Site Reports ---
-NLP_EXTRACTION_PROMPT = """
+# The prompt is assembled from a stable prefix (role, category rules, field list and
+# special commands) and per-topic fragments selected from the input by build_nlp_prompt.
+# The prefix always comes first so provider-side prompt caching can reuse it.
+NLP_PROMPT_PREFIX = """
 You are a specialized AI for extracting structured data from construction site reports. 
 You understand specific construction terminology, abbreviations, and common misspellings.
 
 CRITICAL: You're processing input from a construction site worker who might be using voice recognition in a noisy environment, 
 so account for audio transcription errors and construction-specific terminology.
 
-IMPORTANT: Voice transcription often incorrectly adds commas between words that belong together. For example:
-- "Build, Tech AG" should be understood as "BuildTech AG"
-- "Construction, Bro, GmbH" should be understood as "ConstructionBro GmbH" or "Construction Bro GmbH"
-- "Electric Solutions, Ltd" should be understood as "Electric Solutions Ltd"
-- "Electric Maya Game Behave" might be "Electric-Meier GmbH" (voice errors)
-- "Companies Electric Maya Game Behave" means add company "Electric-Meier GmbH"
-
-When you see company names with AG, GmbH, Ltd, Inc, LLC, Corp suffixes, treat the words before the suffix as part of the company name, even if separated by commas.
-
-CRITICAL FOR COMPANY EXTRACTION:
-- If you see "Companies" followed by words, extract ALL companies mentioned
-- Multiple companies are often connected with "and" or commas
-- Example: "Companies Kieback AG and Implenia AG" means TWO companies: Kieback AG and Implenia AG
-- Example: "Companies BuildCorp, TechSolutions GmbH, and Electric Ltd" means THREE companies
-- ALWAYS split on "and" or commas when multiple companies are listed
-- IMPORTANT: When you see "Companies X and Y", both X and Y are separate companies
-- "Companies Implenia AG and KIBAG AG" should return: [{"name": "Implenia AG"}, {"name": "KIBAG AG"}]
-- Never combine companies into a single entry
-- Common voice errors: "Maya" → "Meier", "Game Behave" → "GmbH", "are gay" → "AG"
-- If the text starts with "Companies" and has no clear suffix, still treat it as a company name
-- "Electric Maya Game Behave" should be extracted as company: "Electric Maya Game Behave" (let the user correct later)
-
-
 Extract information into these fields (only include fields that are explicitly mentioned):
 CRITICAL CATEGORY SEPARATION RULES:
 - When you see a category keyword (tools, services, activities, issues, people, companies, time, weather), it marks the START of that category
@@ -207,6 +264,60 @@ IMPORTANT: If you see text like "Tools, hammer, saw, electric wiring, activities
 When parsing comma-separated lists, watch for category transitions:
 - "services inspection, tools hammer" → services: ["inspection"], tools: ["hammer"]
 - "issues cracks, time 8am" → issues: ["cracks"], time: "8am"
+
+Extract information into these fields (only include fields that are explicitly mentioned):
+- site_name: string - physical location or project name (e.g., "Downtown Project", "Building 7")
+- segment: string - specific section or area within the site (e.g., "5", "North Wing", "Foundation")
+- category: string - classification of work or report (e.g., "Bestand", "Safety", "Progress", "Mängelerfassung")
+- companies: list of objects with company names [{"name": "BuildRight AG"}, {"name": "ElectricFlow GmbH"}]
+- people: list of strings with ALL names of individuals mentioned (extract every person, but NEVER include "me" as a person name) ["Anna Keller", "John Smith", "Maxwell", "Stefan"]
+- roles: list of {"name": "person", "role": "their role"} for ALL people with specific roles mentioned
+- tools: list of objects with equipment/tools [{"item": "mobile crane"}, {"item": "welding equipment"}]
+- services: list of objects with services provided [{"task": "electrical wiring"}, {"task": "HVAC installation"}]
+- activities: list of strings describing work performed ["laying foundations", "setting up scaffolding"]
+- issues: list of {"description": "issue description", "has_photo": boolean} for problems encountered
+- time: string - duration or time period (e.g., "7am to 4pm", "7 a.m. to 4 p.m.", "all day from 8 to 5", "full day", "8 hours")
+- weather: string - weather conditions (e.g., "cloudy with intermittent rain", "sunny with occasional clouds")
+- impression: string - overall assessment (e.g., "productive despite setbacks")
+- comments: string - additional notes or observations
+- date: string - in dd-mm-yyyy format
+
+Special commands to detect (return these as single-field objects, do not combine with other fields):
+- reset: boolean (true) - if input contains commands like "new", "new report", or "reset"
+- yes_confirm: boolean (true) - for responses like "yes", "yeah", "okay", "sure", "confirm"
+- no_confirm: boolean (true) - for responses like "no", "nope", "nah", "negative"
+- summary: boolean (true) - for requests like "summarize", "summary", "short report", "overview"
+- detailed: boolean (true) - for requests like "detailed report", "full report", "comprehensive report"
+- export_pdf: boolean (true) - for requests like "export", "export pdf", "generate report"
+- undo_last: boolean (true) - for commands like "undo last", "undo last change"
+- help: string - extract specific help topic if mentioned after "help"
+"""
+
+NLP_PROMPT_FRAGMENTS: Dict[str, str] = {
+    "companies": """
+IMPORTANT: Voice transcription often incorrectly adds commas between words that belong together. For example:
+- "Build, Tech AG" should be understood as "BuildTech AG"
+- "Construction, Bro, GmbH" should be understood as "ConstructionBro GmbH" or "Construction Bro GmbH"
+- "Electric Solutions, Ltd" should be understood as "Electric Solutions Ltd"
+- "Electric Maya Game Behave" might be "Electric-Meier GmbH" (voice errors)
+- "Companies Electric Maya Game Behave" means add company "Electric-Meier GmbH"
+
+When you see company names with AG, GmbH, Ltd, Inc, LLC, Corp suffixes, treat the words before the suffix as part of the company name, even if separated by commas.
+
+CRITICAL FOR COMPANY EXTRACTION:
+- If you see "Companies" followed by words, extract ALL companies mentioned
+- Multiple companies are often connected with "and" or commas
+- Example: "Companies Kieback AG and Implenia AG" means TWO companies: Kieback AG and Implenia AG
+- Example: "Companies BuildCorp, TechSolutions GmbH, and Electric Ltd" means THREE companies
+- ALWAYS split on "and" or commas when multiple companies are listed
+- IMPORTANT: When you see "Companies X and Y", both X and Y are separate companies
+- "Companies Implenia AG and KIBAG AG" should return: [{"name": "Implenia AG"}, {"name": "KIBAG AG"}]
+- Never combine companies into a single entry
+- Common voice errors: "Maya" → "Meier", "Game Behave" → "GmbH", "are gay" → "AG"
+- If the text starts with "Companies" and has no clear suffix, still treat it as a company name
+- "Electric Maya Game Behave" should be extracted as company: "Electric Maya Game Behave" (let the user correct later)
+""",
+    "people": """
 CRITICAL RULES FOR PEOPLE EXTRACTION:
 - When you see "People, [Name1] as [Role1], [Name2] as [Role2]", extract ALL people mentioned
 - "John Smith as site manager, Anna Weber as safety officer" means:
@@ -222,28 +333,7 @@ CRITICAL RULES FOR PEOPLE EXTRACTION:
 - NEVER stop after the first person - continue parsing the entire sentence for all people
 - Common voice errors: "honor" might be "Anna", "are gay" might be "AG", "Maya" might be "Meier"
 The word "worked" or "as" is just grammar, not part of the name!
-
-CRITICAL RULES FOR ISSUES/ACTIVITIES:
-- When you see "Issues, [issue1] and [issue2]", treat as SEPARATE issues
-- "water leak in basement and delayed material delivery" = TWO issues, not one
-- When you see "Activities [activity1], [activity2]", extract ALL activities
-- "Pouring Concrete, Installing Windows" = TWO activities
-
-CRITICAL RULES FOR COMBINED FIELDS:
-- If you see "weather [condition] time [duration]" in one input, SPLIT them:
-  - weather: only the weather condition
-  - time: only the time duration
-- Example: "weather sunny with occasional clouds time full day eight hours"
-  - weather: "sunny with occasional clouds"
-  - time: "full day eight hours"
-
-Extract information into these fields (only include fields that are explicitly mentioned):
-- site_name: string - physical location or project name (e.g., "Downtown Project", "Building 7")
-- segment: string - specific section or area within the site (e.g., "5", "North Wing", "Foundation")
-- category: string - classification of work or report (e.g., "Bestand", "Safety", "Progress", "Mängelerfassung")
-- companies: list of objects with company names [{"name": "BuildRight AG"}, {"name": "ElectricFlow GmbH"}]
-- people: list of strings with ALL names of individuals mentioned (extract every person, but NEVER include "me" as a person name) ["Anna Keller", "John Smith", "Maxwell", "Stefan"]
-- roles: list of {"name": "person", "role": "their role"} for ALL people with specific roles mentioned
+Details for the roles field:
   CRITICAL: When you see "John Smith as site manager, Anna Weber as safety officer", extract BOTH:
   [{"name": "John Smith", "role": "Site Manager"}, {"name": "Anna Weber", "role": "Safety Officer"}]
   When you see "Lisa Maya as co-worker", extract: [{"name": "Lisa Maya", "role": "Co-Worker"}]
@@ -258,34 +348,47 @@ Example: "people Lisa Miller as co-worker" should return:
   "roles": [{"name": "Lisa Miller", "role": "Co-Worker"}]
 }
 NEVER extract just the person without their role when "as" is present in the text.
-- tools: list of objects with equipment/tools [{"item": "mobile crane"}, {"item": "welding equipment"}]
-- services: list of objects with services provided [{"task": "electrical wiring"}, {"task": "HVAC installation"}]
-- activities: list of strings describing work performed ["laying foundations", "setting up scaffolding"]
-- issues: list of {"description": "issue description", "has_photo": boolean} for problems encountered
+CRITICAL for people and roles extraction:
+- When you see patterns like "X as Y, A as B, C was doing D, and me as E", extract ALL people mentioned
+- When you see "X was a Y" or "X was working as Y", extract X as a person and Y as their role
+- Extract "me" as a person (keep it as "me" unless context provides a specific name)
+- Don't stop after finding the first person - continue parsing the entire sentence
+- "Stefan was laying the electrical wiring" means Stefan is a person with implied role
+- "Lisa Malone was a safety officer" means Lisa Malone is a person with role "Safety Officer"
+- "Marcus Smith was working as an electrical engineer" means Marcus Smith is a person with role "Electrical Engineer"
+- Always extract ALL people mentioned, even if their role isn't specified
+- For patterns like "NAME was a ROLE" or "NAME was working as ROLE", always extract both the person and their role
+- For spelling corrections like "correct spelling of X to Y" in companies or other fields, treat as correction in that field
+""",
+    "issues_activities": """
+CRITICAL RULES FOR ISSUES/ACTIVITIES:
+- When you see "Issues, [issue1] and [issue2]", treat as SEPARATE issues
+- "water leak in basement and delayed material delivery" = TWO issues, not one
+- When you see "Activities [activity1], [activity2]", extract ALL activities
+- "Pouring Concrete, Installing Windows" = TWO activities
+Details for the issues field:
   CRITICAL: "water leak in basement and delayed material delivery" = TWO separate issues:
   [{"description": "water leak in basement", "has_photo": false}, {"description": "delayed material delivery", "has_photo": false}]
   Always split issues connected by "and" into separate items
-- time: string - duration or time period (e.g., "7am to 4pm", "7 a.m. to 4 p.m.", "all day from 8 to 5", "full day", "8 hours")
+""",
+    "weather_time": """
+CRITICAL RULES FOR COMBINED FIELDS:
+- If you see "weather [condition] time [duration]" in one input, SPLIT them:
+  - weather: only the weather condition
+  - time: only the time duration
+- Example: "weather sunny with occasional clouds time full day eight hours"
+  - weather: "sunny with occasional clouds"
+  - time: "full day eight hours"
+Details for the time and weather fields:
   IMPORTANT: Extract the COMPLETE time phrase including "a.m."/"p.m." - "7 a.m. to 4 p.m." NOT just "7 a"
-- weather: string - weather conditions (e.g., "cloudy with intermittent rain", "sunny with occasional clouds")
 IMPORTANT: If you see "weather [condition] time [duration]" in one sentence, split them into separate fields
-- impression: string - overall assessment (e.g., "productive despite setbacks")
-- comments: string - additional notes or observations
-- date: string - in dd-mm-yyyy format
-
-Special commands to detect (return these as single-field objects, do not combine with other fields):
-- reset: boolean (true) - if input contains commands like "new", "new report", or "reset"
-- yes_confirm: boolean (true) - for responses like "yes", "yeah", "okay", "sure", "confirm"
-- no_confirm: boolean (true) - for responses like "no", "nope", "nah", "negative"
-- summary: boolean (true) - for requests like "summarize", "summary", "short report", "overview"
-- detailed: boolean (true) - for requests like "detailed report", "full report", "comprehensive report"
-- export_pdf: boolean (true) - for requests like "export", "export pdf", "generate report"
-- undo_last: boolean (true) - for commands like "undo last", "undo last change"
-- help: string - extract specific help topic if mentioned after "help"
-
+""",
+    "delete": """
 Deletion commands (parse these accurately):
 - If input is "delete X from Y" or "remove X from Y": return {"delete": {"target": "X", "field": "Y"}}
 - If input is "delete all X" or "clear X": return {"X": {"delete": true}} where X is the field name
+""",
+    "correct": """
 CRITICAL: When you see "Correct X to Y as Z" patterns:
 - This means: correct person name X to Y, and their role is Z
 - DO NOT add Z as a separate person
@@ -325,112 +428,723 @@ Correction commands (CRITICAL - DO NOT ADD AS COMPANIES):
   - Each comma-separated "old to new" pair becomes a separate object in the correct array
   - Preserve company suffixes (AG, GmbH, Ltd, etc.) in both old and new values
   - The field should be "companies" when the values contain company suffixes
-CRITICAL for people and roles extraction:
-- When you see patterns like "X as Y, A as B, C was doing D, and me as E", extract ALL people mentioned
-- When you see "X was a Y" or "X was working as Y", extract X as a person and Y as their role
-- Extract "me" as a person (keep it as "me" unless context provides a specific name)
-- Don't stop after finding the first person - continue parsing the entire sentence
-- "Stefan was laying the electrical wiring" means Stefan is a person with implied role
-- "Lisa Malone was a safety officer" means Lisa Malone is a person with role "Safety Officer"
-- "Marcus Smith was working as an electrical engineer" means Marcus Smith is a person with role "Electrical Engineer"
-- Always extract ALL people mentioned, even if their role isn't specified
-- For patterns like "NAME was a ROLE" or "NAME was working as ROLE", always extract both the person and their role
-- For spelling corrections like "correct spelling of X to Y" in companies or other fields, treat as correction in that field
-
+""",
+    "voice": """
 For voice inputs, handle common transcription errors like:
 - "site vs. sight", "weather vs. whether", "crews vs. cruise", "concrete vs. concert", "form vs. foam"
 - Misheard numbers: "to buy for" → "2x4", "for buy ate" → "4x8"
 - Run-together words: "concretework" → "concrete work", "siteinspection" → "site inspection"
 - Split lists properly, even if transcribed without commas
+""",
+}
 
+NLP_PROMPT_SUFFIX = """
 ONLY return a valid JSON object with the extracted fields, nothing else.
 """
 
+# The complete prompt, used when pruning is disabled or the input touches every topic
+NLP_EXTRACTION_PROMPT = NLP_PROMPT_PREFIX + "".join(NLP_PROMPT_FRAGMENTS.values()) + NLP_PROMPT_SUFFIX
+
+# Keywords or likely content that pull a fragment into the prompt
+NLP_PROMPT_TRIGGERS: Dict[str, re.Pattern] = {
+    "companies": re.compile(r'\b(?:compan\w*|firms?|contractors?|subcontractors?|ag|gmbh|ltd|inc|llc|corp|'
+                            r'game\s+behave|are\s+gay|maya)\b', re.IGNORECASE),
+    # Role words, or the "as"/"was" that follows a name
+    "people": re.compile(r'\b(?:people|persons?|workers?|staff|crew|team|roles?|me|as|was|works?|worked|'
+                         r'manager|supervisor|foreman|engineer|officer|electrician|plumber|architect)\b',
+                         re.IGNORECASE),
+    "issues_activities": re.compile(r'\b(?:issues?|problems?|delays?|delayed|leaks?|cracks?|damage\w*|'
+                                    r'activit\w*|install\w*|pour\w*|laying|building|progress)\b', re.IGNORECASE),
+    "weather_time": re.compile(r'\b(?:weather|whether|sunny|rain\w*|cloud\w*|wind\w*|snow\w*|hot|cold|'
+                               r'time|hours?|day|am|pm|a\.m|p\.m|morning|afternoon|evening)\b', re.IGNORECASE),
+    "delete": re.compile(r'\b(?:delete|remove|clear)\b', re.IGNORECASE),
+    "correct": re.compile(r'\b(?:correct\w*|spelling|instead)\b', re.IGNORECASE),
+    "voice": re.compile(r'\b(?:sight|whether|cruise|concert|foam|buy)\b', re.IGNORECASE),
+}
+
+# Dictated free-form reports get the voice-error fragment regardless of keywords
+NLP_PROMPT_VOICE_MIN_WORDS = 20
+
+def estimate_token_count(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return math.ceil(len(text) / 4)
+
+def select_prompt_fragments(text: str) -> List[str]:
+    """Names of the prompt fragments relevant to this input, in prompt order"""
+    if not CONFIG["NLP_PROMPT_PRUNING"]:
+        return list(NLP_PROMPT_FRAGMENTS)
+    selected = []
+    for name in NLP_PROMPT_FRAGMENTS:
+        if NLP_PROMPT_TRIGGERS[name].search(text):
+            selected.append(name)
+        elif name == "voice" and len(text.split()) >= NLP_PROMPT_VOICE_MIN_WORDS:
+            selected.append(name)
+    return selected
+
+def build_nlp_prompt(text: str) -> str:
+    """The system prompt for this input: the stable prefix, the selected fragments and the suffix"""
+    fragments = select_prompt_fragments(text)
+    prompt = NLP_PROMPT_PREFIX + "".join(NLP_PROMPT_FRAGMENTS[name] for name in fragments) + NLP_PROMPT_SUFFIX
+    _record_prompt_pruning(prompt, fragments)
+    return prompt
+
+def nlp_max_tokens(text: str) -> int:
+    """Completion budget scaled to the input: the JSON output grows with what was said"""
+    budget = CONFIG["NLP_MIN_TOKENS"] + int(estimate_token_count(text) * CONFIG["NLP_OUTPUT_TOKENS_PER_INPUT_TOKEN"])
+    return min(CONFIG["NLP_MAX_TOKENS"], budget)
+
+NLP_FULL_PROMPT_TOKENS = estimate_token_count(NLP_EXTRACTION_PROMPT)
+NLP_PREFIX_PROMPT_TOKENS = estimate_token_count(NLP_PROMPT_PREFIX)
+_prompt_pruning_lock = threading.Lock()
+prompt_pruning_stats: Dict[str, Any] = {
+    "prompts": 0,
+    "full_prompt_tokens": 0,
+    "sent_prompt_tokens": 0,
+    "fragments": defaultdict(int),
+}
+
+def _record_prompt_pruning(prompt: str, fragments: List[str]) -> None:
+    sent_tokens = estimate_token_count(prompt)
+    with _prompt_pruning_lock:
+        prompt_pruning_stats["prompts"] += 1
+        prompt_pruning_stats["full_prompt_tokens"] += NLP_FULL_PROMPT_TOKENS
+        prompt_pruning_stats["sent_prompt_tokens"] += sent_tokens
+        for name in fragments:
+            prompt_pruning_stats["fragments"][name] += 1
+    log_event("nlp_prompt_built", full_tokens=NLP_FULL_PROMPT_TOKENS, sent_tokens=sent_tokens,
+              fragments=fragments)
+
+def prompt_pruning_summary() -> Dict[str, Any]:
+    """Estimated system-prompt tokens before and after pruning, for /health"""
+    with _prompt_pruning_lock:
+        full_tokens = prompt_pruning_stats["full_prompt_tokens"]
+        sent_tokens = prompt_pruning_stats["sent_prompt_tokens"]
+        return {
+            "enabled": CONFIG["NLP_PROMPT_PRUNING"],
+            "prompts": prompt_pruning_stats["prompts"],
+            "prefix_tokens": NLP_PREFIX_PROMPT_TOKENS,
+            "full_prompt_tokens": full_tokens,
+            "sent_prompt_tokens": sent_tokens,
+            "saved_pct": round(100 * (1 - sent_tokens / full_tokens), 1) if full_tokens else 0.0,
+            "fragments": dict(prompt_pruning_stats["fragments"]),
+        }
+
+# --- Request-scoped Memoization ---
+class RequestMemo:
+    """Results of pure extraction calls made while handling one Telegram update.
+    
+    Entries are futures keyed by function and input, so a call that is still running
+    in another thread (speculative extraction) is waited for instead of repeated.
+    The OpenAI requests of the update are fingerprinted as well, which is what the
+    duplicate counter is based on.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Future] = {}
+        self._openai_requests: Set[str] = set()
+        self.calls = 0
+        self.hits = 0
+        self.openai_requests = 0
+        self.duplicate_openai_requests = 0
+    
+    @staticmethod
+    def _key(name: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+        return json.dumps([name, args, kwargs], sort_keys=True, default=str)
+    
+    def call(self, func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        key = self._key(func.__name__, args, kwargs)
+        with self._lock:
+            self.calls += 1
+            future = self._entries.get(key)
+            owner = future is None
+            if owner:
+                future = self._entries[key] = Future()
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        elif not future.done():
+            log_event("request_memo_wait", function=func.__name__)
+        # Callers adjust the returned data, so every caller gets its own copy
+        return copy.deepcopy(future.result())
+    
+    def peek(self, name: str, *args, **kwargs) -> Optional[Any]:
+        """The finished result of an earlier call, or None"""
+        with self._lock:
+            future = self._entries.get(self._key(name, args, kwargs))
+        if future is None or not future.done() or future.exception():
+            return None
+        return copy.deepcopy(future.result())
+    
+    def seed(self, name: str, result: Any, *args, **kwargs) -> None:
+        """Store a result obtained another way (e.g. streamed) for later calls"""
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            self._entries.setdefault(self._key(name, args, kwargs), future)
+    
+    def record_openai_request(self, operation: str, request_kwargs: Dict[str, Any]) -> None:
+        fingerprint = hashlib.sha256(self._key(operation, (), {
+            key: request_kwargs.get(key) for key in ("model", "messages", "max_tokens", "response_format", "stream", "file")
+        }).encode("utf-8")).hexdigest()
+        with self._lock:
+            self.openai_requests += 1
+            if fingerprint in self._openai_requests:
+                self.duplicate_openai_requests += 1
+                log_event("duplicate_openai_request", operation=operation)
+            self._openai_requests.add(fingerprint)
+
+_request_memo: contextvars.ContextVar = contextvars.ContextVar("request_memo", default=None)
+_request_memo_lock = threading.Lock()
+request_memo_stats: Dict[str, int] = {"requests": 0, "calls": 0, "hits": 0, "openai_requests": 0,
+                                      "duplicate_openai_requests": 0}
+
+def request_scoped(func: Callable) -> Callable:
+    """Give each call of a request handler its own RequestMemo"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        memo = RequestMemo()
+        token = _request_memo.set(memo)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request_memo.reset(token)
+            with _request_memo_lock:
+                request_memo_stats["requests"] += 1
+                request_memo_stats["calls"] += memo.calls
+                request_memo_stats["hits"] += memo.hits
+                request_memo_stats["openai_requests"] += memo.openai_requests
+                request_memo_stats["duplicate_openai_requests"] += memo.duplicate_openai_requests
+            if memo.calls:
+                log_event("request_memo", calls=memo.calls, hits=memo.hits, openai_requests=memo.openai_requests,
+                          duplicate_openai_requests=memo.duplicate_openai_requests)
+    return wrapper
+
+def memoize_per_request(func: Callable) -> Callable:
+    """Run a pure extraction call at most once per input within the current request"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        memo = _request_memo.get()
+        if memo is None:
+            return func(*args, **kwargs)
+        return memo.call(func, args, kwargs)
+    return wrapper
+
 # --- NLP-enhanced Field Extraction Functions ---
 
+class NLPResultCache:
+    """Two-tier cache of NLP extraction results: an in-memory LRU in front of a SQLite file.
+    
+    Entries hold the standardized output as JSON plus the confidence, so every
+    hit returns a fresh copy that callers are free to modify. The transcription
+    cache uses the same class with its own table.
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: int, db_path: str = "", table: str = "nlp_cache"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.table = table
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    "(key TEXT PRIMARY KEY, payload TEXT NOT NULL, confidence REAL NOT NULL, created REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.getLogger("ConstructionBot").error(f"{table} database unavailable, using memory only: {e}")
+                self._db = None
+    
+    def _remember(self, key: str, entry: Tuple[str, float, float]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (data, confidence) for a fresh entry, checking memory first, then disk"""
+        now = time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[2] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(entry[0]), entry[1]
+                del self._entries[key]
+                self.expired += 1
+            
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        f"SELECT payload, confidence, created FROM {self.table} WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and now - row[2] <= self.ttl_seconds:
+                        self._remember(key, row)
+                        self.disk_hits += 1
+                        return json.loads(row[0]), row[1]
+                    if row is not None:
+                        self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                        self._db.commit()
+                        self.expired += 1
+                except sqlite3.Error as e:
+                    log_event(f"{self.table}_db_error", error=str(e))
+            
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, data: Dict[str, Any], confidence: float) -> None:
+        """Store a result in both tiers"""
+        entry = (json.dumps(data), confidence, time())
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)", (key,) + entry)
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._db.execute(f"DELETE FROM {self.table} WHERE created < ?", (entry[2] - self.ttl_seconds,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                log_event(f"{self.table}_db_error", error=str(e))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit-rate figures for both tiers"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._entries),
+                "persistent": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+nlp_result_cache = NLPResultCache(CONFIG["NLP_CACHE_ENTRIES"], CONFIG["NLP_CACHE_TTL"], CONFIG["NLP_CACHE_FILE"])
+
+def nlp_cache_key(text: str) -> str:
+    """Key on whitespace-normalized text, the model and the prompt in use (including the selected fragments).
+    
+    Case is kept: names and sites are extracted as written.
+    """
+    normalized_text = " ".join(text.split())
+    prompt_hash = hashlib.sha256(NLP_EXTRACTION_PROMPT.encode("utf-8")).hexdigest()
+    fragments = ",".join(select_prompt_fragments(text))
+    key_material = f"{CONFIG['NLP_MODEL']}\n{prompt_hash}\n{fragments}\n{normalized_text}"
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+@memoize_per_request
 def extract_with_nlp(text: str) -> Tuple[Dict[str, Any], float]:
+    """Use NLP to extract structured data from text with confidence score, reusing cached results"""
+    cache_key = nlp_cache_key(text)
+    cached = nlp_result_cache.get(cache_key)
+    if cached is not None:
+        log_event("nlp_cache_hit", text_length=len(text))
+        return cached
+    
+    data, confidence = _extract_with_nlp_uncached(text)
+    # Failed or skipped extractions come back empty and are never cached
+    if data:
+        nlp_result_cache.put(cache_key, data, confidence)
+    return data, confidence
+
+# (model, format type) pairs the API rejected, so later requests go straight to the next format
+_unsupported_response_formats: Set[Tuple[str, str]] = set()
+
+def request_json_completion(operation: str, model: str, system_prompt: str, user_content: str,
+                            structured: bool, batch: bool = False, **kwargs) -> Tuple[Any, bool]:
+    """Chat completion constrained to JSON: the extraction schema, else JSON mode, else plain text.
+    
+    Returns the response and whether it follows the extraction schema. A format the
+    model rejects is remembered and skipped from then on.
+    """
+    formats = ([extraction_response_format(batch)] if structured else []) + [{"type": "json_object"}, None]
+    for response_format in formats:
+        format_type = response_format["type"] if response_format else None
+        if response_format and (model, format_type) in _unsupported_response_formats:
+            continue
+        messages = [
+            {"role": "system", "content": system_prompt if response_format else system_prompt + "\nRespond ONLY with valid JSON."},
+            {"role": "user", "content": user_content}
+        ]
+        if response_format:
+            kwargs["response_format"] = response_format
+        else:
+            kwargs.pop("response_format", None)
+        try:
+            response = call_openai(operation, client.chat.completions.create, model=model, messages=messages, **kwargs)
+            return response, format_type == "json_schema"
+        except Exception as e:
+            # If the model doesn't support this format, try the next one
+            if response_format is None or not re.search(r'response_format|json_schema|json_object', str(e)):
+                raise
+            _unsupported_response_formats.add((model, format_type))
+            log_event("response_format_unsupported", operation=operation, model=model, format=format_type, error=str(e))
+    raise RuntimeError("No response format left to try")
+
+JSON_FENCE_PATTERN = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+# Confidence factor for JSON recovered from a fence or surrounding prose
+RECOVERED_JSON_PENALTY = 0.9
+
+def parse_completion_json(content: str, structured: bool) -> Tuple[Any, bool]:
+    """Parse a completion's JSON and report whether it had to be recovered.
+    
+    Schema-constrained output is pure JSON. Without the schema (JSON mode or the plain-text
+    fallback) the model may wrap it in a ```json fence or prose, so the fenced block, else
+    the outermost object, is parsed instead. Raises ValueError if there is no valid JSON.
+    """
+    try:
+        return json.loads(content), False
+    except ValueError:
+        if structured:
+            raise
+    fence = JSON_FENCE_PATTERN.search(content)
+    if fence:
+        return json.loads(fence.group(1)), True
+    start, end = content.find("{"), content.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("No JSON object in the response")
+    return json.loads(content[start:end + 1]), True
+
+def _extract_with_nlp_uncached(text: str) -> Tuple[Dict[str, Any], float]:
     """Use NLP to extract structured data from text with confidence score"""
     try:
         # Skip NLP for obvious command patterns to save time and resources
         if re.match(r'^(?:yes|no|help|new|reset|undo|export|summarize|detailed)\b', text.lower()):
             log_event("nlp_extraction_skipped", reason="obvious_command")
             return {}, 0.0
+        if not openai_breakers["nlp_extraction"].allow():
+            log_event("nlp_extraction_skipped", reason="circuit_open")
+            return {}, 0.0
             
         print("NLP extraction attempted for text:", text)
-            
-        # Call OpenAI API with the enhanced construction-focused prompt
-        log_event("nlp_extraction_start", text_length=len(text))
-        try:
-            # First try with JSON format for newer models
-            response = client.chat.completions.create(
-                model=CONFIG["NLP_MODEL"],
-                messages=[
-                    {"role": "system", "content": NLP_EXTRACTION_PROMPT},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.1,  # Lower temperature for more consistent extraction
-                max_tokens=CONFIG["NLP_MAX_TOKENS"],
-                response_format={"type": "json_object"}
+        intent_router.record_llm_call()
+            
+        # Call OpenAI API with the enhanced construction-focused prompt, pruned to the input
+        prompt = build_nlp_prompt(text)
+        max_tokens = nlp_max_tokens(text)
+        log_event("nlp_extraction_start", text_length=len(text), max_tokens=max_tokens)
+        response, structured = request_json_completion(
+            "nlp_extraction", CONFIG["NLP_MODEL"], prompt, text, CONFIG["NLP_STRUCTURED_OUTPUTS"],
+            temperature=0.1,  # Lower temperature for more consistent extraction
+            max_tokens=max_tokens
+        )
+        if response.choices[0].finish_reason == "length" and max_tokens < CONFIG["NLP_MAX_TOKENS"]:
+            # The scaled budget cut the JSON short; retry once with the full budget
+            log_event("nlp_extraction_truncated", max_tokens=max_tokens)
+            response, structured = request_json_completion(
+                "nlp_extraction", CONFIG["NLP_MODEL"], prompt, text, CONFIG["NLP_STRUCTURED_OUTPUTS"],
+                temperature=0.1,
+                max_tokens=CONFIG["NLP_MAX_TOKENS"]
             )
-        except Exception as e:
-            # If the model doesn't support JSON format, try without it
-            if "response_format" in str(e) or "json_object" in str(e):
-                log_event("nlp_extraction_format_error", error=str(e))
-                response = client.chat.completions.create(
-                    model=CONFIG["NLP_MODEL"],
-                    messages=[
-                        {"role": "system", "content": NLP_EXTRACTION_PROMPT + "\nRespond ONLY with valid JSON."},
-                        {"role": "user", "content": text}
-                    ],
-                    temperature=0.1,
-                    max_tokens=CONFIG["NLP_MAX_TOKENS"]
-                )
-            else:
-                raise
         content = response.choices[0].message.content.strip()
-        log_event("nlp_extraction_completed", response_length=len(content))
+        log_event("nlp_extraction_completed", response_length=len(content), structured=structured)
         
         # Debug log the actual NLP response
         print(f"DEBUG NLP Response: {content}")
         
-        # Extract JSON from the response
         try:
-            # First check if the entire response is JSON
-            data = json.loads(content)
-            
-            # Debug log the parsed data
-            print(f"DEBUG NLP Parsed Data: {data}")
-            
-            # Post-process the extracted data
-            data = standardize_nlp_output(data)
-            
-            # Calculate confidence based on fields present and structure
-            confidence = calculate_extraction_confidence(data, text)
-            
-            return data, confidence
-            
-        except json.JSONDecodeError:
-            # Try to extract JSON from the response if not pure JSON
-            json_pattern = r'```(?:json)?\s*(.*?)```'
-            json_match = re.search(json_pattern, content, re.DOTALL)
-            
-            if json_match:
-                json_str = json_match.group(1)
-                try:
-                    data = json.loads(json_str)
-                    data = standardize_nlp_output(data)
-                    confidence = calculate_extraction_confidence(data, text) * 0.9  # Slight penalty for not being pure JSON
-                    return data, confidence
-                except json.JSONDecodeError:
-                    log_event("nlp_json_parse_error", error="Extracted JSON invalid")
-            
+            data, recovered = parse_completion_json(content, structured)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
             log_event("nlp_response_parse_error", content_sample=content[:100])
             return {}, 0.0
+        
+        # Debug log the parsed data
+        print(f"DEBUG NLP Parsed Data: {data}")
+        
+        # Schema-conforming output only needs validating; free JSON gets the repair pass
+        data = normalize_nlp_output(data, structured)
+        
+        # Calculate confidence based on fields present and structure
+        confidence = calculate_extraction_confidence(data, text)
+        if recovered:
+            confidence *= RECOVERED_JSON_PENALTY
+        
+        return data, confidence
             
     except Exception as e:
         log_event("nlp_extraction_error", error=str(e), traceback=traceback.format_exc())
         return {}, 0.0
 
+NLP_BATCH_INSTRUCTIONS = """
+You will receive several independent message segments as JSON:
+{"segments": [{"index": 0, "text": "..."}, {"index": 1, "text": "..."}]}
+Extract the fields of each segment on its own, exactly as you would for a single message.
+ONLY return a JSON object of the form {"results": [{"index": 0, "fields": {...}}, {"index": 1, "fields": {...}}]}
+with one entry per segment, using the segment's index.
+"""
+
+NLP_SKIP_PATTERN = re.compile(r'^(?:yes|no|help|new|reset|undo|export|summarize|detailed|delete|clear)\b')
+CORRECT_SPELLING_PATTERN = re.compile(r'^correct\s+spelling', re.IGNORECASE)
+
+@memoize_per_request
+def route_intent(text: str) -> str:
+    """intent_router.route, once per text within an update, so the route counts stay per input"""
+    return intent_router.route(text)
+
+def segment_uses_nlp(text: str) -> bool:
+    """Whether extract_fields would send this text to extract_with_nlp"""
+    normalized_text = as_utterance(text).normalized
+    if not normalized_text or CORRECT_SPELLING_PATTERN.match(normalized_text):
+        return False
+    if NLP_SKIP_PATTERN.match(normalized_text.lowered):
+        return False
+    # Degraded mode: while OpenAI is failing, everything goes to the regex patterns
+    if not openai_available("nlp_extraction"):
+        return False
+    # Structured commands and confirmations are left to the regex patterns
+    return not CONFIG["ENABLE_INTENT_CLASSIFIER"] or route_intent(normalized_text) == "llm"
+
+def extract_batch_with_nlp(texts: List[str]) -> List[Optional[Tuple[Dict[str, Any], float]]]:
+    """Extract several segments with one OpenAI request.
+    
+    Results are returned in segment order (None where a segment was not part of the
+    batch or the model returned nothing for it). Results at or above
+    NLP_BATCH_MIN_CONFIDENCE are seeded into the request memo, so the per-segment
+    extract_with_nlp calls that follow in this update reuse them; low-confidence
+    segments fall back to their own request. They are kept out of the NLP cache,
+    whose keys stand for the single-segment prompt.
+    """
+    results: List[Optional[Tuple[Dict[str, Any], float]]] = [None] * len(texts)
+    memo = _request_memo.get()
+    if memo is None:
+        # Outside a request nothing would pick the results up
+        return results
+    pending = {}
+    for index, text in enumerate(texts):
+        if not segment_uses_nlp(text):
+            continue
+        cached = nlp_result_cache.get(nlp_cache_key(text))
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending[index] = text
+    
+    if len(pending) < 2:
+        # Nothing to gain over the regular single-segment request
+        return results
+    
+    log_event("nlp_batch_start", segments=len(pending))
+    intent_router.record_llm_call()
+    # One prompt covers every segment, so select fragments for all of them together
+    combined_text = "\n".join(pending.values())
+    try:
+        response, structured = request_json_completion(
+            "nlp_extraction", CONFIG["NLP_MODEL"],
+            build_nlp_prompt(combined_text) + NLP_BATCH_INSTRUCTIONS,
+            json.dumps({"segments": [{"index": index, "text": text} for index, text in pending.items()]}),
+            CONFIG["NLP_STRUCTURED_OUTPUTS"], batch=True,
+            temperature=0.1,
+            max_tokens=min(CONFIG["NLP_MAX_TOKENS"], sum(nlp_max_tokens(text) for text in pending.values()))
+        )
+        batch = parse_completion_json(response.choices[0].message.content.strip(), structured)[0].get("results", [])
+    except Exception as e:
+        log_event("nlp_batch_error", error=str(e))
+        return results
+    
+    threshold = CONFIG["NLP_BATCH_MIN_CONFIDENCE"]
+    confident = 0
+    for item in batch:
+        if not isinstance(item, dict) or not isinstance(item.get("fields"), dict):
+            continue
+        try:
+            index = int(item.get("index"))
+        except (TypeError, ValueError):
+            continue
+        if index not in pending:
+            continue
+        text = pending[index]
+        data = normalize_nlp_output(item["fields"], structured)
+        confidence = calculate_extraction_confidence(data, text)
+        results[index] = (data, confidence)
+        if data and confidence >= threshold:
+            memo.seed("extract_with_nlp", (data, confidence), text)
+            confident += 1
+    
+    log_event("nlp_batch_completed", segments=len(pending), confident=confident,
+              fallbacks=len(pending) - confident)
+    return results
+
+class IncrementalJSONObjectParser:
+    """Parses a JSON object as it streams in and yields each top-level field once it closes.
+    
+    Only string, depth and separator state is tracked per character; a field's text
+    is handed to json.loads once the comma or closing brace after it arrives.
+    """
+    
+    def __init__(self):
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._field_chars: List[str] = []
+        self.done = False
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume more text and return the fields completed by it"""
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+            if not self._started:
+                # Skip anything before the object, e.g. a ```json fence
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    completed.extend(self._close_field())
+                    continue
+            elif char == "," and self._depth == 1:
+                completed.extend(self._close_field())
+                continue
+            self._field_chars.append(char)
+        return completed
+    
+    def _close_field(self) -> List[Tuple[str, Any]]:
+        field_text = "".join(self._field_chars).strip()
+        self._field_chars = []
+        if not field_text:
+            return []
+        try:
+            return list(json.loads("{" + field_text + "}").items())
+        except ValueError:
+            log_event("nlp_stream_field_parse_error", sample=field_text[:80])
+            return []
+
+def stream_extract_with_nlp(text: str, on_field: Optional[Callable[[str, Any, bool], None]] = None) -> Tuple[Dict[str, Any], float]:
+    """Like extract_with_nlp, but streams the completion and reports each top-level field as it closes.
+    
+    on_field receives the raw field name and value and whether the response follows the
+    extraction schema, so it can normalize the field the way the final result is. The
+    returned data and confidence are computed from the whole response exactly as in
+    extract_with_nlp.
+    """
+    memo = _request_memo.get()
+    cache_key = nlp_cache_key(text)
+    cached = (memo.peek("extract_with_nlp", text) if memo else None) or nlp_result_cache.get(cache_key)
+    if cached is not None:
+        log_event("nlp_cache_hit", text_length=len(text))
+        if on_field:
+            # Cached results are already normalized, so they only need the validation pass
+            for key, value in cached[0].items():
+                on_field(key, value, True)
+        return cached
+    
+    started = time()
+    first_field_at = None
+    max_tokens = nlp_max_tokens(text)
+    intent_router.record_llm_call()
+    while True:
+        attempt_started = time()
+        stream_usage = None
+        stream_failed = False
+        finish_reason = None
+        parser = IncrementalJSONObjectParser()
+        parts: List[str] = []
+        stream = None
+        try:
+            stream, structured = request_json_completion(
+                "nlp_extraction", CONFIG["NLP_MODEL"], build_nlp_prompt(text), text, CONFIG["NLP_STRUCTURED_OUTPUTS"],
+                temperature=0.1,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    stream_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content or ""
+                parts.append(delta)
+                for key, value in parser.feed(delta):
+                    if first_field_at is None:
+                        first_field_at = time()
+                    if on_field:
+                        try:
+                            on_field(key, value, structured)
+                        except Exception as e:
+                            log_event("nlp_stream_callback_error", field=key, error=str(e))
+            openai_breakers["nlp_extraction"].record_success()
+        except Exception as e:
+            log_event("nlp_stream_error", error=str(e))
+            stream_failed = True
+            # Errors from create() were counted by call_openai; these broke the open stream
+            if stream is not None and isinstance(e, OPENAI_OUTAGE_ERRORS):
+                openai_breakers["nlp_extraction"].record_failure(e)
+            if not parts:
+                # Nothing streamed - fall back to the regular request
+                return extract_with_nlp(text)
+        
+        openai_usage.record("nlp_extraction", CONFIG["NLP_MODEL"], time() - attempt_started, usage=stream_usage,
+                            error=stream_failed)
+        if finish_reason == "length" and max_tokens < CONFIG["NLP_MAX_TOKENS"]:
+            # The scaled budget cut the JSON short; stream it again with the full budget.
+            # Fields already shown are reported again and simply replace themselves.
+            log_event("nlp_extraction_truncated", max_tokens=max_tokens, streamed=True)
+            max_tokens = CONFIG["NLP_MAX_TOKENS"]
+            continue
+        break
+    
+    content = "".join(parts).strip()
+    log_event("nlp_stream_completed", response_length=len(content),
+              first_field_ms=round((first_field_at - started) * 1000) if first_field_at else None,
+              total_ms=round((time() - started) * 1000))
+    try:
+        data, recovered = parse_completion_json(content, structured)
+    except ValueError:
+        data, recovered = None, False
+    if not isinstance(data, dict):
+        log_event("nlp_response_parse_error", content_sample=content[:100])
+        return {}, 0.0
+    
+    data = normalize_nlp_output(data, structured)
+    confidence = calculate_extraction_confidence(data, text)
+    if recovered:
+        confidence *= RECOVERED_JSON_PENALTY
+    if data:
+        nlp_result_cache.put(cache_key, data, confidence)
+    if memo:
+        # A later extract_with_nlp(text) in this update reuses the streamed result
+        memo.seed("extract_with_nlp", (data, confidence), text)
+    return data, confidence
+
 def standardize_nlp_output(data: Dict[str, Any]) -> Dict[str, Any]:
     """Ensure NLP extracted data conforms to expected structure"""
     result = {}
@@ -726,23 +1440,87 @@ def standardize_nlp_output(data: Dict[str, Any]) -> Dict[str, Any]:
     
     # Handle date field
     if "date" in data:
-        # Ensure date is in dd-mm-yyyy format
-        date_str = str(data["date"])
+        date_str = normalize_report_date(data["date"])
+        if date_str:
+            result["date"] = date_str
+    
+    return result
+
+def normalize_report_date(value: Any) -> Optional[str]:
+    """Bring a date into dd-mm-yyyy format, or None if it can't be parsed"""
+    for fmt in ["%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%d.%m.%Y", "%m.%d.%Y"]:
         try:
-            # Try to parse the date in various formats
-            for fmt in ["%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%d.%m.%Y", "%m.%d.%Y"]:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    result["date"] = date_obj.strftime("%d-%m-%Y")
-                    break
-                except ValueError:
-                    continue
-        except Exception:
-            # If date parsing fails, use today's date
-            result["date"] = datetime.now().strftime("%d-%m-%Y")
+            return datetime.strptime(str(value), fmt).strftime("%d-%m-%Y")
+        except ValueError:
+            continue
+    return None
+
+NLP_PRONOUNS = {"me", "i", "we", "us", "them", "they"}
+
+def _title_role(role: str) -> str:
+    """Capitalize a role title, including hyphenated roles like "co-worker" """
+    if '-' in role:
+        return '-'.join(word.capitalize() for word in role.split('-'))
+    return ' '.join(word.capitalize() for word in role.split())
+
+def validate_structured_output(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Single pass over a schema-conforming response: drop nulls, trim and dedupe entries.
+    
+    The schema already guarantees the shape of every field, so none of the repairs in
+    standardize_nlp_output are needed. Role names are added to people as they are there.
+    """
+    result: Dict[str, Any] = {}
+    seen: Dict[str, Set[Any]] = defaultdict(set)
+    
+    def add_entry(field: str, entry: Any, key: Any) -> None:
+        if key not in seen[field]:
+            seen[field].add(key)
+            result.setdefault(field, []).append(entry)
     
+    for field, value in data.items():
+        if value is None or value == "" or value == []:
+            continue
+        if field in NLP_COMMAND_FIELDS:
+            if value:
+                result[field] = True
+        elif field in SCALAR_FIELDS:
+            result[field] = str(value).strip()
+        elif field == "date":
+            date_str = normalize_report_date(value)
+            if date_str:
+                result["date"] = date_str
+        elif field in LIST_FIELDS and isinstance(value, dict):
+            if value.get("delete"):
+                result[field] = {"delete": True}
+        elif field in SIMPLE_LIST_FIELDS:
+            for entry in value:
+                entry = entry.strip()
+                if entry and not (field == "people" and entry.lower() in NLP_PRONOUNS):
+                    add_entry(field, entry, entry.lower())
+        elif field == "roles":
+            for entry in value:
+                name, role = entry["name"].strip(), _title_role(entry["role"].strip())
+                if name and role:
+                    add_entry("roles", {"name": name, "role": role}, (name.lower(), role.lower()))
+                    add_entry("people", name, name.lower())
+        elif field in DICT_LIST_FIELDS:
+            primary_key = next(iter(DICT_LIST_ITEM_FIELDS[field]))
+            for entry in value:
+                entry = {key: item.strip() if isinstance(item, str) else item for key, item in entry.items()}
+                if entry[primary_key]:
+                    add_entry(field, entry, entry[primary_key].lower())
+        elif field in ("help", "delete", "correct"):
+            result[field] = value
+    
+    # A correction names companies without adding them
+    if "correct" in result:
+        result.pop("companies", None)
     return result
 
+def normalize_nlp_output(data: Dict[str, Any], structured: bool) -> Dict[str, Any]:
+    """Validate a structured-output response, or repair a free JSON one"""
+    return validate_structured_output(data) if structured else standardize_nlp_output(data)
+
 def calculate_extraction_confidence(data: Dict[str, Any], original_text: str) -> float:
     """Calculate confidence score for NLP extraction"""
     if not data:
@@ -939,6 +1717,56 @@ SCALAR_FIELDS = ["site_name", "segment", "category", "time", "weather", "impress
 LIST_FIELDS = ["people", "companies", "roles", "tools", "services", "activities", "issues"]
 DICT_LIST_FIELDS = ["companies", "roles", "tools", "services", "issues"]
 SIMPLE_LIST_FIELDS = ["people", "activities"]
+# Keys and JSON types of the objects stored in each DICT_LIST_FIELDS entry
+DICT_LIST_ITEM_FIELDS = {
+    "companies": {"name": "string"},
+    "roles": {"name": "string", "role": "string"},
+    "tools": {"item": "string"},
+    "services": {"task": "string"},
+    "issues": {"description": "string", "has_photo": "boolean"},
+}
+NLP_COMMAND_FIELDS = ["reset", "yes_confirm", "no_confirm", "summary", "detailed", "export_pdf", "undo_last"]
+
+def _strict_object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Object schema in the form strict structured outputs require: every key listed, no extras"""
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+def build_extraction_schema() -> Dict[str, Any]:
+    """JSON schema of an extraction result, derived from the field lists.
+
+    Strict mode makes every property required, so fields that were not mentioned
+    come back as null. List fields also accept {"delete": true} to clear the field.
+    """
+    field_deletion = _strict_object({"delete": {"type": "boolean"}})
+    properties: Dict[str, Any] = {}
+    for field in SCALAR_FIELDS + ["date"]:
+        properties[field] = {"type": ["string", "null"]}
+    for field in LIST_FIELDS:
+        if field in DICT_LIST_FIELDS:
+            items = _strict_object({key: {"type": json_type} for key, json_type in DICT_LIST_ITEM_FIELDS[field].items()})
+        else:
+            items = {"type": "string"}
+        properties[field] = {"anyOf": [{"type": "array", "items": items}, field_deletion, {"type": "null"}]}
+    for command in NLP_COMMAND_FIELDS:
+        properties[command] = {"type": ["boolean", "null"]}
+    properties["help"] = {"type": ["string", "null"]}
+    properties["delete"] = {"anyOf": [_strict_object({"target": {"type": "string"}, "field": {"type": "string"}}),
+                                      {"type": "null"}]}
+    correction = _strict_object({"field": {"type": "string"}, "old": {"type": "string"}, "new": {"type": "string"}})
+    properties["correct"] = {"anyOf": [{"type": "array", "items": correction}, {"type": "null"}]}
+    return _strict_object(properties)
+
+@lru_cache(maxsize=None)
+def extraction_response_format(batch: bool = False) -> Dict[str, Any]:
+    """response_format for structured outputs, for a single message or a batch of segments"""
+    schema = build_extraction_schema()
+    if batch:
+        result = _strict_object({"index": {"type": "integer"}, "fields": schema})
+        schema = _strict_object({"results": {"type": "array", "items": result}})
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "site_report_batch" if batch else "site_report_fields", "strict": True, "schema": schema},
+    }
 
 # Map fields to their suggested value lists for common terms
 FIELD_SUGGESTIONS = {
@@ -1065,6 +1893,312 @@ CONTEXTUAL_PATTERNS = {
 }
 
 #Part 3 Error Handling
+# --- Intent Pre-classifier ---
+INTENT_LABELS = ("regex", "llm")
+
+def intent_corpus(seed: int = 7) -> List[Tuple[str, str, str]]:
+    """Labelled corpus for the intent classifier as (text, label, group).
+    
+    Commands in the forms FIELD_PATTERNS accepts are "regex"; free-form reports are
+    "llm", including sentences that open with a field keyword but are not commands.
+    Confirmations are "regex" when yes_confirm/no_confirm match them and "llm"
+    otherwise, since only the LLM understands e.g. "go ahead". group is the template
+    a text was filled from, so splits by group never share a phrasing.
+    """
+    import random
+    rng = random.Random(seed)
+    values = {
+        "site": ["Central Plaza", "Downtown Project", "Hardbrücke", "Bahnhofstrasse 12", "North Tower", "Riverside Mall"],
+        "name": ["Anna", "Peter Meier", "Tom", "Lisa Keller", "Marco", "Jonas Frei", "Sarah"],
+        "company": ["BuildRight AG", "Implenia", "Holcim GmbH", "Keller Bau", "Swiss Steel Ltd", "Marti AG"],
+        "role": ["site manager", "supervisor", "foreman", "engineer", "electrician", "crane operator"],
+        "tool": ["excavator", "crane", "concrete mixer", "scaffolding", "drill", "jackhammer"],
+        "service": ["waste removal", "surveying", "electrical installation", "plumbing", "cleaning"],
+        "activity": ["pouring concrete", "laying bricks", "installing windows", "excavation", "roof work"],
+        "issue": ["water leak in basement", "delayed delivery", "broken scaffolding", "missing permits"],
+        "time": ["full day", "morning", "8 hours", "half day", "afternoon"],
+        "weather": ["sunny", "rainy", "cloudy", "windy and cold", "light snow"],
+        "impression": ["good progress", "productive", "behind schedule", "excellent"],
+        "comment": ["check the crane tomorrow", "order more cement", "safety meeting on friday"],
+        "field": ["people", "companies", "tools", "services", "activities", "issues", "roles", "weather", "time", "comments"],
+        "category": ["progress", "safety", "quality control", "handover"],
+        "segment": ["3", "5", "A", "north wing", "12"],
+    }
+    regex_templates = [
+        "site {site}", "add site {site}", "site: {site}", "location {site}", "project {site}",
+        "segment {segment}", "section {segment}", "category {category}", "segment {segment} category {category}",
+        "company {company}", "add company {company}", "companies {company} and {company}", "firm {company}",
+        "add {name} as {role}", "{name} as {role}", "{name} is {role}", "supervisor {name}", "roles: {name} ({role})",
+        "people {name}", "add people {name}, {name}", "persons {name} and {name}",
+        "tool {tool}", "tools {tool}, {tool}", "add tool {tool}",
+        "service {service}", "services {service}", "add service {service}",
+        "activity {activity}", "activities {activity}, {activity}", "add activity {activity}",
+        "issue {issue}", "issues {issue}", "add issue {issue}", "problem {issue}",
+        "time {time}", "weather {weather}", "impression {impression}", "comments {comment}", "comment {comment}",
+        "time: {time}", "weather: {weather}", "impression: {impression}", "issue: {issue}", "activities: {activity}",
+        "delete {name}", "remove {company}", "delete {field}", "remove {name} from {field}", "delete {tool} from tools",
+        "clear {field}", "delete entire {field}", "{field} none",
+        "correct {name} to {name}", "correct spelling of {company} to {company}", "correct spelling {site}",
+        "update {field} to {weather}", "change weather to {weather}", "set time to {time}",
+        "export pdf", "export", "export report", "generate report", "pdf", "status", "undo", "undo last",
+        "undo last change", "reset", "new report", "start over", "help", "help on {field}", "summary",
+        "summarize", "detailed report", "full report", "digest", "weekly digest",
+    ]
+    llm_templates = [
+        "today we were at {site} with {name} and {name} from {company}, the weather was {weather} and we did {activity}",
+        "{name} mentioned that there is a {issue}, we should check it tomorrow",
+        "the crew from {company} arrived late because of traffic and then started {activity}",
+        "we finished {activity} and found a {issue}, {name} was acting as {role} all day",
+        "overall it was a {impression} day, {weather}, and {company} delivered the {tool}",
+        "hey so I'm at {site} right now and {name} from {company} is here doing {service}",
+        "the guys spent the {time} on {activity} but the {tool} broke down around noon",
+        "{company} and {company} were on site, {name} supervised, we had {issue} again",
+        "it was {weather} so we couldn't do {activity}, instead we focused on {service}",
+        "quick update from {site}: {activity} is done, {issue} still open, {name} will follow up",
+        "I think {name} should be the {role} from now on since {name} is leaving",
+        "we need to talk about the {issue} because it keeps delaying {activity}",
+        "can you note that {company} brought a {tool} and {name} operated it",
+        "this morning {name} and {name} started with {activity} and later the {service} team came",
+        "so basically the {issue} got worse and we had to stop {activity} for the {time}",
+    ]
+    # Free-form sentences that open like a command; the patterns misread these
+    llm_boundary_templates = [
+        "project is delayed due to {weather} weather and the {tool} broke down",
+        "site {site} was closed for the {time} because of the {issue}",
+        "location {site} had no power so {name} sent everyone home",
+        "people {name} and {name} worked with the {tool} all day",
+        "people on site today were {name} and {name} from {company}",
+        "persons from {company} left early because of the {issue}",
+        "section {segment} is finished",
+        "segment {segment} was finished today and {name} checked it",
+        "companies {company} and {company} were late again because of the {issue}",
+        "company {company} says the {tool} will only arrive next week",
+        "activities {activity} and {activity}, issues {issue}",
+        "activity {activity} stopped when the {issue} was found",
+        "tools {tool} and {tool} were broken so {name} called {company}",
+        "issues with the {tool} again, {name} says it needs {service}",
+        "weather was {weather} so we stopped {activity} early",
+        "time was short because {company} arrived late",
+        "category {category} needs another look since {name} found a {issue}",
+        "services from {company} are finished but the {issue} is still there",
+    ]
+    confirm_examples = [
+        "yes", "yes please", "yeah", "yep", "yup", "sure", "ok", "okay", "confirm", "y", "ja", "jep",
+        "go ahead", "do it", "that's right", "correct", "right", "absolutely", "of course", "yes do it",
+        "no", "nope", "nah", "no thanks", "n", "nein", "negative", "cancel", "not now", "don't", "never mind",
+        "stop", "no, keep it", "yes, reset", "ok go",
+    ]
+    
+    def fill(template: str) -> str:
+        return re.sub(r'\{(\w+)\}', lambda m: rng.choice(values[m.group(1)]), template)
+    
+    examples = []
+    for template in regex_templates:
+        for _ in range(8):
+            text = fill(template)
+            examples.append((text if rng.random() < 0.7 else text.capitalize(), "regex", template))
+    for template in llm_templates + llm_boundary_templates:
+        for _ in range(12):
+            text = fill(template)
+            examples.append((text if rng.random() < 0.5 else text.capitalize(), "llm", template))
+    for text in confirm_examples:
+        confirm_patterns = (FIELD_PATTERNS["yes_confirm"], FIELD_PATTERNS["no_confirm"])
+        label = "regex" if any(re.match(pattern, text, re.IGNORECASE) for pattern in confirm_patterns) else "llm"
+        examples.extend((variant, label, text) for variant in (text, text.capitalize(), text + "."))
+    return examples
+
+def intent_training_examples(seed: int = 7) -> List[Tuple[str, str]]:
+    """The intent corpus as (text, label) pairs"""
+    return [(text, label) for text, label, _ in intent_corpus(seed)]
+
+def split_intent_corpus(seed: int = 7) -> Dict[str, List[Tuple[str, str]]]:
+    """Train (60%), calibration (20%) and test (20%) splits of the corpus, by template"""
+    splits: Dict[str, List[Tuple[str, str]]] = {"train": [], "calibration": [], "test": []}
+    for text, label, group in intent_corpus(seed):
+        bucket = zlib.crc32(f"{seed}:{group}".encode()) % 10
+        splits["train" if bucket < 6 else "calibration" if bucket < 8 else "test"].append((text, label))
+    return splits
+
+class IntentClassifier:
+    """Multinomial naive Bayes over character n-grams.
+    
+    Pure Python so it adds no dependency; the trained model is a JSON artifact
+    (INTENT_MODEL_PATH) loaded at startup.
+    """
+    
+    def __init__(self, ngram_range: Tuple[int, int] = (2, 4), alpha: float = 0.5):
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        # Naive Bayes counts every overlapping n-gram as independent evidence, which pushes
+        # raw posteriors to 0 or 1; scores are divided by this before normalizing
+        self.temperature = 1.0
+        self.class_log_prior: Dict[str, float] = {}
+        self.feature_log_prob: Dict[str, Dict[str, float]] = {}
+        self.unseen_log_prob: Dict[str, float] = {}
+    
+    def ngrams(self, text: str) -> List[str]:
+        padded = f" {' '.join(text.lower().split())} "
+        low, high = self.ngram_range
+        return [padded[i:i + n] for n in range(low, high + 1) for i in range(len(padded) - n + 1)]
+    
+    def fit(self, examples: List[Tuple[str, str]], min_count: int = 2) -> "IntentClassifier":
+        counts = {label: defaultdict(int) for label in INTENT_LABELS}
+        documents = defaultdict(int)
+        for text, label in examples:
+            documents[label] += 1
+            for gram in self.ngrams(text):
+                counts[label][gram] += 1
+        
+        totals = defaultdict(int)
+        for label_counts in counts.values():
+            for gram, count in label_counts.items():
+                totals[gram] += count
+        vocabulary = {gram for gram, count in totals.items() if count >= min_count}
+        
+        for label in INTENT_LABELS:
+            self.class_log_prior[label] = math.log(documents[label] / len(examples))
+            label_total = sum(counts[label][gram] for gram in vocabulary) + self.alpha * len(vocabulary)
+            # Only n-grams seen for the label are stored; the rest share the smoothed unseen value
+            self.feature_log_prob[label] = {
+                gram: round(math.log((counts[label][gram] + self.alpha) / label_total), 4)
+                for gram in vocabulary if counts[label][gram]
+            }
+            self.unseen_log_prob[label] = round(math.log(self.alpha / label_total), 4)
+        self.vocabulary = vocabulary
+        return self
+    
+    def scores(self, text: str) -> Dict[str, float]:
+        """Unnormalized log posterior of each label"""
+        grams = [gram for gram in self.ngrams(text) if gram in self.vocabulary]
+        scores = {}
+        for label in INTENT_LABELS:
+            label_probs = self.feature_log_prob[label]
+            unseen = self.unseen_log_prob[label]
+            scores[label] = self.class_log_prior[label] + sum(label_probs.get(gram, unseen) for gram in grams)
+        return scores
+    
+    @staticmethod
+    def _probabilities(scores: Dict[str, float], temperature: float) -> Dict[str, float]:
+        top = max(scores.values())
+        weights = {label: math.exp((score - top) / temperature) for label, score in scores.items()}
+        total = sum(weights.values())
+        return {label: weight / total for label, weight in weights.items()}
+    
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return the most likely label and its calibrated probability"""
+        probabilities = self._probabilities(self.scores(text), self.temperature)
+        best = max(probabilities, key=probabilities.get)
+        return best, probabilities[best]
+    
+    def calibrate(self, examples: List[Tuple[str, str]]) -> "IntentClassifier":
+        """Pick the temperature with the lowest log loss on examples held out from fit"""
+        scored = [(self.scores(text), label) for text, label in examples]
+        
+        def log_loss(temperature: float) -> float:
+            return -sum(math.log(max(self._probabilities(scores, temperature)[label], 1e-12))
+                        for scores, label in scored)
+        
+        self.temperature = min((1.25 ** step for step in range(40)), key=log_loss)
+        return self
+    
+    def evaluate(self, examples: List[Tuple[str, str]], min_confidence: float) -> Dict[str, Any]:
+        """Routing quality at a confidence threshold: a "regex" prediction below it goes to the LLM"""
+        routed = [(label, predicted if predicted == "llm" or probability >= min_confidence else "llm")
+                  for (text, label), (predicted, probability) in
+                  ((example, self.predict(example[0])) for example in examples)]
+        to_regex = [label for label, route in routed if route == "regex"]
+        regex_total = sum(1 for label, _ in routed if label == "regex")
+        llm_total = len(routed) - regex_total
+        return {
+            "examples": len(routed),
+            "accuracy": round(sum(label == route for label, route in routed) / len(routed), 3),
+            # Free-form text sent to the patterns loses its extraction; this is the costly error
+            "llm_sent_to_regex": round(to_regex.count("llm") / llm_total, 3) if llm_total else 0.0,
+            # Commands that still reach the LLM only cost a call
+            "regex_kept_from_llm": round(to_regex.count("regex") / regex_total, 3) if regex_total else 0.0,
+        }
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": 2,
+            "ngram_range": list(self.ngram_range),
+            "alpha": self.alpha,
+            "temperature": self.temperature,
+            "class_log_prior": self.class_log_prior,
+            "feature_log_prob": self.feature_log_prob,
+            "unseen_log_prob": self.unseen_log_prob,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IntentClassifier":
+        if data.get("version") != 2:
+            raise ValueError(f"Unsupported intent model version {data.get('version')}")
+        model = cls(tuple(data["ngram_range"]), data["alpha"])
+        model.temperature = data["temperature"]
+        model.class_log_prior = data["class_log_prior"]
+        model.feature_log_prob = data["feature_log_prob"]
+        model.unseen_log_prob = data["unseen_log_prob"]
+        model.vocabulary = set().union(*(set(probs) for probs in model.feature_log_prob.values()))
+        return model
+
+def load_intent_classifier(path: str) -> IntentClassifier:
+    """Load the shipped model, or train one from the built-in corpus if it is missing"""
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                model = IntentClassifier.from_dict(json.load(f))
+            log_event("intent_model_loaded", path=path, features=len(model.vocabulary))
+            return model
+        except (OSError, ValueError, KeyError) as e:
+            log_event("intent_model_load_error", path=path, error=str(e))
+    model = train_intent_classifier()
+    log_event("intent_model_trained", features=len(model.vocabulary))
+    return model
+
+def train_intent_classifier(seed: int = 7) -> IntentClassifier:
+    """Fit on the training split and calibrate on the calibration split"""
+    splits = split_intent_corpus(seed)
+    return IntentClassifier().fit(splits["train"]).calibrate(splits["calibration"])
+
+class IntentRouter:
+    """Routes inputs to the regex patterns or the LLM and tracks the LLM call rate"""
+    
+    def __init__(self, classifier: IntentClassifier, min_confidence: float):
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.routes = defaultdict(int)
+        self.messages = 0
+        self.llm_calls = 0
+    
+    def route(self, text: str) -> str:
+        """'regex' skips the LLM; uncertain predictions go to the LLM as before"""
+        label, probability = self.classifier.predict(text)
+        route = label if label == "llm" or probability >= self.min_confidence else "llm"
+        with self._lock:
+            self.routes[route] += 1
+        log_event("intent_routed", route=route, predicted=label, probability=round(probability, 3))
+        return route
+    
+    def record_message(self) -> None:
+        with self._lock:
+            self.messages += 1
+    
+    def record_llm_call(self) -> None:
+        with self._lock:
+            self.llm_calls += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routes": dict(self.routes),
+                "messages": self.messages,
+                "llm_calls": self.llm_calls,
+                "llm_calls_per_message": round(self.llm_calls / self.messages, 3) if self.messages else 0.0,
+            }
+
+intent_router = IntentRouter(load_intent_classifier(CONFIG["INTENT_MODEL_PATH"]), CONFIG["INTENT_MIN_CONFIDENCE"])
+
 # --- Errors and Exceptions ---
 class BotError(Exception):
     """Base exception for bot-related errors"""
@@ -1074,6 +2208,14 @@ class TranscriptionError(BotError):
     """Raised when voice transcription fails"""
     pass
 
+class ServiceUnavailableError(BotError):
+    """Raised when an OpenAI operation is skipped because its circuit breaker is open"""
+    pass
+
+class DownloadTooLargeError(BotError):
+    """Raised when a Telegram file is larger than its download limit"""
+    pass
+
 
 
 # --- Session Management ---
@@ -1228,7 +2370,237 @@ def blank_report() -> Dict[str, Any]:
 
 # Part 4
 # --- OpenAI Initialization ---
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, timeout=CONFIG["OPENAI_TIMEOUT"])
+
+# --- Circuit Breakers ---
+# Connection problems, timeouts, rate limits and 5xx responses count as outage signals;
+# bad requests are our fault and never open a breaker
+OPENAI_OUTAGE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+class CircuitBreaker:
+    """Per-operation breaker: opens after consecutive outage errors, closes once a background probe succeeds"""
+    
+    def __init__(self, name: str, probe: Callable[[], Any], failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.times_opened = 0
+        self.rejected_calls = 0
+        self._lock = threading.Lock()
+        self._probing = False
+    
+    def allow(self) -> bool:
+        """Whether calls may go through; rejected calls are counted"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            self.rejected_calls += 1
+            return False
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                log_event("circuit_closed", operation=self.name)
+            self.state = "closed"
+            self.opened_at = None
+    
+    def record_failure(self, error: Exception) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            if self.state == "open" or self.consecutive_failures < self.failure_threshold:
+                return
+            self.state = "open"
+            self.opened_at = time()
+            self.times_opened += 1
+            start_probe = not self._probing
+            self._probing = True
+        log_event("circuit_opened", operation=self.name, error=self.last_error)
+        if start_probe:
+            threading.Thread(target=self._probe_until_recovered, name=f"probe-{self.name}", daemon=True).start()
+    
+    def _probe_until_recovered(self) -> None:
+        """Background loop: wait, probe, back off until the service answers again"""
+        delay = self.reset_timeout
+        while True:
+            sleep(delay)
+            with self._lock:
+                self.state = "half_open"
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.state = "open"
+                    self.last_error = f"{type(e).__name__}: {e}"[:200]
+                log_event("circuit_probe_failed", operation=self.name, error=self.last_error)
+                delay = min(delay * 2, CONFIG["CIRCUIT_MAX_PROBE_INTERVAL"])
+                continue
+            with self._lock:
+                self._probing = False
+            self.record_success()
+            return
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_s": round(time() - self.opened_at, 1) if self.opened_at else None,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected_calls,
+                "last_error": self.last_error,
+            }
+
+def _new_breaker(name: str, model_key: str) -> CircuitBreaker:
+    # Retrieving the model is the cheapest request that exercises the same API and credentials
+    return CircuitBreaker(
+        name,
+        probe=lambda: client.models.retrieve(CONFIG[model_key] if model_key in CONFIG else model_key),
+        failure_threshold=CONFIG["CIRCUIT_FAILURE_THRESHOLD"],
+        reset_timeout=CONFIG["CIRCUIT_RESET_TIMEOUT"],
+    )
+
+openai_breakers: Dict[str, CircuitBreaker] = {
+    "nlp_extraction": _new_breaker("nlp_extraction", "NLP_MODEL"),
+    "gpt_extraction": _new_breaker("gpt_extraction", "OPENAI_MODEL"),
+    "transcription": _new_breaker("transcription", "whisper-1"),
+}
+
+# --- OpenAI Usage Accounting ---
+# Chat the current request is for; set by the webhook so every OpenAI call can be attributed
+current_chat_id: contextvars.ContextVar = contextvars.ContextVar("current_chat_id", default=None)
+
+def _empty_usage() -> Dict[str, Any]:
+    return {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "audio_seconds": 0.0, "latency_s": 0.0, "max_latency_s": 0.0}
+
+class OpenAIUsageTracker:
+    """Aggregates tokens, audio seconds and latency per operation, per chat and per time window"""
+    
+    def __init__(self, window_seconds: int, window_count: int, latency_samples: int = 500):
+        self.window_seconds = window_seconds
+        self.window_count = window_count
+        self._lock = threading.Lock()
+        self.by_operation: Dict[str, Dict[str, Any]] = defaultdict(_empty_usage)
+        self.by_chat: Dict[str, Dict[str, Any]] = defaultdict(_empty_usage)
+        self.by_model: Dict[str, Dict[str, Any]] = defaultdict(_empty_usage)
+        self.windows: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=latency_samples))
+    
+    @staticmethod
+    def _add(bucket: Dict[str, Any], prompt_tokens: int, completion_tokens: int,
+             audio_seconds: float, latency: float, error: bool) -> None:
+        bucket["calls"] += 1
+        bucket["errors"] += int(error)
+        bucket["prompt_tokens"] += prompt_tokens
+        bucket["completion_tokens"] += completion_tokens
+        bucket["audio_seconds"] = round(bucket["audio_seconds"] + audio_seconds, 2)
+        bucket["latency_s"] = round(bucket["latency_s"] + latency, 4)
+        bucket["max_latency_s"] = round(max(bucket["max_latency_s"], latency), 4)
+    
+    def record(self, operation: str, model: str, latency: float, usage: Any = None,
+               audio_seconds: float = 0.0, error: bool = False, chat_id: Optional[str] = None) -> None:
+        """Record one OpenAI call; usage is the response's usage object, if any"""
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        chat_id = chat_id or current_chat_id.get() or "unattributed"
+        window_start = int(time() // self.window_seconds * self.window_seconds)
+        with self._lock:
+            window = self.windows.get(window_start)
+            if window is None:
+                window = self.windows[window_start] = _empty_usage()
+                while len(self.windows) > self.window_count:
+                    self.windows.popitem(last=False)
+            for bucket in (self.by_operation[operation], self.by_chat[chat_id], self.by_model[model], window):
+                self._add(bucket, prompt_tokens, completion_tokens, audio_seconds, latency, error)
+            self._latencies[operation].append(latency)
+        log_event("openai_usage", operation=operation, model=model, chat_id=chat_id,
+                  prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                  audio_seconds=audio_seconds, latency_ms=round(latency * 1000), error=error)
+    
+    def _latency_percentiles(self, operation: str) -> Dict[str, float]:
+        samples = sorted(self._latencies[operation])
+        if not samples:
+            return {}
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 4)
+        return {"p50_s": pick(0.5), "p95_s": pick(0.95)}
+    
+    def summary(self) -> Dict[str, Any]:
+        """Totals and per-operation figures, small enough for /health"""
+        with self._lock:
+            total = _empty_usage()
+            for operation_usage in self.by_operation.values():
+                for key in ("calls", "errors", "prompt_tokens", "completion_tokens"):
+                    total[key] += operation_usage[key]
+                total["audio_seconds"] = round(total["audio_seconds"] + operation_usage["audio_seconds"], 2)
+                total["latency_s"] = round(total["latency_s"] + operation_usage["latency_s"], 4)
+                total["max_latency_s"] = max(total["max_latency_s"], operation_usage["max_latency_s"])
+            return {
+                "total": total,
+                "by_operation": {operation: dict(usage, **self._latency_percentiles(operation))
+                                 for operation, usage in self.by_operation.items()},
+            }
+    
+    def report(self, chat_id: Optional[str] = None, top: int = 20) -> Dict[str, Any]:
+        """Full breakdown for the admin endpoint; chats are sorted by total tokens"""
+        result = self.summary()
+        with self._lock:
+            if chat_id:
+                # .get, so querying an unknown chat does not add an empty entry for it
+                usage = self.by_chat.get(chat_id)
+                chats = {chat_id: dict(usage)} if usage else {}
+            else:
+                chats = self.by_chat
+            ranked = sorted(chats.items(), key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"],
+                            reverse=True)
+            result.update({
+                "window_seconds": self.window_seconds,
+                "windows": [dict(usage, start=datetime.fromtimestamp(start).isoformat())
+                            for start, usage in self.windows.items()],
+                "by_model": {model: dict(usage) for model, usage in self.by_model.items()},
+                "by_chat": {chat: dict(usage) for chat, usage in ranked[:top]},
+                "chat_count": len(self.by_chat),
+            })
+        return result
+
+openai_usage = OpenAIUsageTracker(CONFIG["USAGE_WINDOW_SECONDS"], CONFIG["USAGE_WINDOW_COUNT"])
+
+def openai_available(operation: str) -> bool:
+    """False while the operation's breaker is open or probing"""
+    return openai_breakers[operation].state == "closed"
+
+def call_openai(operation: str, func: Callable, *args, audio_seconds: float = 0.0, **kwargs) -> Any:
+    """Call an OpenAI client method through the operation's circuit breaker and record its usage.
+    
+    Streaming calls are recorded, in the usage and the breaker, by the caller once the
+    stream is consumed: an outage can still break the stream after create() returns.
+    """
+    breaker = openai_breakers[operation]
+    if not breaker.allow():
+        raise ServiceUnavailableError(f"OpenAI {operation} is unavailable (circuit open)")
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.record_openai_request(operation, kwargs)
+    model = kwargs.get("model", "unknown")
+    started = time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        openai_usage.record(operation, model, time() - started, audio_seconds=audio_seconds, error=True)
+        if isinstance(e, OPENAI_OUTAGE_ERRORS):
+            breaker.record_failure(e)
+        raise
+    if not kwargs.get("stream"):
+        breaker.record_success()
+        openai_usage.record(operation, model, time() - started, usage=getattr(result, "usage", None),
+                            audio_seconds=audio_seconds)
+    return result
 
 # --- GPT Prompt ---
 GPT_PROMPT = """
@@ -1293,11 +2665,15 @@ signal.signal(signal.SIGTERM, handle_shutdown)
 signal.signal(signal.SIGINT, handle_shutdown)
 
 # --- Telegram API ---
+def telegram_api_url(method: str) -> str:
+    """URL of a Bot API method on TELEGRAM_API_URL"""
+    return f"{CONFIG['TELEGRAM_API_URL'].rstrip('/')}/bot{TELEGRAM_TOKEN}/{method}"
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
-def send_message(chat_id: str, text: str) -> None:
-    """Send message to Telegram with enhanced error handling"""
+def send_message(chat_id: str, text: str) -> Optional[int]:
+    """Send message to Telegram with enhanced error handling; returns the message id"""
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+        url = telegram_api_url("sendMessage")
         payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
         
         # First try with Markdown
@@ -1326,6 +2702,10 @@ def send_message(chat_id: str, text: str) -> None:
         
         response.raise_for_status()
         log_event("message_sent", chat_id=chat_id, text=text[:50])
+        try:
+            return response.json()["result"]["message_id"]
+        except (ValueError, KeyError, TypeError):
+            return None
     except requests.RequestException as e:
         log_event("send_message_error", chat_id=chat_id, error=str(e))
         # Try with simpler content if all else fails
@@ -1348,61 +2728,602 @@ def send_message(chat_id: str, text: str) -> None:
                 pass
             raise
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
-def get_telegram_file_path(file_id: str) -> str:
-    """Get file path from Telegram"""
+def edit_message(chat_id: str, message_id: int, text: str) -> bool:
+    """Replace the text of a message sent earlier, without formatting"""
+    try:
+        url = telegram_api_url("editMessageText")
+        plain_text = text.replace("**", "").replace("`", "")[:4000]
+        response = requests.post(url, json={"chat_id": chat_id, "message_id": message_id, "text": plain_text})
+        response.raise_for_status()
+        return True
+    except requests.RequestException as e:
+        log_event("edit_message_error", chat_id=chat_id, error=str(e))
+        return False
+
+class ProgressiveSummary:
+    """Shows a report preview that fills in while a streamed extraction is running.
+    
+    Fields are applied to a copy of the report, so the session is only changed by
+    the final merge_data once the whole extraction is known to be confident.
+    Telegram edits are throttled to one per NLP_STREAM_UPDATE_INTERVAL seconds.
+    """
+    
+    def __init__(self, chat_id: str, report_data: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.preview = copy.deepcopy(report_data)
+        self.fields: List[str] = []
+        self._last_update = 0.0
+        self._pending = False
+        self.message_id = send_message(chat_id, "📝 Reading your report...")
+    
+    def add_field(self, key: str, value: Any, structured: bool) -> None:
+        """Apply one streamed field; structured is the format request_json_completion settled on"""
+        for field, field_value in normalize_nlp_output({key: value}, structured).items():
+            if field in LIST_FIELDS and isinstance(field_value, list):
+                self.preview[field] = self.preview.get(field, []) + [
+                    item for item in field_value if item not in self.preview.get(field, [])]
+            elif field_value:
+                self.preview[field] = field_value
+            self.fields.append(field)
+        self._pending = True
+        if time() - self._last_update >= CONFIG["NLP_STREAM_UPDATE_INTERVAL"]:
+            self.flush()
+    
+    def flush(self) -> None:
+        if not self._pending or self.message_id is None:
+            return
+        edit_message(self.chat_id, self.message_id, f"📝 Reading your report...\n\n{summarize_report(self.preview)}")
+        self._last_update = time()
+        self._pending = False
+    
+    def discard(self) -> None:
+        """Replace the preview once the extraction turns out too unsure to be merged"""
+        self._pending = False
+        if self.message_id is not None:
+            edit_message(self.chat_id, self.message_id,
+                         "⚠️ I could not extract this report reliably, so the preview was discarded and nothing from it was saved.")
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
+def get_telegram_file_path(file_id: str) -> str:
+    """Get the download URL of a file from Telegram.
+    
+    A Bot API server in local mode answers getFile with an absolute path on its own
+    disk, which is returned as is for download_telegram_file to open directly.
+    """
+    try:
+        url = telegram_api_url("getFile")
+        response = requests.get(url, params={"file_id": file_id}, timeout=CONFIG["DOWNLOAD_TIMEOUT"])
+        response.raise_for_status()
+        file_path = response.json()["result"]["file_path"]
+        log_event("get_telegram_file_path", file_id=file_id)
+        if CONFIG["TELEGRAM_LOCAL_MODE"] and os.path.isabs(file_path):
+            return file_path
+        return f"{CONFIG['TELEGRAM_API_URL'].rstrip('/')}/file/bot{TELEGRAM_TOKEN}/{file_path}"
+    except requests.RequestException as e:
+        log_event("get_telegram_file_path_error", file_id=file_id, error=str(e))
+        raise
+
+class TelegramDownload:
+    """A downloaded file, positioned at the start, with its size and SHA-256"""
+    
+    def __init__(self, file: BinaryIO, size: int, sha256: str):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TelegramDownload":
+        return cls(io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+    
+    def read(self) -> bytes:
+        """The whole file as bytes, for consumers that can't take a file object"""
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(0)
+        return data
+    
+    def close(self) -> None:
+        self.file.close()
+    
+    def __enter__(self) -> "TelegramDownload":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def open_local_telegram_file(path: str, max_bytes: int) -> TelegramDownload:
+    """Memory-map a file stored by a local-mode Bot API server instead of downloading it.
+    
+    The mapping is read-only and shared with the page cache, so hashing it and handing
+    it to Whisper or ReportLab makes no copy of its own.
+    """
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise DownloadTooLargeError(f"File is {size} bytes, the limit is {max_bytes}")
+    with open(path, "rb") as f:
+        if not size:
+            return TelegramDownload(io.BytesIO(), 0, hashlib.sha256().hexdigest())
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    log_event("telegram_file_mapped", size_bytes=size)
+    return TelegramDownload(mapped, size, hashlib.sha256(mapped).hexdigest())
+
+def download_telegram_file(file_url: str, max_bytes: int) -> TelegramDownload:
+    """Stream a file from the Telegram file server without holding it in memory twice.
+    
+    Files whose Content-Length fits in DOWNLOAD_SPOOL_MAX_BYTES are written to a BytesIO
+    (which ReportLab and the OpenAI client read without copying); larger or unsized ones
+    to a spooled temp file that moves to disk past that size. The SHA-256 is computed
+    while streaming. Raises DownloadTooLargeError as soon as max_bytes is exceeded.
+    Local paths from a local-mode Bot API server are memory-mapped instead.
+    """
+    if CONFIG["TELEGRAM_LOCAL_MODE"] and os.path.isabs(file_url):
+        return open_local_telegram_file(file_url, max_bytes)
+    with requests.get(file_url, stream=True, timeout=CONFIG["DOWNLOAD_TIMEOUT"]) as response:
+        response.raise_for_status()
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > max_bytes:
+            raise DownloadTooLargeError(f"File is {declared} bytes, the limit is {max_bytes}")
+        if declared and declared <= CONFIG["DOWNLOAD_SPOOL_MAX_BYTES"]:
+            target = io.BytesIO()
+        else:
+            target = tempfile.SpooledTemporaryFile(max_size=CONFIG["DOWNLOAD_SPOOL_MAX_BYTES"])
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=CONFIG["DOWNLOAD_CHUNK_BYTES"]):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DownloadTooLargeError(f"File exceeds the limit of {max_bytes} bytes")
+                digest.update(chunk)
+                target.write(chunk)
+        except Exception:
+            target.close()
+            raise
+    target.seek(0)
+    log_event("telegram_file_downloaded", size_bytes=size, spooled=not isinstance(target, io.BytesIO))
+    return TelegramDownload(target, size, digest.hexdigest())
+            
+# Normalized transcriptions and their confidence, keyed by "<backend>:uid:<file_unique_id>" and
+# "<backend>:sha:<audio sha256>", so one backend's transcripts are never served for another's chats
+transcription_cache = NLPResultCache(CONFIG["TRANSCRIPTION_CACHE_ENTRIES"], CONFIG["TRANSCRIPTION_CACHE_TTL"],
+                                     CONFIG["TRANSCRIPTION_CACHE_FILE"], table="transcription_cache")
+
+def transcription_cache_key(backend_name: str, kind: str, value: str) -> str:
+    return f"{backend_name}:{kind}:{value}"
+
+def cached_transcription(file_unique_id: Optional[str], backend_name: str) -> Optional[Tuple[str, float]]:
+    """Earlier transcription of the same Telegram file by the same backend, which needs neither
+    a download nor an API call"""
+    if not file_unique_id:
+        return None
+    cached = transcription_cache.get(transcription_cache_key(backend_name, "uid", file_unique_id))
+    return (cached[0]["text"], cached[1]) if cached else None
+
+# --- Chunked Transcription ---
+# Long voice reports are decoded to 16 kHz mono PCM, cut in the quietest spot near every
+# TRANSCRIPTION_CHUNK_SECONDS and the WAV chunks are transcribed concurrently.
+TRANSCRIPTION_SAMPLE_RATE = 16000
+SILENCE_WINDOW_SECONDS = 0.03
+
+_transcription_executor = ThreadPoolExecutor(max_workers=CONFIG["TRANSCRIPTION_WORKERS"], thread_name_prefix="transcription")
+
+def decode_audio_pcm(audio: bytes) -> Optional[Tuple[bytes, int]]:
+    """16-bit mono PCM and its sample rate, or None if the audio can't be decoded here.
+    
+    WAV is read directly; anything else (Telegram sends OGG/Opus) needs ffmpeg on the PATH.
+    """
+    if audio[:4] == b"RIFF":
+        try:
+            with wave.open(io.BytesIO(audio)) as wav:
+                if wav.getnchannels() == 1 and wav.getsampwidth() == 2:
+                    return wav.readframes(wav.getnframes()), wav.getframerate()
+        except wave.Error:
+            pass
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+             "-ac", "1", "-ar", str(TRANSCRIPTION_SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+            input=audio, capture_output=True, timeout=60, check=True
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        log_event("audio_decode_failed", error=str(e))
+        return None
+    return result.stdout, TRANSCRIPTION_SAMPLE_RATE
+
+def _window_energies(samples: array, window: int) -> List[float]:
+    """Mean square of every window, estimated from every fourth sample"""
+    energies = []
+    for start in range(0, len(samples) - window + 1, window):
+        part = samples[start:start + window:4]
+        energies.append(sum(sample * sample for sample in part) / len(part))
+    return energies
+
+def _pcm_to_wav(pcm: bytes, rate: int) -> bytes:
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return output.getvalue()
+
+def split_audio_at_silences(audio: bytes, chunk_seconds: float = None) -> List[Tuple[bytes, float]]:
+    """Cut audio into WAV chunks of about chunk_seconds, each ending in the quietest moment
+    within TRANSCRIPTION_SILENCE_SEARCH_SECONDS of its target length.
+    
+    Returns (wav_bytes, seconds) per chunk in order, or an empty list if the audio
+    can't be decoded.
+    """
+    decoded = decode_audio_pcm(audio)
+    if not decoded:
+        return []
+    pcm, rate = decoded
+    chunk_seconds = chunk_seconds or CONFIG["TRANSCRIPTION_CHUNK_SECONDS"]
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    window = max(1, int(rate * SILENCE_WINDOW_SECONDS))
+    energies = _window_energies(samples, window)
+    windows_per_chunk = int(chunk_seconds / SILENCE_WINDOW_SECONDS)
+    search = int(CONFIG["TRANSCRIPTION_SILENCE_SEARCH_SECONDS"] / SILENCE_WINDOW_SECONDS)
+    
+    cuts = [0]
+    # Leave the last chunk alone unless it would be much longer than the target
+    while len(energies) - cuts[-1] > windows_per_chunk * 1.5:
+        target = cuts[-1] + windows_per_chunk
+        low, high = max(cuts[-1] + 1, target - search), min(len(energies), target + search + 1)
+        quietest = min(range(low, high), key=lambda index: (energies[index], abs(index - target)))
+        cuts.append(quietest + 1)
+    
+    chunks = []
+    boundaries = [cut * window for cut in cuts] + [len(samples)]
+    for start, end in zip(boundaries, boundaries[1:]):
+        chunks.append((_pcm_to_wav(samples[start:end].tobytes(), rate), (end - start) / rate))
+    return chunks
+
+# --- Transcription Backends ---
+class TranscriptionBackend(ABC):
+    """Speech-to-text backend used by transcribe_audio"""
+    name = "base"
+    # Whether long notes may be split at silences and sent as WAV chunks
+    supports_chunking = True
+    
+    @abstractmethod
+    def transcribe(self, filename: str, audio: Union[bytes, BinaryIO], mime_type: str, seconds: float) -> str:
+        """Raw transcript of one audio file, given as bytes or a file object at its start"""
+    
+    def available(self) -> bool:
+        return True
+
+class OpenAITranscriptionBackend(TranscriptionBackend):
+    """whisper-1 through the OpenAI API, behind the transcription circuit breaker"""
+    name = "openai"
+    
+    def transcribe(self, filename: str, audio: Union[bytes, BinaryIO], mime_type: str, seconds: float) -> str:
+        response = call_openai(
+            "transcription", client.audio.transcriptions.create,
+            audio_seconds=seconds,
+            model="whisper-1",
+            file=(filename, audio, mime_type)
+        )
+        return response.text.strip()
+    
+    def available(self) -> bool:
+        return openai_available("transcription")
+
+class LocalTranscriptionBackend(TranscriptionBackend):
+    """Whisper on the local CPU via faster-whisper (optional; the model loads on first use)"""
+    name = "local"
+    
+    def __init__(self, model_size: str):
+        self.model_size = model_size
+        self._model = None
+        self._lock = threading.Lock()
+    
+    def _load_model(self):
+        with self._lock:
+            if self._model is None:
+                from faster_whisper import WhisperModel
+                log_event("local_transcription_model_loading", model=self.model_size)
+                self._model = WhisperModel(self.model_size, device="cpu", compute_type="int8")
+            return self._model
+    
+    def transcribe(self, filename: str, audio: Union[bytes, BinaryIO], mime_type: str, seconds: float) -> str:
+        segments, _ = self._load_model().transcribe(io.BytesIO(audio) if isinstance(audio, bytes) else audio)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+    
+    def available(self) -> bool:
+        return importlib.util.find_spec("faster_whisper") is not None
+
+class FixtureTranscriptionBackend(TranscriptionBackend):
+    """Deterministic transcripts looked up by the SHA-256 of the audio, for offline load tests.
+    
+    The fixture file is a JSON object of hex digest to transcript. Audio without an
+    entry gets the default transcript, or fails if there is none.
+    """
+    name = "fixture"
+    # Chunk hashes would never match the recorded ones
+    supports_chunking = False
+    
+    def __init__(self, path: str, default: str = ""):
+        self.path = path
+        self.default = default
+        self.transcripts: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.transcripts = json.load(f)
+    
+    def add(self, audio: bytes, transcript: str) -> None:
+        self.transcripts[hashlib.sha256(audio).hexdigest()] = transcript
+    
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.transcripts, f, indent=2, sort_keys=True)
+    
+    def transcribe(self, filename: str, audio: Union[bytes, BinaryIO], mime_type: str, seconds: float) -> str:
+        digest = hashlib.sha256(audio if isinstance(audio, bytes) else audio.read()).hexdigest()
+        transcript = self.transcripts.get(digest, self.default)
+        if not transcript:
+            raise KeyError(f"No fixture transcript for audio {digest[:12]}")
+        return transcript
+
+transcription_backends: Dict[str, TranscriptionBackend] = {
+    "openai": OpenAITranscriptionBackend(),
+    "local": LocalTranscriptionBackend(CONFIG["LOCAL_WHISPER_MODEL"]),
+    "fixture": FixtureTranscriptionBackend(CONFIG["TRANSCRIPTION_FIXTURE_FILE"], CONFIG["TRANSCRIPTION_FIXTURE_DEFAULT"]),
+}
+
+def _parse_backend_routes(spec: str) -> Dict[str, str]:
+    """Parse "chat_id=backend,chat_id=backend" into {chat_id: backend}"""
+    routes = {}
+    for route in filter(None, (part.strip() for part in spec.split(","))):
+        chat_id, _, backend = route.partition("=")
+        if backend.strip() not in transcription_backends:
+            raise ValueError(f"Unknown transcription backend in TRANSCRIPTION_CHAT_BACKENDS: {route}")
+        routes[chat_id.strip()] = backend.strip()
+    return routes
+
+TRANSCRIPTION_CHAT_ROUTES = _parse_backend_routes(CONFIG["TRANSCRIPTION_CHAT_BACKENDS"])
+for _setting in ("TRANSCRIPTION_BACKEND", "TRANSCRIPTION_SMALL_BACKEND"):
+    if CONFIG[_setting] not in transcription_backends:
+        raise ValueError(f"Unknown transcription backend in {_setting}: {CONFIG[_setting]}")
+
+def select_transcription_backend(chat_id: str = None, audio_size: int = None) -> TranscriptionBackend:
+    """Backend for a voice note: the chat's route, else the small-audio route, else TRANSCRIPTION_BACKEND"""
+    chat_id = chat_id or current_chat_id.get()
+    name = TRANSCRIPTION_CHAT_ROUTES.get(str(chat_id)) if chat_id else None
+    small_max = CONFIG["TRANSCRIPTION_SMALL_MAX_BYTES"]
+    if not name and small_max and audio_size is not None and audio_size <= small_max:
+        name = CONFIG["TRANSCRIPTION_SMALL_BACKEND"]
+    return transcription_backends[name or CONFIG["TRANSCRIPTION_BACKEND"]]
+
+def transcribe_audio(audio: Union[bytes, TelegramDownload], duration: float = 0.0,
+                     backend: TranscriptionBackend = None) -> str:
+    """Normalized transcription of a voice note.
+    
+    Notes longer than TRANSCRIPTION_CHUNK_MIN_SECONDS (or of unknown length) are split at
+    silences and the chunks transcribed concurrently, then stitched back in order; short
+    notes, audio that can't be decoded and backends without chunking get a single request,
+    which uploads a download's file object as is.
+    """
+    download = TelegramDownload.from_bytes(audio) if isinstance(audio, bytes) else audio
+    backend = backend or select_transcription_backend(audio_size=download.size)
+    chunks = []
+    if backend.supports_chunking and (not duration or duration > CONFIG["TRANSCRIPTION_CHUNK_MIN_SECONDS"]):
+        # Decoding needs the whole note in memory anyway
+        chunks = split_audio_at_silences(download.read())
+    if len(chunks) < 2:
+        download.file.seek(0)
+        return normalize_transcription(backend.transcribe("voice.ogg", download.file, "audio/ogg", duration))
+    
+    started = time()
+    futures = [
+        _transcription_executor.submit(contextvars.copy_context().run, backend.transcribe,
+                                       f"voice_{index}.wav", chunk, "audio/wav", seconds)
+        for index, (chunk, seconds) in enumerate(chunks)
+    ]
+    texts = [normalize_transcription(future.result()) for future in futures]
+    log_event("chunked_transcription", backend=backend.name, chunks=len(chunks),
+              elapsed_ms=round((time() - started) * 1000),
+              chunk_seconds=[round(seconds, 1) for _, seconds in chunks])
+    return " ".join(text for text in texts if text)
+
+@contextmanager
+def timed_stage(timings: Optional[Dict[str, float]], name: str) -> Iterator[None]:
+    """Add the wall time of the block, in seconds, to timings[name] (no-op without timings)"""
+    started = time()
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getFile?file_id={file_id}"
-        response = requests.get(url)
-        response.raise_for_status()
-        file_path = response.json()["result"]["file_path"]
-        log_event("get_telegram_file_path", file_id=file_id)
-        return f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}"
-    except requests.RequestException as e:
-        log_event("get_telegram_file_path_error", file_id=file_id, error=str(e))
-        raise
-            
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time() - started
+
+def fetch_voice_audio(file_id: str, timings: Optional[Dict[str, float]] = None) -> TelegramDownload:
+    """Download a voice note from Telegram, streamed and capped at MAX_VOICE_BYTES"""
+    with timed_stage(timings, "get_file"):
+        audio_url = get_telegram_file_path(file_id)
+    with timed_stage(timings, "download"):
+        return download_telegram_file(audio_url, CONFIG["MAX_VOICE_BYTES"])
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
-def transcribe_voice(file_id: str) -> Tuple[str, float]:
-    """Transcribe voice message with enhanced confidence scoring"""
+def transcribe_voice(file_id: str, duration: float = 0.0, file_unique_id: Optional[str] = None,
+                     timings: Optional[Dict[str, float]] = None, file_size: int = 0) -> Tuple[str, float]:
+    """Transcribe voice message with enhanced confidence scoring.
+    
+    Forwarded notes and redelivered updates keep their file_unique_id and are answered
+    from the transcription cache; re-uploaded audio is recognized by its hash after
+    the download. The backend is chosen from the declared file_size (or, without one,
+    the downloaded size) and cache entries are kept per backend. Stage wall times are
+    added to timings when it is given.
+    """
     try:
-        audio_url = get_telegram_file_path(file_id)
-        audio_response = requests.get(audio_url)
-        audio_response.raise_for_status()
-        audio = audio_response.content
-        
-        log_event("audio_fetched", size_bytes=len(audio))
-        
-        # Get transcription
-        response = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=("voice.ogg", audio, "audio/ogg")
-        )
-        
-        text = response.text.strip()
+        backend = select_transcription_backend(audio_size=file_size or None)
+        with timed_stage(timings, "cache_lookup"):
+            cached = cached_transcription(file_unique_id, backend.name)
+        if cached:
+            log_event("transcription_cache_hit", source="file_unique_id")
+            return cached
+        
+        with fetch_voice_audio(file_id, timings) as audio:
+            log_event("audio_fetched", size_bytes=audio.size)
+            
+            if not file_size:
+                backend = select_transcription_backend(audio_size=audio.size)
+            uid_key = transcription_cache_key(backend.name, "uid", file_unique_id) if file_unique_id else None
+            with timed_stage(timings, "cache_lookup"):
+                audio_key = transcription_cache_key(backend.name, "sha", audio.sha256)
+                cached = transcription_cache.get(audio_key)
+            if cached:
+                log_event("transcription_cache_hit", source="audio_hash")
+                if uid_key:
+                    transcription_cache.put(uid_key, cached[0], cached[1])
+                return cached[0]["text"], cached[1]
+            
+            # Get the normalized transcription, in parallel chunks for long notes
+            with timed_stage(timings, "transcribe"):
+                text = transcribe_audio(audio, duration, backend)
         if not text:
             log_event("transcription_empty")
             return "", 0.0
         
-        # Normalize text
-        text = normalize_transcription(text)
-        
         # Enhanced confidence calculation
-        confidence = calculate_enhanced_confidence(text, len(audio))
+        with timed_stage(timings, "confidence"):
+            confidence = calculate_enhanced_confidence(text, audio.size)
+        
+        transcription_cache.put(audio_key, {"text": text}, confidence)
+        if uid_key:
+            transcription_cache.put(uid_key, {"text": text}, confidence)
         
-        log_event("transcription_success", text=text, confidence=confidence)
+        log_event("transcription_success", text=text, confidence=confidence, backend=backend.name)
         return text, confidence
         
+    except DownloadTooLargeError as e:
+        log_event("voice_download_too_large", file_id=file_id, error=str(e))
+        return "", 0.0
     except Exception as e:
         log_event("transcription_failed", error=str(e))
         return "", 0.0
 
+# --- Voice Pipeline ---
+_voice_io_executor = ThreadPoolExecutor(max_workers=CONFIG["VOICE_IO_WORKERS"], thread_name_prefix="voice-io")
+class ChatLocks:
+    """Reentrant locks serializing the session updates of each chat.
+    
+    A chat's lock exists only while a thread holds or waits for it: every holder and
+    waiter is counted, and the last one to leave removes it, so idle chats keep none.
+    """
+    
+    def __init__(self):
+        self._guard = threading.Lock()
+        # chat_id -> [lock, holders and waiters]
+        self._locks: Dict[str, List[Any]] = {}
+    
+    @contextmanager
+    def hold(self, chat_id: str) -> Iterator[None]:
+        chat_id = str(chat_id)
+        with self._guard:
+            entry = self._locks.setdefault(chat_id, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[chat_id]
+    
+    def __len__(self) -> int:
+        with self._guard:
+            return len(self._locks)
+
+chat_locks = ChatLocks()
+
+def chat_lock(chat_id: str) -> ContextManager[None]:
+    """Hold the lock serializing session updates of one chat for a with block"""
+    return chat_locks.hold(chat_id)
+
+def with_chat_lock(func: Callable) -> Callable:
+    """Hold the chat's lock for the call; the first argument is the chat id"""
+    @wraps(func)
+    def wrapper(chat_id, *args, **kwargs):
+        with chat_lock(chat_id):
+            return func(chat_id, *args, **kwargs)
+    return wrapper
+
+class VoicePipeline:
+    """One voice update as explicit stages with per-stage timings.
+    
+    Independent network stages overlap: the acknowledgment is sent on the voice I/O
+    pool while getFile, the download and Whisper run in the transcription future.
+    None of that holds the chat's session lock; it is taken with lock_session once the
+    transcript is there and held until the command has been handled.
+    """
+    
+    def __init__(self, chat_id: str, voice: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.file_id = voice["file_id"]
+        self.file_unique_id = voice.get("file_unique_id")
+        self.duration = voice.get("duration", 0)
+        self.file_size = voice.get("file_size", 0)
+        self.timings: Dict[str, float] = {}
+        self.started = time()
+        self.acknowledged: Optional[Future] = None
+        self._held = ExitStack()
+    
+    def lock_session(self) -> None:
+        with timed_stage(self.timings, "lock_wait"):
+            self._held.enter_context(chat_lock(self.chat_id))
+    
+    def unlock_session(self) -> None:
+        self._held.close()
+    
+    def _submit(self, stage: str, func: Callable, *args, **kwargs) -> Future:
+        def run():
+            with timed_stage(self.timings, stage):
+                return func(*args, **kwargs)
+        return _voice_io_executor.submit(contextvars.copy_context().run, run)
+    
+    def acknowledge(self, text: str) -> None:
+        """Send the acknowledgment without waiting for it"""
+        self.acknowledged = self._submit("acknowledge", send_message, self.chat_id, text)
+    
+    def transcribe(self) -> Future:
+        """Future of (text, confidence); transcribe_voice fills in its own stage timings"""
+        return _voice_io_executor.submit(contextvars.copy_context().run, transcribe_voice, self.file_id,
+                                         self.duration, self.file_unique_id, self.timings, self.file_size)
+    
+    def wait_for_acknowledgment(self) -> None:
+        """Replies must not overtake the acknowledgment"""
+        if self.acknowledged is not None:
+            with timed_stage(self.timings, "acknowledge_wait"):
+                self.acknowledged.result()
+    
+    def report(self, outcome: str) -> None:
+        log_event("voice_pipeline", chat_id=self.chat_id, outcome=outcome, duration=self.duration,
+                  stages_ms={stage: round(seconds * 1000, 1) for stage, seconds in self.timings.items()},
+                  total_ms=round((time() - self.started) * 1000, 1))
+
+# Construction vocabulary check - EXPANDED LIST
+CONSTRUCTION_TERMS = {
+    'site', 'concrete', 'scaffold', 'safety', 'contractor', 
+    'building', 'foundation', 'equipment', 'supervisor', 'worker',
+    'segment', 'plaza', 'commercial', 'westfield', 'add', 'construction',
+    'axis', 'premier', 'electric', 'electrician', 'crane', 'operator',
+    'project', 'manager', 'companies', 'people', 'miller', 'wilson', 'brown'
+}
+ADD_SITE_PATTERN = re.compile(r"add\s+(?:the\s+)?.*?\s+site")
+REPEATED_CHARACTERS_PATTERN = re.compile(r'(\w)\1{4,}')
+
 def calculate_enhanced_confidence(text: str, audio_size: int) -> float:
     """Calculate confidence with multiple factors"""
     confidence = 0.5
     
-    text_lower = text.lower()
-    words = text.split()
+    utterance = as_utterance(text)
+    text_lower = utterance.lowered
+    words = utterance.words
     
     # Text length factor
     if 3 <= len(words) <= 100:
@@ -1410,17 +3331,8 @@ def calculate_enhanced_confidence(text: str, audio_size: int) -> float:
     elif len(words) > 100:
         confidence += 0.15
     
-    # Construction vocabulary check - EXPANDED LIST
-    construction_terms = {
-        'site', 'concrete', 'scaffold', 'safety', 'contractor', 
-        'building', 'foundation', 'equipment', 'supervisor', 'worker',
-        'segment', 'plaza', 'commercial', 'westfield', 'add', 'construction',
-        'axis', 'premier', 'electric', 'electrician', 'crane', 'operator',
-        'project', 'manager', 'companies', 'people', 'miller', 'wilson', 'brown'
-    }
-    
     # Special boost for construction patterns
-    if re.search(r"add\s+(?:the\s+)?.*?\s+site", text_lower):
+    if ADD_SITE_PATTERN.search(text_lower):
         confidence += 0.3
     
     if "segment" in text_lower and "category" in text_lower:
@@ -1429,11 +3341,11 @@ def calculate_enhanced_confidence(text: str, audio_size: int) -> float:
     if "companies" in text_lower or "people" in text_lower:
         confidence += 0.2
     
-    term_matches = sum(1 for term in construction_terms if term in text_lower)
+    term_matches = sum(1 for term in CONSTRUCTION_TERMS if term in text_lower)
     confidence += min(0.3, term_matches * 0.05)
     
     # Penalize suspicious patterns
-    if re.search(r'(\w)\1{4,}', text):  # Repeated characters
+    if REPEATED_CHARACTERS_PATTERN.search(text):  # Repeated characters
         confidence -= 0.2
     if len(set(words)) < len(words) * 0.3:  # Too many repeated words
         confidence -= 0.1
@@ -1442,60 +3354,344 @@ def calculate_enhanced_confidence(text: str, audio_size: int) -> float:
 
         
     
-# REPLACE the normalize_transcription function with this enhanced version:
-def normalize_transcription(text: str) -> str:
-    """Normalize transcription text with enhanced construction vocabulary recognition"""
-    # Construction-specific vocabulary for common misrecognitions
-    construction_replacements = {
-        # Common misheard terms
-        r'\bside\s+([a-z]+)\b': r'site \1',  
-        r'\bproject\s+section\b': r'project',
-        r'\belse\s+true\s+fix\b': r'electro fix',
-        r'\bbuild\s+a\b': r'builder',
-        r'\broof\s+master\b': r'roof masters',
-        
-        # Additional construction-specific corrections
-        r'\bsee\s+meant\b': r'cement', 
-        r'\bscaffold\s+ink\b': r'scaffolding',
-        r'\bwire\s+ink\b': r'wiring',
-        r'\bfoam\s+work\b': r'form work',
-        r'\brein\s+force\s+meant\b': r'reinforcement',
-        r'\bcon\s+crete\b': r'concrete',
-        r'\bweld\s+in\b': r'welding',
-        r'\bheavy\s+coupe\s+meant\b': r'heavy equipment',
-        r'\bpower\s+out\s+edge\b': r'power outage',
-        r'\btool\s+box\s+talk\b': r'toolbox talk',
-        r'\bsafe\s+tea\b': r'safety',
-        r'\binspect\s+shun\b': r'inspection',
-        r'\breg\s+you\s+late\s+shuns\b': r'regulations',
-        
-        # Numbers and units
-        r'\btwo\s+by\s+four\b': r'2x4',
-        r'\bfour\s+by\s+four\b': r'4x4',
-        r'\bsquare\s+meter\b': r'square meter',
-        r'\bsquare\s+foot\b': r'square foot',
-        r'\bcubic\s+yard\b': r'cubic yard',
-    }
+# --- Transcription Normalization ---
+class ReplacementEngine:
+    """Ordered regex replacements with the result of one re.sub per rule, in fewer scans.
     
-    # Process all construction-specific terms
-    for pattern, replacement in construction_replacements.items():
-        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
-        
-    # Process common command words with typos
-    command_corrections = {
-        r'\b(ad|ed|odd|at)\b': 'add',
-        r'\b(delet|deleet|dell eat|dell it)\b': 'delete',
-        r'\b(new|nu|knew)\b': 'new',
-        r'\b(reset|re set|resat)\b': 'reset',
-        r'\b(expor|export|expoart)\b': 'export',
-        r'\b(summery|summary|some mary)\b': 'summary',
-        r'\b(komment|coment|comment)\b': 'comment',
-    }
+    Consecutive literal rules (patterns that match a finite set of phrases, replaced by
+    fixed text) are merged into a stage unless a static check finds that a rule could
+    match text an earlier rule of the stage writes, or a match that starts before and
+    overlaps an earlier rule's match. Any other rule is a stage of its own.
+    
+    A stage is one pass over the text. Its phrases are compiled into a trie-shaped
+    alternation over the lowercased text, so the scan only stops at characters that can
+    start a phrase, and the replacement is picked by the leaf that matched. Text that
+    lowercasing doesn't map onto IGNORECASE matching (dotted and dotless i, long s) falls
+    back to an alternation of the original patterns.
+    """
+    MAX_FORMS = 256
+    # Placeholders: any non-word character in the boundary checks, a whitespace run
+    # (\s+) in phrases, and the word boundaries a rule requires at its start and end
+    NON_WORD = "\0"
+    WHITESPACE = "\1"
+    START = "\2"
+    END = "\3"
+    # Characters whose IGNORECASE matching differs from comparing lowercased text
+    UNSAFE_LOWERCASE = frozenset("İıſ")
+    
+    def __init__(self, rules: Iterable[Tuple[str, str]], flags: int = re.IGNORECASE):
+        self.rules = [(re.compile(pattern, flags), replacement) for pattern, replacement in rules]
+        self.stages: List[Tuple[re.Pattern, List[str], Optional[Tuple[re.Pattern, List[str]]]]] = []
+        forms = [self._literal_forms(pattern.pattern, replacement) for pattern, replacement in self.rules]
+        stage: List[int] = []
+        for index, form in enumerate(forms):
+            if form is None or any(self._conflicts(forms[earlier], form) for earlier in stage):
+                self._close_stage(stage, forms, flags)
+                stage = []
+            stage.append(index)
+            if form is None:
+                self._close_stage(stage, forms, flags)
+                stage = []
+        self._close_stage(stage, forms, flags)
+    
+    def _close_stage(self, stage: List[int], forms: List[Optional[Dict[str, Any]]], flags: int) -> None:
+        if not stage:
+            return
+        replacements = [self.rules[index][1] for index in stage]
+        if len(stage) == 1:
+            self.stages.append((self.rules[stage[0]][0], replacements, None))
+            return
+        combined = "|".join(f"(?P<r{position}>{self.rules[index][0].pattern})" for position, index in enumerate(stage))
+        lowered = None
+        if flags == re.IGNORECASE and all(forms[index]["ascii"] for index in stage):
+            trie, leaves = self._trie_pattern([forms[index] for index in stage])
+            lowered = (re.compile(trie), [replacements[position] for position in leaves])
+        self.stages.append((re.compile(combined, flags), replacements, lowered))
+    
+    @classmethod
+    def _literal_forms(cls, pattern: str, replacement: str) -> Optional[Dict[str, Any]]:
+        """Casefolded phrases the pattern matches, whether it requires a word boundary at
+        its start and end, and the casefolded replacement, or None if the rule isn't a
+        literal rule"""
+        if "\\" in replacement or not replacement:
+            return None
+        items = list(re_parser.parse(pattern))
+        boundary = lambda item: str(item[0]) == "AT" and str(item[1]) == "AT_BOUNDARY"
+        starts = bool(items) and boundary(items[0])
+        ends = len(items) > 1 and boundary(items[-1])
+        tokens = cls._phrases(items[int(starts):len(items) - int(ends)])
+        if not tokens or "" in tokens or any(phrase.startswith(cls.WHITESPACE) for phrase in tokens):
+            return None
+        phrases = [phrase.replace(cls.WHITESPACE, " ") for phrase in tokens]
+        # Text next to any match must stay a non-word character for the boundary checks
+        is_word = lambda char: char.isalnum() or char == "_"
+        for phrase in phrases:
+            if (not is_word(phrase[0]) and is_word(replacement[0])) or (not is_word(phrase[-1]) and is_word(replacement[-1])):
+                return None
+        return {"phrases": phrases, "tokens": tokens, "starts": starts, "ends": ends,
+                "output": replacement.casefold(), "ascii": all(phrase.isascii() for phrase in phrases)}
+    
+    @classmethod
+    def _phrases(cls, items) -> Optional[List[str]]:
+        """Every string items can match, with WHITESPACE for a whitespace run"""
+        phrases = [""]
+        for op, value in items:
+            op = str(op)
+            if op == "LITERAL":
+                options = [chr(value).casefold()]
+            elif op == "SUBPATTERN":
+                options = cls._phrases(value[-1])
+            elif op == "BRANCH":
+                options = []
+                for branch in value[1]:
+                    branch_phrases = cls._phrases(branch)
+                    if branch_phrases is None:
+                        return None
+                    options.extend(branch_phrases)
+            elif op == "IN" and [(str(kind), str(what)) for kind, what in value] == [("CATEGORY", "CATEGORY_SPACE")]:
+                options = None  # a single whitespace character, only supported as \s+ or \s*
+            elif op == "MAX_REPEAT":
+                low, high, body = value
+                if len(body) == 1 and str(body[0][0]) == "IN" \
+                        and [(str(kind), str(what)) for kind, what in body[0][1]] == [("CATEGORY", "CATEGORY_SPACE")]:
+                    # Greedy repeats try the longer option first
+                    options = [cls.WHITESPACE] + ([""] if low == 0 else []) if low <= 1 and high == re_parser.MAXREPEAT else None
+                elif (low, high) == (0, 1):
+                    options = cls._phrases(body)
+                    options = None if options is None else options + [""]
+                else:
+                    options = None
+            else:
+                options = None
+            if options is None:
+                return None
+            phrases = list(dict.fromkeys(phrase + option for phrase in phrases for option in options))
+            if len(phrases) > cls.MAX_FORMS:
+                return None
+        return phrases
+    
+    @classmethod
+    def _trie_pattern(cls, forms: List[Dict[str, Any]]) -> Tuple[str, List[int]]:
+        """Case-sensitive alternation of the stage's lowercase phrases with shared prefixes
+        factored out, each ending in an empty named group, and the stage position of the
+        rule behind each group.
+        
+        Alternatives are only reordered where they can't both match at the same place
+        (different literal characters), so the first phrase in rule order still wins.
+        The start boundary is checked after the first character, which keeps every
+        top-level alternative starting with a literal the scan can skip to.
+        """
+        root: List[List[Any]] = []
+        whitespace = set(" \t\n\r\f\v") | {cls.WHITESPACE}
+        def exclusive(first: str, second: str) -> bool:
+            literal = lambda token: token not in (cls.START, cls.END)
+            return (literal(first) and literal(second) and first != second
+                    and not (first in whitespace and second in whitespace))
+        for position, form in enumerate(forms):
+            for phrase in form["tokens"]:
+                tokens = list(phrase[:1]) + ([cls.START] if form["starts"] else []) + list(phrase[1:])
+                tokens += [cls.END] if form["ends"] else []
+                items = root
+                for token in tokens:
+                    child = None
+                    for offset in range(len(items) - 1, -1, -1):
+                        item = items[offset]
+                        if item[0] == "child" and item[1] == token:
+                            child = item
+                            break
+                        if item[0] == "leaf" or not exclusive(item[1], token):
+                            break
+                    if child is None:
+                        child = ["child", token, []]
+                        items.append(child)
+                    items = child[2]
+                items.append(["leaf", position])
+        
+        leaves: List[int] = []
+        def render(items: List[List[Any]], first: Optional[str] = None) -> str:
+            parts = []
+            for item in items:
+                if item[0] == "leaf":
+                    parts.append(f"(?P<r{len(leaves)}>)")
+                    leaves.append(item[1])
+                    continue
+                token, children = item[1], item[2]
+                if token == cls.WHITESPACE:
+                    regex = r"\s+"
+                elif token == cls.START:
+                    # \b before the first character, checked one character later
+                    regex = r"(?<!\w[\s\S])" if first.isalnum() or first == "_" else r"(?<=\w[\s\S])"
+                elif token == cls.END:
+                    regex = r"\b"
+                else:
+                    regex = re.escape(token)
+                parts.append(regex + render(children, first if first is not None else token))
+            return parts[0] if len(parts) == 1 else "(?:" + "|".join(parts) + ")"
+        return render(root), leaves
+    
+    @staticmethod
+    def _overlaps(placed: str, offset: int, other: str, placed_form: Dict[str, Any],
+                  other_form: Optional[Dict[str, Any]]) -> bool:
+        """Whether placed, starting at offset relative to other, can coexist with it: the
+        overlapping characters agree and the word boundaries either one requires hold
+        wherever both neighbouring characters are known. NON_WORD in other stands for
+        any character that isn't a word character."""
+        is_word = lambda char: char != ReplacementEngine.NON_WORD and (char.isalnum() or char == "_")
+        known: Dict[int, str] = dict(enumerate(other))
+        for position, char in enumerate(placed, offset):
+            current = known.get(position, char)
+            if current == ReplacementEngine.NON_WORD and not is_word(char):
+                continue
+            if current != char:
+                return False
+            known[position] = char
+        def boundary_holds(position: int) -> bool:
+            if position - 1 not in known or position not in known:
+                return True
+            return is_word(known[position - 1]) != is_word(known[position])
+        if placed_form["starts"] and not boundary_holds(offset):
+            return False
+        if placed_form["ends"] and not boundary_holds(offset + len(placed)):
+            return False
+        if other_form and other_form["starts"] and not boundary_holds(0):
+            return False
+        if other_form and other_form["ends"] and not boundary_holds(len(other)):
+            return False
+        return True
+    
+    @classmethod
+    def _conflicts(cls, earlier: Dict[str, Any], later: Dict[str, Any]) -> bool:
+        """Whether running the rules in one pass could differ from running earlier, then later"""
+        output = earlier["output"]
+        # Boundaries around phrases that start and end in word characters mean the text
+        # on either side of the replacement is a non-word character, and stays one
+        word_edges = earlier["starts"] and earlier["ends"] and all(
+            (phrase[0].isalnum() or phrase[0] == "_") and (phrase[-1].isalnum() or phrase[-1] == "_")
+            for phrase in earlier["phrases"])
+        left = right = cls.NON_WORD if word_edges else ""
+        context = left + output + right
+        for phrase in later["phrases"]:
+            # later matching (part of) what earlier wrote
+            for offset in range(len(left) - len(phrase) + 1, len(left) + len(output)):
+                if cls._overlaps(phrase, offset, context, later, None):
+                    return True
+            # a later match starting first would take text the earlier rule replaces
+            for earlier_phrase in earlier["phrases"]:
+                for offset in range(1, len(phrase)):
+                    if cls._overlaps(earlier_phrase, offset, phrase, earlier, later):
+                        return True
+        return False
     
-    for pattern, replacement in command_corrections.items():
-        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+    def apply(self, text: str) -> str:
+        for pattern, replacements, lowered in self.stages:
+            if len(replacements) == 1:
+                text = pattern.sub(replacements[0], text)
+            elif lowered is None or not self.UNSAFE_LOWERCASE.isdisjoint(text):
+                text = pattern.sub(lambda match: replacements[int(match.lastgroup[1:])], text)
+            else:
+                # Lowercasing keeps every other character at its index, so spans carry over
+                trie, leaf_replacements = lowered
+                parts, end = [], 0
+                for match in trie.finditer(text.lower()):
+                    parts += (text[end:match.start()], leaf_replacements[int(match.lastgroup[1:])])
+                    end = match.end()
+                if parts:
+                    parts.append(text[end:])
+                    text = "".join(parts)
+        return text
+    
+    def apply_sequential(self, text: str) -> str:
+        """Reference semantics: one re.sub per rule, in order"""
+        for pattern, replacement in self.rules:
+            text = pattern.sub(replacement, text)
+        return text
+    
+    def stats(self) -> Dict[str, int]:
+        return {"rules": len(self.rules), "stages": len(self.stages)}
+
+# Construction vocabulary Whisper commonly mishears, then command words with typos; in order
+TRANSCRIPTION_REPLACEMENTS = [
+    # Common misheard terms
+    (r'\bside\s+([a-z]+)\b', r'site \1'),
+    (r'\bproject\s+section\b', r'project'),
+    (r'\belse\s+true\s+fix\b', r'electro fix'),
+    (r'\bbuild\s+a\b', r'builder'),
+    (r'\broof\s+master\b', r'roof masters'),
+    
+    # Additional construction-specific corrections
+    (r'\bsee\s+meant\b', r'cement'),
+    (r'\bscaffold\s+ink\b', r'scaffolding'),
+    (r'\bwire\s+ink\b', r'wiring'),
+    (r'\bfoam\s+work\b', r'form work'),
+    (r'\brein\s+force\s+meant\b', r'reinforcement'),
+    (r'\bcon\s+crete\b', r'concrete'),
+    (r'\bweld\s+in\b', r'welding'),
+    (r'\bheavy\s+coupe\s+meant\b', r'heavy equipment'),
+    (r'\bpower\s+out\s+edge\b', r'power outage'),
+    (r'\btool\s+box\s+talk\b', r'toolbox talk'),
+    (r'\bsafe\s+tea\b', r'safety'),
+    (r'\binspect\s+shun\b', r'inspection'),
+    (r'\breg\s+you\s+late\s+shuns\b', r'regulations'),
+    
+    # Numbers and units
+    (r'\btwo\s+by\s+four\b', r'2x4'),
+    (r'\bfour\s+by\s+four\b', r'4x4'),
+    (r'\bsquare\s+meter\b', r'square meter'),
+    (r'\bsquare\s+foot\b', r'square foot'),
+    (r'\bcubic\s+yard\b', r'cubic yard'),
+    
+    # Common command words with typos
+    (r'\b(ad|ed|odd|at)\b', 'add'),
+    (r'\b(delet|deleet|dell eat|dell it)\b', 'delete'),
+    (r'\b(new|nu|knew)\b', 'new'),
+    (r'\b(reset|re set|resat)\b', 'reset'),
+    (r'\b(expor|export|expoart)\b', 'export'),
+    (r'\b(summery|summary|some mary)\b', 'summary'),
+    (r'\b(komment|coment|comment)\b', 'comment'),
+]
+transcription_replacements = ReplacementEngine(TRANSCRIPTION_REPLACEMENTS)
+
+# Common voice transcription errors for German company names; in order
+VOICE_COMPANY_REPLACEMENTS = [
+    (r"\bKybak\b", "KIBAG"),  # Common misrecognition of KIBAG
+    (r"\bKieback\b", "KIBAG"),  # Another variant
+    (r"Company's\s+", "Companies "),  # Fix possessive to plural
+    (r"\bElectro Maya Game Bearer\b", "Elektro-Meier GmbH"),
+    (r"\bElectro Maya Game Behave\b", "Elektro-Meier GmbH"),
+    (r"\bMaya\b", "Meier"),  # Common misrecognition
+    (r"\bGame Bearer\b", "GmbH"),
+    (r"\bGame Behave\b", "GmbH"),
+    (r"\bare gay\b", "AG"),
+    (r"\bmakhti ageet\b", "Marti AG"),
+    (r"\bImplenier\b", "Implenia"),
+    (r"\bElektromaya\b", "Elektro-Meier"),
+    (r"\bageet\b", "AG"),
+    (r"\bmakhti\b", "Marti"),
+]
+voice_company_replacements = ReplacementEngine(VOICE_COMPANY_REPLACEMENTS)
+
+COMPANY_SUFFIXES = ['AG', 'GmbH', 'Ltd', 'Limited', 'Inc', 'LLC', 'Corp', 'Corporation', 'S.A.', 'S.L.', 'B.V.', 'N.V.']
+
+def _company_suffix_rules(suffix: str) -> Tuple[re.Pattern, List[Tuple[re.Pattern, str]]]:
+    """Presence check and the three comma fixes for one suffix"""
+    escaped = re.escape(suffix)
+    return re.compile(escaped, re.IGNORECASE), [
+        # Fix patterns like "Build, Tech AG" -> "BuildTech AG"
+        (re.compile(r'(\w+),\s*(\w+),?\s*(' + escaped + r')\b', re.IGNORECASE), r'\1\2 \3'),
+        # Fix patterns like "Electric Solutions, Ltd" -> "Electric Solutions Ltd"
+        (re.compile(r'(\w+\s+\w+),\s*(' + escaped + r')\b', re.IGNORECASE), r'\1 \2'),
+        # Fix patterns like "Construction, Bro, GmbH" -> "Construction Bro GmbH"
+        (re.compile(r'(\w+),\s*(\w+),\s*(' + escaped + r')\b', re.IGNORECASE), r'\1 \2 \3'),
+    ]
+
+COMPANY_SUFFIX_RULES = [_company_suffix_rules(suffix) for suffix in COMPANY_SUFFIXES]
+log_event("replacement_engines_built", transcription=transcription_replacements.stats(),
+          voice_companies=voice_company_replacements.stats())
+
+def normalize_transcription(text: str) -> str:
+    """Normalize transcription text with enhanced construction vocabulary recognition"""
+    text = transcription_replacements.apply(text)
     
-    # Rest of the original function's code...
     # Convert common non-English transcriptions to English equivalents
     non_english_to_english = {
         # Russian/Cyrillic
@@ -1538,113 +3734,198 @@ def normalize_transcription(text: str) -> str:
 
 def normalize_voice_companies(text: str) -> str:
     """Fix common voice transcription errors in company names"""
+    text = voice_company_replacements.apply(text)
     
-    # Common voice transcription errors for German company names
-    voice_replacements = {
-        r"\bKybak\b": "KIBAG",  # Common misrecognition of KIBAG
-        r"\bKieback\b": "KIBAG",  # Another variant
-        r"Company's\s+": "Companies ",  # Fix possessive to plural
-        r"\bElectro Maya Game Bearer\b": "Elektro-Meier GmbH",
-        r"\bElectro Maya Game Behave\b": "Elektro-Meier GmbH",
-        r"\bMaya\b": "Meier",  # Common misrecognition
-        r"\bGame Bearer\b": "GmbH",
-        r"\bGame Behave\b": "GmbH",
-        r"\bare gay\b": "AG",
-        r"Company's\s+": "Companies ",  # Fix possessive to plural
-        r"\bElectro Maya Game Bearer\b": "Elektro-Meier GmbH",
-        r"\bElectro Maya Game Behave\b": "Elektro-Meier GmbH",
-        r"\bMaya\b": "Meier",  # Common misrecognition
-        r"\bGame Bearer\b": "GmbH",
-        r"\bGame Behave\b": "GmbH",
-        r"\bare gay\b": "AG",
-        # ADD THESE NEW PATTERNS:
-        r"\bmakhti ageet\b": "Marti AG",
-        r"\bKieback\b": "KIBAG",
-        r"\bImplenier\b": "Implenia",
-        r"\bElektromaya\b": "Elektro-Meier",
-        r"\bageet\b": "AG",
-        r"\bmakhti\b": "Marti",
-    }
-    
-    for pattern, replacement in voice_replacements.items():
-        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
-    
-    # Pattern to fix company names split by commas before suffixes
-    company_suffixes = ['AG', 'GmbH', 'Ltd', 'Limited', 'Inc', 'LLC', 'Corp', 'Corporation', 'S.A.', 'S.L.', 'B.V.', 'N.V.']
-    
-    for suffix in company_suffixes:
-        # Fix patterns like "Build, Tech AG" -> "BuildTech AG"
-        pattern = r'(\w+),\s*(\w+),?\s*(' + re.escape(suffix) + r')\b'
-        text = re.sub(pattern, r'\1\2 \3', text, flags=re.IGNORECASE)
-        
-        # Fix patterns like "Electric Solutions, Ltd" -> "Electric Solutions Ltd"
-        pattern = r'(\w+\s+\w+),\s*(' + re.escape(suffix) + r')\b'
-        text = re.sub(pattern, r'\1 \2', text, flags=re.IGNORECASE)
-        
-        # Fix patterns like "Construction, Bro, GmbH" -> "Construction Bro GmbH"
-        pattern = r'(\w+),\s*(\w+),\s*(' + re.escape(suffix) + r')\b'
-        text = re.sub(pattern, r'\1 \2 \3', text, flags=re.IGNORECASE)
+    # Re-join company names split by commas before suffixes. Every fix needs a comma and
+    # the suffix, so suffixes that don't occur are skipped without running their patterns.
+    for presence, rules in COMPANY_SUFFIX_RULES:
+        if "," not in text:
+            break
+        if not presence.search(text):
+            continue
+        for pattern, replacement in rules:
+            text = pattern.sub(replacement, text)
     
     return text
 
+def _pdf_digest(pdf_file: Any) -> str:
+    """sha256 of a PDF buffer or file, read in chunks so large digests are never copied"""
+    hasher = hashlib.sha256()
+    pdf_file.seek(0)
+    for chunk in iter(lambda: pdf_file.read(64 * 1024), b""):
+        hasher.update(chunk)
+    pdf_file.seek(0)
+    return hasher.hexdigest()
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
-def send_pdf(chat_id: str, pdf_buffer: io.BytesIO, report_type: str = "standard") -> bool:
-    """Send PDF report to user"""
+def send_pdf(chat_id: str, pdf_buffer: io.BytesIO, report_type: str = "standard", filename: Optional[str] = None) -> bool:
+    """Send PDF report to user, reusing a previously uploaded identical document"""
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendDocument"
+        url = telegram_api_url("sendDocument")
         caption = "Here is your construction site report."
         if report_type == "summary":
             caption = "Here is your summarized construction site report."
         elif report_type == "detailed":
             caption = "Here is your detailed construction site report."
-            
-        # Get the site name and current date/time for the filename
-        report_data = session_data.get(chat_id, {}).get("structured_data", {})
-        site_name = report_data.get("site_name", "site").lower().replace(" ", "_")
-        # Format current datetime as DDMMYYYY_HHMMSS
-        current_time = datetime.now().strftime("%d%m%Y_%H%M%S")
-        filename = f"{current_time}_{site_name}.pdf"
-            
+        elif report_type == "digest":
+            caption = "Here is your construction site digest."
+        
+        # Identical PDF bytes (e.g. served from the render cache) can be resent by file_id
+        pdf_digest = _pdf_digest(pdf_buffer)
+        session = session_data.get(chat_id, {})
+        sent_file_ids = session.get("pdf_file_ids", {})
+        cached_file_id = sent_file_ids.get(pdf_digest)
+        if cached_file_id:
+            data = {'chat_id': chat_id, 'caption': caption, 'document': cached_file_id}
+            response = requests.post(url, data=data)
+            if response.ok:
+                log_event("pdf_resent_by_file_id", chat_id=chat_id, report_type=report_type)
+                return True
+            # File id is no longer valid - forget it and upload again
+            log_event("pdf_file_id_invalid", chat_id=chat_id, status=response.status_code)
+            sent_file_ids.pop(pdf_digest, None)
+            
+        if not filename:
+            # Get the site name and current date/time for the filename
+            report_data = session.get("structured_data", {})
+            site_name = report_data.get("site_name", "site").lower().replace(" ", "_")
+            # Format current datetime as DDMMYYYY_HHMMSS
+            current_time = datetime.now().strftime("%d%m%Y_%H%M%S")
+            filename = f"{current_time}_{site_name}.pdf"
+        
+        pdf_buffer.seek(0)
         files = {'document': (filename, pdf_buffer, 'application/pdf')}
         data = {'chat_id': chat_id, 'caption': caption}
         response = requests.post(url, files=files, data=data)
         response.raise_for_status()
         log_event("pdf_sent", chat_id=chat_id, report_type=report_type, filename=filename)
+        
+        # Remember the uploaded document so an identical export can skip the upload
+        try:
+            file_id = response.json()["result"]["document"]["file_id"]
+        except (ValueError, KeyError, TypeError):
+            file_id = None
+        if file_id and chat_id in session_data:
+            sent_file_ids[pdf_digest] = file_id
+            while len(sent_file_ids) > CONFIG["PDF_FILE_ID_HISTORY"]:
+                sent_file_ids.pop(next(iter(sent_file_ids)))
+            session_data[chat_id]["pdf_file_ids"] = sent_file_ids
         return True
     except requests.RequestException as e:
         log_event("send_pdf_error", chat_id=chat_id, error=str(e))
         return False
     
    
- # ADD THIS NEW CLASS HERE
 class NumberedCanvas(canvas.Canvas):
-    """Canvas that adds page numbers"""
+    """Canvas that adds "Page X of Y" footers without keeping per-page state.
+    
+    Each page references a small form XObject that is only defined in save(),
+    once the total page count is known.
+    """
     def __init__(self, *args, **kwargs):
         canvas.Canvas.__init__(self, *args, **kwargs)
-        self._saved_page_states = []
+        self._numbered_pages = 0
 
     def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
-        self._startPage()
+        self._numbered_pages += 1
+        self.doForm(self._page_number_form_name(self._pageNumber))
+        canvas.Canvas.showPage(self)
 
     def save(self):
-        """Add page number to each page."""
-        num_pages = len(self._saved_page_states)
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_page_number(num_pages)
-            canvas.Canvas.showPage(self)
+        """Define the page number forms, then write the document."""
+        if len(self._code):
+            self.showPage()
+        for page_number in range(1, self._numbered_pages + 1):
+            self.beginForm(self._page_number_form_name(page_number))
+            self.draw_page_number(page_number, self._numbered_pages)
+            self.endForm()
         canvas.Canvas.save(self)
 
-    def draw_page_number(self, page_count):
+    @staticmethod
+    def _page_number_form_name(page_number: int) -> str:
+        return f"pageNumber{page_number}"
+
+    def draw_page_number(self, page_number, page_count):
         self.setFont("Helvetica", 9)
         self.setFillColor(colors.gray)
         self.drawRightString(
             letter[0] - 0.5*inch,
             0.5*inch,
-            f"Page {self._pageNumber} of {page_count}"
+            f"Page {page_number} of {page_count}"
         )
 
+class PDFRenderCache:
+    """LRU cache of rendered PDF bytes bounded by a total byte budget"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached PDF bytes and mark the entry as recently used"""
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return pdf_bytes
+    
+    def put(self, key: str, pdf_bytes: bytes) -> None:
+        """Store PDF bytes, evicting least recently used entries over budget"""
+        size = len(pdf_bytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = pdf_bytes
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+                log_event("pdf_cache_evicted", size_bytes=len(evicted))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return cache usage figures"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+pdf_render_cache = PDFRenderCache(CONFIG["PDF_CACHE_MAX_BYTES"])
+
+def pdf_cache_key(report_data: Dict[str, Any], report_type: str, photos: Optional[List[Dict]]) -> str:
+    """Stable hash of everything that affects the rendered PDF"""
+    logo_path = CONFIG.get("PDF_LOGO_PATH") or ""
+    logo_mtime = None
+    if logo_path and os.path.exists(logo_path):
+        logo_mtime = os.path.getmtime(logo_path)
+    
+    photo_set = sorted(
+        (p.get("file_id", ""), str(p.get("issue_ref", "")), p.get("caption", ""))
+        for p in (photos or []) if not p.get("pending")
+    )
+    
+    key_material = {
+        "report": report_data,
+        "report_type": report_type,
+        "photos": photo_set,
+        "logo": [logo_path, CONFIG.get("PDF_LOGO_WIDTH"), logo_mtime],
+        "photo_size": [CONFIG.get("MAX_PHOTO_WIDTH"), CONFIG.get("MAX_PHOTO_HEIGHT")],
+    }
+    encoded = json.dumps(key_material, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
 # THEN YOUR EXISTING FUNCTION STAYS HERE
 def get_pdf_styles():
     """Cache PDF styles to improve performance"""
@@ -1724,29 +4005,272 @@ def get_pdf_styles():
         'metadata': metadata_style
     }
 
-def get_photo_from_telegram(file_id: str, chat_id: str) -> Optional[io.BytesIO]:
-    """Download photo from Telegram and return as BytesIO"""
+# --- PDF Template ---
+PDF_SECTION_HEADINGS = {
+    "site_info": "📍 Site Information",
+    "personnel": "👥 Personnel & Companies",
+    "activities": "Activities",
+    "issues": "Issues & Problems",
+    "equipment": "Equipment & Services",
+    "conditions": "📊 Conditions",
+    "comments": "💬 Additional Comments",
+}
+
+class PDFTemplate:
+    """Static PDF parts built once per process and copied into each export"""
+    
+    def __init__(self, logo_path: str, logo_width: float):
+        self.styles = get_pdf_styles()
+        self.metadata_table_style = TableStyle([
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#616161')),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ])
+        self.title = Paragraph("Construction Site Report", self.styles['title'])
+        self.divider = HRFlowable(width="100%", thickness=2, color=colors.HexColor('#485B6A'))
+        self.roles_label = Paragraph("<b>Roles:</b>", self.styles['normal'])
+        self.headings = {key: Paragraph(text, self.styles['heading'])
+                         for key, text in PDF_SECTION_HEADINGS.items()}
+        self.logo_bytes, self.logo_size = self._load_logo(logo_path, logo_width)
+    
+    @staticmethod
+    def _load_logo(logo_path: str, logo_width: float) -> Tuple[Optional[bytes], Optional[Tuple[float, float]]]:
+        """Read the logo and its drawn size once; each export decodes its own copy"""
+        if not logo_path or not os.path.exists(logo_path):
+            return None, None
+        try:
+            with open(logo_path, "rb") as f:
+                logo_bytes = f.read()
+            logo = Image(io.BytesIO(logo_bytes), width=logo_width*inch, height=None)
+            return logo_bytes, (logo.drawWidth, logo.drawHeight)
+        except Exception as e:
+            logger.error(f"Failed to add logo: {e}")
+            return None, None
+    
+    def logo(self) -> Optional[Image]:
+        """A logo flowable with its own buffer and reader, so concurrent builds never share one"""
+        if self.logo_bytes is None:
+            return None
+        width, height = self.logo_size
+        logo = Image(io.BytesIO(self.logo_bytes), width=width, height=height)
+        logo.hAlign = 'CENTER'
+        return logo
+    
+    def heading(self, key: str) -> Paragraph:
+        return copy.copy(self.headings[key])
+    
+    def static_flowable(self, name: str) -> Any:
+        """Fresh copy of a prebuilt flowable so layout state never leaks between exports"""
+        flowable = getattr(self, name)
+        return copy.copy(flowable) if flowable is not None else None
+
+@lru_cache(maxsize=4)
+def _build_pdf_template(logo_path: str, logo_width: float, logo_mtime: Optional[float]) -> PDFTemplate:
+    log_event("pdf_template_built", logo=bool(logo_path))
+    return PDFTemplate(logo_path, logo_width)
+
+def get_pdf_template() -> PDFTemplate:
+    """Return the process-wide template, rebuilt only when the logo config changes"""
+    logo_path = CONFIG.get("PDF_LOGO_PATH") or ""
+    logo_mtime = os.path.getmtime(logo_path) if logo_path and os.path.exists(logo_path) else None
+    return _build_pdf_template(logo_path, CONFIG["PDF_LOGO_WIDTH"], logo_mtime)
+
+def get_photo_from_telegram(file_id: str, chat_id: str) -> Optional[BinaryIO]:
+    """Download photo from Telegram, streamed and capped at MAX_PHOTO_BYTES.
+    
+    The file object is handed to ReportLab's Image as is; nothing is copied into a new buffer here.
+    The caller closes it once the document has been built.
+    """
     try:
-        # Get file path from Telegram
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getFile?file_id={file_id}"
-        response = requests.get(url)
-        response.raise_for_status()
-        file_path = response.json()["result"]["file_path"]
-        
-        # Download the file
-        file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}"
-        photo_response = requests.get(file_url)
-        photo_response.raise_for_status()
-        
-        # Return as BytesIO
-        return io.BytesIO(photo_response.content)
+        download = download_telegram_file(get_telegram_file_path(file_id), CONFIG["MAX_PHOTO_BYTES"])
+        return download.file
     except Exception as e:
         logger.error(f"Failed to get photo from Telegram: {e}")
         return None
 
+def build_report_sections(report_data: Dict[str, Any], template: PDFTemplate, photos: List[Dict] = None, chat_id: str = None,
+                          photo_files: Optional[List[BinaryIO]] = None) -> List[Any]:
+    """Build the data-dependent flowables of a report (everything below the header).
+    
+    ReportLab reads photos while the document is built, so the downloaded files are
+    appended to photo_files for the caller to close after doc.build.
+    """
+    styles = template.styles
+    story = []
+    
+    # Basic Information Section with better formatting
+    
+    if any([report_data.get("segment"), report_data.get("category")]):
+        story.append(template.heading("site_info"))
+        
+        if report_data.get("segment"):
+            segment_text = report_data.get("segment", "")
+            # Capitalize first letter
+            segment_text = segment_text[0].upper() + segment_text[1:] if segment_text else segment_text
+            story.append(Paragraph(f"<b>Segment:</b> {segment_text}", styles['normal']))
+        
+        if report_data.get("category"):
+            category = report_data.get("category", "")
+            # Capitalize first letter of each word
+            category = ' '.join(word.capitalize() for word in category.split())
+            story.append(Paragraph(f"<b>Category:</b> {category}", styles['normal']))
+        
+        story.append(Spacer(1, 12))
+    
+    # Personnel & Companies Section
+    if report_data.get("people") or report_data.get("companies") or report_data.get("roles"):
+        story.append(template.heading("personnel"))
+        
+        if report_data.get("companies"):
+            companies_str = ", ".join(c.get("name", "") for c in report_data.get("companies", []) if c.get("name"))
+            if companies_str:
+                story.append(Paragraph(f"<b>Companies:</b> {companies_str}", styles['normal']))
+        
+        if report_data.get("people"):
+            people_str = ", ".join(report_data.get("people", []))
+            if people_str:
+                story.append(Paragraph(f"<b>Personnel:</b> {people_str}", styles['normal']))
+        
+        if report_data.get("roles"):
+            roles_list = []
+            for r in report_data.get("roles", []):
+                if isinstance(r, dict) and r.get("name") and r.get("role"):
+                    roles_list.append(f"• {r['name']} - <i>{r['role']}</i>")
+            
+            if roles_list:
+                story.append(template.static_flowable("roles_label"))
+                for role_str in roles_list:
+                    story.append(Paragraph(role_str, styles['normal']))
+        
+        story.append(Spacer(1, 12))
+    
+    # Activities Section
+    if report_data.get("activities"):
+        story.append(template.heading("activities"))
+        activities = report_data.get("activities", [])
+        
+        for activity in activities:
+            # Capitalize first letter of activity
+            activity_text = activity[0].upper() + activity[1:] if activity else activity
+            story.append(Paragraph(f"• {activity_text}", styles['normal']))
+        
+        story.append(Spacer(1, 12))
+    
+    # Issues Section with Photos
+   
+    if report_data.get("issues"):
+        story.append(template.heading("issues"))
+        issues = report_data.get("issues", [])
+        
+        for i, issue in enumerate(issues):
+            if isinstance(issue, dict):
+                desc = issue.get("description", "")
+                # Capitalize first letter
+                desc = desc[0].upper() + desc[1:] if desc else desc
+                
+                # Create issue content
+                issue_content = []
+                issue_content.append(Paragraph(f"• {desc}", styles['normal']))
+                
+                # Add photo if available and has_photo is True
+                
+                if issue.get("has_photo") and photos and chat_id:
+                    # Find photos for this issue
+                    for photo_data in photos:
+                        # Match by issue index or description
+                        if (not photo_data.get("pending") and 
+                            (photo_data.get("issue_ref") == str(i+1) or 
+                             (photo_data.get("caption") and 
+                              desc.lower() in photo_data.get("caption", "").lower()))):
+                            
+                            photo_buffer = get_photo_from_telegram(photo_data["file_id"], chat_id)
+                            if photo_buffer:
+                                if photo_files is not None:
+                                    photo_files.append(photo_buffer)
+                                try:
+                                    img = Image(photo_buffer, 
+                                              width=CONFIG["MAX_PHOTO_WIDTH"]*inch,
+                                              height=CONFIG["MAX_PHOTO_HEIGHT"]*inch)
+                                    img.hAlign = 'LEFT'
+                                    issue_content.append(Spacer(1, 6))
+                                    issue_content.append(img)
+                                    if photo_data.get("caption"):
+                                        issue_content.append(Paragraph(f"<i>{photo_data['caption']}</i>", styles['normal']))
+                                except Exception as e:
+                                    logger.error(f"Failed to add photo to PDF: {e}")
+                
+                # Keep issue and its photo together
+                story.append(KeepTogether(issue_content))
+        
+        story.append(Spacer(1, 12))
+    
+    # Tools & Services Section
+
+    if report_data.get("tools") or report_data.get("services"):
+        story.append(template.heading("equipment"))
+        
+        if report_data.get("tools"):
+            tools_list = [t.get("item", "") for t in report_data.get("tools", []) if t.get("item")]
+            # Capitalize each tool
+            tools_list = [tool[0].upper() + tool[1:] if tool else tool for tool in tools_list]
+            tools_str = ", ".join(tools_list)
+            if tools_str:
+                story.append(Paragraph(f"<b>Tools:</b> {tools_str}", styles['normal']))
+        
+        if report_data.get("services"):
+            services_list = [s.get("task", "") for s in report_data.get("services", []) if s.get("task")]
+            # Capitalize each service
+            services_list = [service[0].upper() + service[1:] if service else service for service in services_list]
+            services_str = ", ".join(services_list)
+            if services_str:
+                story.append(Paragraph(f"<b>Services:</b> {services_str}", styles['normal']))
+        
+        story.append(Spacer(1, 12))
+    
+    # Conditions Section
+    # Conditions Section
+    if report_data.get("time") or report_data.get("weather") or report_data.get("impression"):
+        story.append(template.heading("conditions"))
+        
+        if report_data.get("time"):
+            time_text = report_data.get("time", "")
+            time_text = time_text[0].upper() + time_text[1:] if time_text else time_text
+            story.append(Paragraph(f"<b>Time:</b> {time_text}", styles['normal']))
+        
+        if report_data.get("weather"):
+            weather_text = report_data.get("weather", "")
+            weather_text = weather_text[0].upper() + weather_text[1:] if weather_text else weather_text
+            story.append(Paragraph(f"<b>Weather:</b> {weather_text}", styles['normal']))
+        
+        if report_data.get("impression"):
+            impression_text = report_data.get("impression", "")
+            impression_text = impression_text[0].upper() + impression_text[1:] if impression_text else impression_text
+            story.append(Paragraph(f"<b>Overall Impression:</b> {impression_text}", styles['normal']))
+        
+        story.append(Spacer(1, 12))
+        
+    
+    # Comments Section
+    if report_data.get("comments"):
+        story.append(template.heading("comments"))
+        story.append(Paragraph(report_data.get("comments", ""), styles['normal']))
+        story.append(Spacer(1, 12))
+    
+    
+    return story
+
 def generate_pdf(report_data: Dict[str, Any], report_type: str = "detailed", photos: List[Dict] = None, chat_id: str = None) -> Optional[io.BytesIO]:
     """Generate enhanced PDF report with logo and photos"""
     try:
+        # Photos are only fetched when a chat is given, so only then do they affect the output
+        cache_key = pdf_cache_key(report_data, report_type, photos if chat_id else None)
+        cached_pdf = pdf_render_cache.get(cache_key)
+        if cached_pdf is not None:
+            log_event("pdf_cache_hit", report_type=report_type, size_bytes=len(cached_pdf))
+            return io.BytesIO(cached_pdf)
+        
         buffer = io.BytesIO()
         doc = SimpleDocTemplate(
             buffer, 
@@ -1756,211 +4280,51 @@ def generate_pdf(report_data: Dict[str, Any], report_type: str = "detailed", pho
             topMargin=1*inch,
             bottomMargin=1*inch
         )
-        styles = get_pdf_styles()
+        template = get_pdf_template()
+        styles = template.styles
         
         # Start building the document
         story = []
         
-        # Add logo if available
-        if CONFIG.get("PDF_LOGO_PATH") and os.path.exists(CONFIG["PDF_LOGO_PATH"]):
-            try:
-                logo = Image(CONFIG["PDF_LOGO_PATH"], 
-                           width=CONFIG["PDF_LOGO_WIDTH"]*inch, 
-                           height=None)
-                logo.hAlign = 'CENTER'
-                story.append(logo)
-                story.append(Spacer(1, 12))
-            except Exception as e:
-                logger.error(f"Failed to add logo: {e}")
-        
-        # Add title with better styling
-        site_name = report_data.get('site_name', 'Unknown Site')
-        story.append(Paragraph(f"Construction Site Report", styles['title']))
-        story.append(Paragraph(f"{site_name}", styles['subtitle']))
-        
-        # Add report metadata in a nice table
-        report_date = report_data.get('date', datetime.now().strftime('%d-%m-%Y'))
-        metadata_data = [
-            ['Report Date:', report_date],
-            ['Report Type:', report_type.capitalize()],
-            ['Generated:', datetime.now().strftime('%d-%m-%Y %H:%M')]
-        ]
-        
-        metadata_table = Table(metadata_data, colWidths=[2*inch, 3*inch])
-        metadata_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#616161')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ]))
-        story.append(metadata_table)
-        story.append(Spacer(1, 12))
-        
-        # Add a nice horizontal line
-        story.append(HRFlowable(width="100%", thickness=2, color=colors.HexColor('#485B6A')))
-        story.append(Spacer(1, 12))
-        
-        # Basic Information Section with better formatting
-        
-        if any([report_data.get("segment"), report_data.get("category")]):
-            story.append(Paragraph("📍 Site Information", styles['heading']))
-            
-            if report_data.get("segment"):
-                segment_text = report_data.get("segment", "")
-                # Capitalize first letter
-                segment_text = segment_text[0].upper() + segment_text[1:] if segment_text else segment_text
-                story.append(Paragraph(f"<b>Segment:</b> {segment_text}", styles['normal']))
-            
-            if report_data.get("category"):
-                category = report_data.get("category", "")
-                # Capitalize first letter of each word
-                category = ' '.join(word.capitalize() for word in category.split())
-                story.append(Paragraph(f"<b>Category:</b> {category}", styles['normal']))
-            
-            story.append(Spacer(1, 12))
-        
-        # Personnel & Companies Section
-        if report_data.get("people") or report_data.get("companies") or report_data.get("roles"):
-            story.append(Paragraph("👥 Personnel & Companies", styles['heading']))
-            
-            if report_data.get("companies"):
-                companies_str = ", ".join(c.get("name", "") for c in report_data.get("companies", []) if c.get("name"))
-                if companies_str:
-                    story.append(Paragraph(f"<b>Companies:</b> {companies_str}", styles['normal']))
-            
-            if report_data.get("people"):
-                people_str = ", ".join(report_data.get("people", []))
-                if people_str:
-                    story.append(Paragraph(f"<b>Personnel:</b> {people_str}", styles['normal']))
-            
-            if report_data.get("roles"):
-                roles_list = []
-                for r in report_data.get("roles", []):
-                    if isinstance(r, dict) and r.get("name") and r.get("role"):
-                        roles_list.append(f"• {r['name']} - <i>{r['role']}</i>")
-                
-                if roles_list:
-                    story.append(Paragraph("<b>Roles:</b>", styles['normal']))
-                    for role_str in roles_list:
-                        story.append(Paragraph(role_str, styles['normal']))
-            
-            story.append(Spacer(1, 12))
-        
-        # Activities Section
-        if report_data.get("activities"):
-            story.append(Paragraph("Activities", styles['heading']))
-            activities = report_data.get("activities", [])
-            
-            for activity in activities:
-                # Capitalize first letter of activity
-                activity_text = activity[0].upper() + activity[1:] if activity else activity
-                story.append(Paragraph(f"• {activity_text}", styles['normal']))
-            
-            story.append(Spacer(1, 12))
-        
-        # Issues Section with Photos
-       
-        if report_data.get("issues"):
-            story.append(Paragraph("Issues & Problems", styles['heading']))
-            issues = report_data.get("issues", [])
-            
-            for i, issue in enumerate(issues):
-                if isinstance(issue, dict):
-                    desc = issue.get("description", "")
-                    # Capitalize first letter
-                    desc = desc[0].upper() + desc[1:] if desc else desc
-                    
-                    # Create issue content
-                    issue_content = []
-                    issue_content.append(Paragraph(f"• {desc}", styles['normal']))
-                    
-                    # Add photo if available and has_photo is True
-                    
-                    if issue.get("has_photo") and photos and chat_id:
-                        # Find photos for this issue
-                        for photo_data in photos:
-                            # Match by issue index or description
-                            if (not photo_data.get("pending") and 
-                                (photo_data.get("issue_ref") == str(i+1) or 
-                                 (photo_data.get("caption") and 
-                                  desc.lower() in photo_data.get("caption", "").lower()))):
-                                
-                                photo_buffer = get_photo_from_telegram(photo_data["file_id"], chat_id)
-                                if photo_buffer:
-                                    try:
-                                        img = Image(photo_buffer, 
-                                                  width=CONFIG["MAX_PHOTO_WIDTH"]*inch,
-                                                  height=CONFIG["MAX_PHOTO_HEIGHT"]*inch)
-                                        img.hAlign = 'LEFT'
-                                        issue_content.append(Spacer(1, 6))
-                                        issue_content.append(img)
-                                        if photo_data.get("caption"):
-                                            issue_content.append(Paragraph(f"<i>{photo_data['caption']}</i>", styles['normal']))
-                                    except Exception as e:
-                                        logger.error(f"Failed to add photo to PDF: {e}")
-                    
-                    # Keep issue and its photo together
-                    story.append(KeepTogether(issue_content))
-            
-            story.append(Spacer(1, 12))
-        
-        # Tools & Services Section
-  
-        if report_data.get("tools") or report_data.get("services"):
-            story.append(Paragraph("Equipment & Services", styles['heading']))
-            
-            if report_data.get("tools"):
-                tools_list = [t.get("item", "") for t in report_data.get("tools", []) if t.get("item")]
-                # Capitalize each tool
-                tools_list = [tool[0].upper() + tool[1:] if tool else tool for tool in tools_list]
-                tools_str = ", ".join(tools_list)
-                if tools_str:
-                    story.append(Paragraph(f"<b>Tools:</b> {tools_str}", styles['normal']))
-            
-            if report_data.get("services"):
-                services_list = [s.get("task", "") for s in report_data.get("services", []) if s.get("task")]
-                # Capitalize each service
-                services_list = [service[0].upper() + service[1:] if service else service for service in services_list]
-                services_str = ", ".join(services_list)
-                if services_str:
-                    story.append(Paragraph(f"<b>Services:</b> {services_str}", styles['normal']))
-            
+        # Add logo if available
+        logo = template.logo()
+        if logo is not None:
+            story.append(logo)
             story.append(Spacer(1, 12))
         
-        # Conditions Section
-        # Conditions Section
-        if report_data.get("time") or report_data.get("weather") or report_data.get("impression"):
-            story.append(Paragraph("📊 Conditions", styles['heading']))
-            
-            if report_data.get("time"):
-                time_text = report_data.get("time", "")
-                time_text = time_text[0].upper() + time_text[1:] if time_text else time_text
-                story.append(Paragraph(f"<b>Time:</b> {time_text}", styles['normal']))
-            
-            if report_data.get("weather"):
-                weather_text = report_data.get("weather", "")
-                weather_text = weather_text[0].upper() + weather_text[1:] if weather_text else weather_text
-                story.append(Paragraph(f"<b>Weather:</b> {weather_text}", styles['normal']))
-            
-            if report_data.get("impression"):
-                impression_text = report_data.get("impression", "")
-                impression_text = impression_text[0].upper() + impression_text[1:] if impression_text else impression_text
-                story.append(Paragraph(f"<b>Overall Impression:</b> {impression_text}", styles['normal']))
-            
-            story.append(Spacer(1, 12))
-            
+        # Add title with better styling
+        site_name = report_data.get('site_name', 'Unknown Site')
+        story.append(template.static_flowable("title"))
+        story.append(Paragraph(f"{site_name}", styles['subtitle']))
         
-        # Comments Section
-        if report_data.get("comments"):
-            story.append(Paragraph("💬 Additional Comments", styles['heading']))
-            story.append(Paragraph(report_data.get("comments", ""), styles['normal']))
-            story.append(Spacer(1, 12))
+        # Add report metadata in a nice table
+        report_date = report_data.get('date', datetime.now().strftime('%d-%m-%Y'))
+        metadata_data = [
+            ['Report Date:', report_date],
+            ['Report Type:', report_type.capitalize()],
+            ['Generated:', datetime.now().strftime('%d-%m-%Y %H:%M')]
+        ]
+        
+        metadata_table = Table(metadata_data, colWidths=[2*inch, 3*inch])
+        metadata_table.setStyle(template.metadata_table_style)
+        story.append(metadata_table)
+        story.append(Spacer(1, 12))
         
+        # Add a nice horizontal line
+        story.append(template.static_flowable("divider"))
+        story.append(Spacer(1, 12))
         
-        # Build the document with numbered pages
-        doc.build(story, canvasmaker=NumberedCanvas)
+        # Report sections, then the document with numbered pages
+        photo_files: List[BinaryIO] = []
+        try:
+            story.extend(build_report_sections(report_data, template, photos, chat_id, photo_files))
+            doc.build(story, canvasmaker=NumberedCanvas)
+        finally:
+            # Spooled temp files and local-mode mappings are released now, not when collected
+            for photo_file in photo_files:
+                photo_file.close()
         buffer.seek(0)
+        pdf_render_cache.put(cache_key, buffer.getvalue())
         
         log_event("pdf_generated_enhanced", 
                 size_bytes=buffer.getbuffer().nbytes, 
@@ -2109,6 +4473,258 @@ def generate_pdf(report_data: Dict[str, Any], report_type: str = "detailed", pho
         log_event("pdf_generation_error", error=str(e))
         return None
 
+# --- Report Archive ---
+def _report_archive_path(chat_id: str) -> str:
+    safe_chat_id = re.sub(r'[^A-Za-z0-9_-]', '_', str(chat_id))
+    return os.path.join(CONFIG["REPORT_ARCHIVE_DIR"], f"{safe_chat_id}.jsonl")
+
+def archive_report(chat_id: str, report_data: Dict[str, Any]) -> bool:
+    """Append an exported report to the chat's archive unless it is unchanged since the last export"""
+    report_hash = hashlib.sha256(json.dumps(report_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    session = session_data.get(chat_id, {})
+    if session.get("last_archived_hash") == report_hash:
+        return False
+    try:
+        os.makedirs(CONFIG["REPORT_ARCHIVE_DIR"], exist_ok=True)
+        entry = {"archived_at": get_berlin_time().isoformat(), "report": report_data}
+        with open(_report_archive_path(chat_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        log_event("report_archive_error", chat_id=chat_id, error=str(e))
+        return False
+    if chat_id in session_data:
+        session_data[chat_id]["last_archived_hash"] = report_hash
+    log_event("report_archived", chat_id=chat_id, site=report_data.get("site_name", ""))
+    return True
+
+def _report_matches_site(report_data: Dict[str, Any], site: Optional[str]) -> bool:
+    return not site or (report_data.get("site_name") or "").strip().lower() == site.strip().lower()
+
+def iter_archived_reports(chat_id: str, since: Optional[datetime] = None, site: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream archived reports for a chat, oldest first, one line at a time"""
+    path = _report_archive_path(chat_id)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                log_event("report_archive_bad_line", chat_id=chat_id)
+                continue
+            if since and entry.get("archived_at"):
+                archived_at = datetime.fromisoformat(entry["archived_at"])
+                if archived_at.tzinfo is None:
+                    archived_at = pytz.timezone('Europe/Berlin').localize(archived_at)
+                if archived_at < since:
+                    continue
+            report_data = entry.get("report", {})
+            if _report_matches_site(report_data, site):
+                yield report_data
+
+def iter_reports_from_json(path: str, site: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream reports from a JSON list, JSON lines, a report archive or a session dump"""
+    def unwrap(item: Any) -> Iterator[Dict[str, Any]]:
+        if not isinstance(item, dict):
+            return
+        if "report" in item and isinstance(item["report"], dict):
+            yield item["report"]
+        elif "structured_data" in item and isinstance(item["structured_data"], dict):
+            yield item["structured_data"]
+        elif any(key in item for key in ("site_name", "date", "issues", "activities")):
+            yield item
+        else:
+            # Session dump keyed by chat id
+            for value in item.values():
+                if isinstance(value, dict) and isinstance(value.get("structured_data"), dict):
+                    yield value["structured_data"]
+
+    with open(path, encoding="utf-8") as f:
+        first_char = f.read(1)
+        while first_char and first_char.isspace():
+            first_char = f.read(1)
+        f.seek(0)
+        if first_char in ("[", "{"):
+            try:
+                items = json.load(f)
+            except ValueError:
+                # Not a single JSON document, read it as JSON lines below
+                f.seek(0)
+                items = None
+            if items is not None:
+                for item in (items if isinstance(items, list) else [items]):
+                    for report_data in unwrap(item):
+                        if _report_matches_site(report_data, site):
+                            yield report_data
+                return
+        for line in f:
+            if not line.strip():
+                continue
+            for report_data in unwrap(json.loads(line)):
+                if _report_matches_site(report_data, site):
+                    yield report_data
+
+# --- Digest Export ---
+class _LazyStory(list):
+    """Story that pulls flowables from a generator as the document build consumes them.
+    
+    SimpleDocTemplate.build only uses len(), [0], del [0] and slice inserts, so
+    keeping a small window filled is enough to stream an unbounded story.
+    """
+    def __init__(self, flowables: Iterable[Any], window: int = 50):
+        list.__init__(self)
+        self._source = iter(flowables)
+        self._window = window
+        self._refill()
+
+    def _refill(self):
+        while self._source is not None and list.__len__(self) < self._window:
+            try:
+                list.append(self, next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._refill()
+        return list.__len__(self)
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._refill()
+
+class _DigestPageRef(Flowable):
+    """Page number of a digest entry, drawn from a form defined once the page is known"""
+    def __init__(self, entry_index: int, width: float = 0.6*inch, height: float = 14):
+        Flowable.__init__(self)
+        self.entry_index = entry_index
+        self.width = width
+        self.height = height
+
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.doForm(DigestCanvas.entry_form_name(self.entry_index))
+
+class _ReportStartMarker(Flowable):
+    """Zero-size flowable recording the page a digest entry starts on"""
+    def __init__(self, entry_index: int):
+        Flowable.__init__(self)
+        self.entry_index = entry_index
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        self.canv.record_entry_page(self.entry_index)
+
+class DigestCanvas(NumberedCanvas):
+    """Numbered canvas that also resolves the digest's table of contents page numbers"""
+    def __init__(self, *args, entry_count: int = 0, **kwargs):
+        NumberedCanvas.__init__(self, *args, **kwargs)
+        self._entry_count = entry_count
+        self._entry_pages = {}
+
+    def record_entry_page(self, entry_index: int):
+        self._entry_pages.setdefault(entry_index, self._pageNumber)
+
+    @staticmethod
+    def entry_form_name(entry_index: int) -> str:
+        return f"digestEntry{entry_index}"
+
+    def save(self):
+        if len(self._code):
+            self.showPage()
+        for entry_index in range(self._entry_count):
+            self.beginForm(self.entry_form_name(entry_index))
+            self.setFont("Helvetica", 10)
+            self.setFillColor(colors.HexColor('#212121'))
+            self.drawRightString(0.6*inch, 3, str(self._entry_pages.get(entry_index, "-")))
+            self.endForm()
+        NumberedCanvas.save(self)
+
+def _digest_entry_title(report_data: Dict[str, Any]) -> str:
+    site_name = report_data.get("site_name") or "Unknown Site"
+    report_date = report_data.get("date") or "no date"
+    return f"{report_date} – {site_name}"
+
+def _digest_flowables(spool, entry_count: int, title: str, subtitle: str, template: PDFTemplate) -> Iterator[Any]:
+    """Yield the digest story: cover, table of contents, then one section per report"""
+    styles = template.styles
+    logo = template.logo()
+    if logo is not None:
+        yield logo
+        yield Spacer(1, 12)
+    yield Paragraph(title, styles['title'])
+    if subtitle:
+        yield Paragraph(subtitle, styles['subtitle'])
+    yield Paragraph(f"{entry_count} report{'s' if entry_count != 1 else ''} · generated {datetime.now().strftime('%d-%m-%Y %H:%M')}",
+                    styles['subtitle'])
+    yield template.static_flowable("divider")
+    yield Spacer(1, 12)
+    
+    # Table of contents: one row per report, page numbers are filled in at save time
+    yield Paragraph("Contents", styles['heading'])
+    spool.seek(0)
+    for entry_index, line in enumerate(spool):
+        label = Paragraph(f"{entry_index + 1}. {_digest_entry_title(json.loads(line))}", styles['normal'])
+        row = Table([[label, _DigestPageRef(entry_index)]], colWidths=[5.9*inch, 0.6*inch])
+        row.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'BOTTOM'),
+                                 ('LEFTPADDING', (0, 0), (-1, -1), 0),
+                                 ('RIGHTPADDING', (0, 0), (-1, -1), 0)]))
+        yield row
+    
+    # Report sections, each on its own page
+    spool.seek(0)
+    for entry_index, line in enumerate(spool):
+        report_data = json.loads(line)
+        yield PageBreak()
+        yield _ReportStartMarker(entry_index)
+        yield Paragraph(_digest_entry_title(report_data), styles['subtitle'])
+        yield template.static_flowable("divider")
+        yield Spacer(1, 12)
+        # Photos would have to be downloaded per report and are left out of the digest
+        yield from build_report_sections(report_data, template)
+
+def generate_digest_pdf(reports: Iterable[Dict[str, Any]], title: str = "Weekly Site Digest", subtitle: str = "") -> Optional[tempfile.SpooledTemporaryFile]:
+    """Render many reports into one PDF with a table of contents.
+    
+    Reports are spooled to a temp file first, so the iterable is consumed once
+    and only a small window of flowables is held in memory while rendering.
+    Returns a spooled temp file positioned at the start, or None if there are no reports.
+    """
+    try:
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as spool:
+            entry_count = 0
+            for report_data in reports:
+                spool.write(json.dumps(report_data, default=str) + "\n")
+                entry_count += 1
+            if not entry_count:
+                log_event("digest_empty")
+                return None
+            
+            output = tempfile.SpooledTemporaryFile(max_size=CONFIG["DIGEST_SPOOL_MAX_BYTES"])
+            doc = SimpleDocTemplate(
+                output,
+                pagesize=letter,
+                rightMargin=0.75*inch,
+                leftMargin=0.75*inch,
+                topMargin=1*inch,
+                bottomMargin=1*inch,
+                pageCompression=1,
+                title=title
+            )
+            story = _LazyStory(_digest_flowables(spool, entry_count, title, subtitle, get_pdf_template()))
+            doc.build(story, canvasmaker=partial(DigestCanvas, entry_count=entry_count))
+        
+        size_bytes = output.tell()
+        output.seek(0)
+        log_event("digest_generated", reports=entry_count, size_bytes=size_bytes)
+        return output
+    except Exception as e:
+        log_event("digest_generation_error", error=str(e))
+        return None
+
 def summarize_report(data: Dict[str, Any]) -> str:
     """Generate a formatted text summary of the report data"""
     try:
@@ -2186,6 +4802,7 @@ def summarize_report(data: Dict[str, Any]) -> str:
     #Part 8 Free Form Processing
 
 # --- Free-form Text Processing ---
+@memoize_per_request
 def extract_with_gpt(text: str) -> Dict[str, Any]:
     """Use OpenAI to extract structured data from natural language text"""
     try:
@@ -2193,28 +4810,16 @@ def extract_with_gpt(text: str) -> Dict[str, Any]:
         construction_prompt = GPT_PROMPT + "\n\nNote that this is for a construction site reporting bot. The input may be transcribed from voice in a noisy environment. Common terms include:\n- 'Site' or 'Project' followed by a location name\n- People's names followed by roles like 'Supervisor', 'Worker', 'Engineer', 'Electrician'\n- Company names like 'BuildRight AG', 'ElectricFlow GmbH'\n- Tools like 'crane', 'scaffolding', 'cement mixer', 'drill'\n- Activities like 'laying foundations', 'pouring concrete', 'electrical wiring'\n\nEven with incomplete or fragmented input, extract whatever information is present."
         
         # Call OpenAI with the enhanced prompt
-        response = client.chat.completions.create(
-            model=CONFIG["OPENAI_MODEL"],
-            messages=[
-                {"role": "system", "content": construction_prompt},
-                {"role": "user", "content": text}
-            ],
+        response, structured = request_json_completion(
+            "gpt_extraction", CONFIG["OPENAI_MODEL"], construction_prompt, text, CONFIG["NLP_STRUCTURED_OUTPUTS"],
             temperature=CONFIG["OPENAI_TEMPERATURE"]
         )
         
         try:
             content = response.choices[0].message.content.strip()
-            
-            # First look for JSON between backticks
-            json_match = re.search(r'```(?:json)?\s*(.*?)```', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Otherwise assume the whole response is JSON
-                json_str = content
-                
-            # Parse the JSON
-            data = json.loads(json_str)
+            data, _ = parse_completion_json(content, structured)
+            if structured:
+                data = validate_structured_output(data)
             log_event("gpt_extracted_data", fields=list(data.keys()))
             return data
         except json.JSONDecodeError as e:
@@ -2227,8 +4832,31 @@ def extract_with_gpt(text: str) -> Dict[str, Any]:
         log_event("gpt_api_error", error=str(e))
         return {}
 
+FREEFORM_COMMAND_PATTERN = re.compile(r'^(?:add|insert|delete|remove|category|site|segment|people|companies|roles|tools|services|activities|issues|weather|time|impression|correct)\b')
+# Look for comprehensive site report indicators
+FREEFORM_REPORT_INDICATORS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    # Reporting phrases
+    r'\b(?:this\s+is|here\s+is|I\s+am\s+providing|I\s+am\s+submitting|sending|reporting)\s+(?:the|a|my)\s+(?:report|update|daily\s+report)\b',
+    r'\b(?:daily|weekly|progress|site|inspection)\s+report\b',
+    
+    # Date/time markers
+    r'\b(?:today|this\s+morning|this\s+afternoon|yesterday|on\s+site\s+today)\b',
+    
+    # Report categories together (multiple categories suggest a comprehensive report)
+    r'\b(?:site|location)\b.*\b(?:weather|conditions)\b.*\b(?:work|activities)\b',
+    r'\b(?:personnel|workers|people)\b.*\b(?:materials|equipment|tools)\b',
+    
+    # Paragraph structure with multiple sentences
+    r'[.!?][^\n.!?]{20,}[.!?][^\n.!?]{20,}[.!?]',
+    
+    # Multiple data points
+    r'\b(?:we|I)\s+(?:have|had)\s+\d+\s+(?:workers|people|contractors)\b',
+    r'\b(?:completed|finished|started|began|continued)\s+(?:the|with|on)\s+[^.!?]+',
+]]
+
 def is_free_form_report(text: str) -> bool:
     """Enhanced detection of free-form construction reports"""
+    utterance = as_utterance(text)
      # If text is very short, it's definitely not a report
     if len(text) < 150:  # Lowered threshold
         return False
@@ -2238,37 +4866,16 @@ def is_free_form_report(text: str) -> bool:
         return True
         
     # Check for command-like patterns first
-    if re.match(r'^(?:add|insert|delete|remove|category|site|segment|people|companies|roles|tools|services|activities|issues|weather|time|impression|correct)\b', text.lower()):
+    if FREEFORM_COMMAND_PATTERN.match(utterance.lowered):
         return False
-        
-    # Look for comprehensive site report indicators
-    report_indicators = [
-        # Reporting phrases
-        r'\b(?:this\s+is|here\s+is|I\s+am\s+providing|I\s+am\s+submitting|sending|reporting)\s+(?:the|a|my)\s+(?:report|update|daily\s+report)\b',
-        r'\b(?:daily|weekly|progress|site|inspection)\s+report\b',
-        
-        # Date/time markers
-        r'\b(?:today|this\s+morning|this\s+afternoon|yesterday|on\s+site\s+today)\b',
-        
-        # Report categories together (multiple categories suggest a comprehensive report)
-        r'\b(?:site|location)\b.*\b(?:weather|conditions)\b.*\b(?:work|activities)\b',
-        r'\b(?:personnel|workers|people)\b.*\b(?:materials|equipment|tools)\b',
-        
-        # Paragraph structure with multiple sentences
-        r'[.!?][^\n.!?]{20,}[.!?][^\n.!?]{20,}[.!?]',
-        
-        # Multiple data points
-        r'\b(?:we|I)\s+(?:have|had)\s+\d+\s+(?:workers|people|contractors)\b',
-        r'\b(?:completed|finished|started|began|continued)\s+(?:the|with|on)\s+[^.!?]+',
-    ]
     
     # Count matching indicators
-    indicator_count = sum(1 for pattern in report_indicators if re.search(pattern, text, re.IGNORECASE))
+    indicator_count = sum(1 for pattern in FREEFORM_REPORT_INDICATORS if pattern.search(text))
     
     # Analyze text structure
-    sentence_count = len(re.findall(r'[.!?]+', text))
-    comma_count = len(re.findall(r',', text))
-    word_count = len(text.split())
+    sentence_count = len(utterance.sentence_boundaries)
+    comma_count = text.count(",")
+    word_count = len(utterance.words)
     
     # Calculate a confidence score based on multiple factors
     structure_score = min(1.0, (sentence_count / 5) * 0.5 + (comma_count / 8) * 0.3 + (word_count / 100) * 0.2)
@@ -2460,13 +5067,143 @@ def validate_patterns() -> None:
 
 validate_patterns()
 
+# --- Pattern Registry ---
+class PatternRegistry:
+    """FIELD_PATTERNS compiled once and indexed by the literal text every match must start with.
+    
+    The possible leading literals of each pattern ("add", "insert", "site", "sites", ...)
+    are read off its parse tree. candidates() then returns only the patterns whose
+    literals prefix the input, plus those that can start with anything, in
+    registration order, so callers that stop at the first match behave as before.
+    """
+    # More alternatives than this make a pattern a wildcard rather than index entries
+    MAX_PREFIXES = 64
+    
+    def __init__(self, patterns: Dict[str, str], flags: int = re.IGNORECASE):
+        self.compiled: Dict[str, re.Pattern] = {name: re.compile(pattern, flags) for name, pattern in patterns.items()}
+        self.prefixes: Dict[str, Optional[Tuple[str, ...]]] = {}
+        self._order = {name: index for index, name in enumerate(self.compiled)}
+        self._wildcards: List[str] = []
+        self._by_prefix: Dict[str, List[str]] = defaultdict(list)
+        for name, pattern in self.compiled.items():
+            prefixes = self._leading_literals(pattern.pattern)
+            self.prefixes[name] = prefixes
+            if prefixes is None:
+                self._wildcards.append(name)
+            for prefix in prefixes or ():
+                self._by_prefix[prefix].append(name)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._by_prefix})
+        self._candidate_cache: Dict[Tuple[str, ...], List[Tuple[str, re.Pattern]]] = {}
+    
+    @classmethod
+    def _leading_literals(cls, pattern: str) -> Optional[Tuple[str, ...]]:
+        """Shortest set of casefolded literals one of which starts every match, or None"""
+        options = cls._sequence_literals(re_parser.parse(pattern))
+        if options is None or any(not prefix for prefix, _ in options):
+            return None
+        prefixes = sorted({prefix for prefix, _ in options}, key=len)
+        kept = []
+        for prefix in prefixes:
+            if not any(prefix.startswith(shorter) for shorter in kept):
+                kept.append(prefix)
+        return tuple(kept)
+    
+    @classmethod
+    def _sequence_literals(cls, items) -> Optional[List[Tuple[str, bool]]]:
+        """(literal prefix, whether it spans the whole sequence) for each way through items"""
+        current = [("", True)]
+        for item in items:
+            if all(not complete for _, complete in current):
+                break
+            options = cls._item_literals(*item)
+            if options is None:
+                return None
+            combined = []
+            for prefix, complete in current:
+                if not complete:
+                    combined.append((prefix, False))
+                else:
+                    combined.extend((prefix + literal, done) for literal, done in options)
+            # A prefix that may end the literal part makes its longer variants redundant
+            ended = [prefix for prefix, complete in combined if not complete]
+            current = [(prefix, complete) for prefix, complete in dict.fromkeys(combined)
+                       if not any(prefix.startswith(short) and (prefix, complete) != (short, False) for short in ended)]
+            if len(current) > cls.MAX_PREFIXES:
+                return None
+        return current
+    
+    @classmethod
+    def _item_literals(cls, op, value) -> Optional[List[Tuple[str, bool]]]:
+        op = str(op)
+        if op == "LITERAL":
+            return [(chr(value).casefold(), True)]
+        if op == "AT":
+            return [("", True)]
+        if op == "SUBPATTERN":
+            return cls._sequence_literals(value[-1])
+        if op == "BRANCH":
+            options = []
+            for branch in value[1]:
+                branch_options = cls._sequence_literals(branch)
+                if branch_options is None:
+                    return None
+                options.extend(branch_options)
+            return options
+        if op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            low, high, body = value
+            body_options = cls._sequence_literals(body)
+            if body_options is None:
+                return None
+            if high != 1:
+                # Only the first repetition is known to be there
+                body_options = [(prefix, False) for prefix, _ in body_options]
+            return ([("", True)] if low == 0 else []) + body_options
+        # Character classes, wildcards, lookarounds: the literal prefix ends here
+        return [("", False)]
+    
+    def __getitem__(self, name: str) -> re.Pattern:
+        return self.compiled[name]
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self.compiled
+    
+    def match(self, name: str, text: str) -> Optional[re.Match]:
+        return self.compiled[name].match(text)
+    
+    def candidates(self, text: str) -> List[Tuple[str, re.Pattern]]:
+        """(name, compiled pattern) of every pattern that can match text, in registration order"""
+        folded = text[:self._prefix_lengths[-1] if self._prefix_lengths else 0].casefold()
+        hits = tuple(folded[:length] for length in self._prefix_lengths if folded[:length] in self._by_prefix)
+        cached = self._candidate_cache.get(hits)
+        if cached is None:
+            names = set(self._wildcards)
+            for prefix in hits:
+                names.update(self._by_prefix[prefix])
+            cached = [(name, self.compiled[name]) for name in sorted(names, key=self._order.__getitem__)]
+            self._candidate_cache[hits] = cached
+        return cached
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "patterns": len(self.compiled),
+            "indexed": len(self.compiled) - len(self._wildcards),
+            "wildcards": list(self._wildcards),
+            "prefixes": len(self._by_prefix),
+        }
+
+FIELD_PATTERN_REGISTRY = PatternRegistry(FIELD_PATTERNS)
+log_event("pattern_registry_built", **FIELD_PATTERN_REGISTRY.stats())
+
 
 def debug_command_matching(text: str, chat_id: str) -> List[Dict[str, Any]]:
     """Debug command matching to identify why a command wasn't understood"""
     results = []
-    for field, pattern in FIELD_PATTERNS.items():
+    candidates = {field for field, _ in FIELD_PATTERN_REGISTRY.candidates(text)}
+    for field, compiled in FIELD_PATTERN_REGISTRY.compiled.items():
+        pattern = compiled.pattern
         try:
-            match = re.match(pattern, text, re.IGNORECASE)
+            # Patterns outside the candidate set can't match text
+            match = compiled.match(text) if field in candidates else None
             if match:
                 results.append({
                     "field": field,
@@ -2497,7 +5234,7 @@ def debug_command_matching(text: str, chat_id: str) -> List[Dict[str, Any]]:
         
         # More detailed debug for delete commands
         if "delete" in matched_fields:
-            delete_match = re.match(FIELD_PATTERNS["delete"], text, re.IGNORECASE)
+            delete_match = FIELD_PATTERN_REGISTRY.match("delete", text)
             if delete_match:
                 log_event("delete_pattern_debug", 
                          text=text, 
@@ -2653,14 +5390,459 @@ def find_name_match(name: str, name_list: List[str]) -> Optional[str]:
     
     return best_match
 
+# --- Command Grammar ---
+# The typed-command language, parsed from word tokens in one left-to-right pass.
+# extract_single_command tries it first and falls back to FIELD_PATTERNS for anything
+# it doesn't accept. The first word picks the rule, so ordering never decides between
+# overlapping forms.
+#
+#   command    := reset | confirm | correction | assignment | deletion | update | entry
+#   reset      := ("new" ["report"] | "reset" | "start" "over" | "clear" "report") END
+#   confirm    := YES ["please"] END | NO ["thanks"] END
+#   correction := "correct" "spelling" ["of"] VALUE "to" VALUE END
+#   assignment := "add" NAME "as" ROLE END
+#               | ("role" | "roles") [":"] NAME "(" ROLE ")" END
+#               | ("supervisor" | "supervisors") [":" | COPULA] NAMES END
+#   deletion   := ("delete" | "remove" | "clear" | "empty" | "reset") ["entire" | "all"] FIELD END
+#               | ("delete" | "remove") VALUE ["from" FIELD] END
+#   update     := ("update" | "change" | "set" | "modify") FIELD ("to" | "with") VALUES END
+#   entry      := ["add" | "insert"] FIELD [":" | ","] [COPULA] (VALUES | EMPTY) END
+#
+# END is the end of the text after any trailing ". ! ?". A segment entry may carry a
+# "category" entry after its value.
+COMMAND_TOKEN_PATTERN = re.compile(r"\w+(?:['’.\-]\w+)*|[^\w\s]")
+
+COMMAND_FIELD_KEYWORDS = {
+    "site": "site_name", "sites": "site_name", "location": "site_name", "project": "site_name",
+    "segment": "segment", "segments": "segment", "section": "segment",
+    "category": "category", "categories": "category", "kategorie": "category",
+    "company": "companies", "companies": "companies", "firm": "companies", "firms": "companies",
+    "person": "people", "persons": "people", "people": "people", "peoples": "people",
+    "tool": "tools", "tools": "tools",
+    "service": "services", "services": "services",
+    "activity": "activities", "activities": "activities",
+    "issue": "issues", "issues": "issues", "problem": "issues", "problems": "issues",
+    "delay": "issues", "delays": "issues",
+    "time": "time", "weather": "weather",
+    "impression": "impression", "impressions": "impression",
+    "comment": "comments", "comments": "comments",
+    "role": "roles", "roles": "roles",
+}
+COMMAND_YES_WORDS = {"yes", "yeah", "ok", "sure", "confirm", "ja", "jep"}
+COMMAND_NO_WORDS = {"no", "nope", "nah", "negative", "nein", "nee"}
+COMMAND_COPULAS = {"is", "are", "was", "were"}
+# Words that make a phrase a sentence rather than a name
+COMMAND_NON_NAME_WORDS = COMMAND_COPULAS | {
+    "a", "an", "the", "at", "in", "on", "of", "to", "for", "from", "with", "not", "has", "had", "will", "today",
+    "be", "been", "due", "because", "but", "so", "all", "again", "still", "we", "they",
+}
+# Fields whose values are names, so a value containing one of those words is a sentence
+COMMAND_NAME_FIELDS = {"people", "companies", "site_name", "segment"}
+# Words joining two clauses; only the free-text fields take a whole sentence as their value
+COMMAND_CLAUSE_WORDS = {"because", "so", "but", "since", "while", "when", "although"}
+COMMAND_FREE_TEXT_FIELDS = {"issues", "activities", "comments", "impression"}
+COMMAND_EMPTY_WORDS = {"none", "delete", "clear", "remove", "reset"}
+COMMAND_END_PUNCTUATION = {".", "!", "?"}
+# Field entries whose list values are separated by these words as well as ";"
+COMMAND_LIST_SEPARATORS = {
+    "companies": {",", "and"}, "people": {",", "and"}, "tools": {",", "and"},
+    "services": {",", "and"}, "activities": {",", "and"}, "issues": set(),
+}
+CONTEXT_PRONOUNS = {"it", "this", "that", "him", "her", "them"}
+
+def correction_field_from_suffix(old_value: str, new_value: str) -> str:
+    """Field a spelling correction applies to when nothing else says: a company if
+    either name has a legal-form suffix, otherwise a person"""
+    if any(suffix in old_value.upper() or suffix in new_value.upper()
+           for suffix in ['AG', 'GMBH', 'LTD', 'INC', 'LLC', 'CORP']):
+        return "companies"
+    return "people"
+
+class Command(ABC):
+    """A command the grammar accepted, as the report fields it sets"""
+    @abstractmethod
+    def to_fields(self) -> Dict[str, Any]:
+        pass
+    
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({vars(self)})"
+
+class ResetCommand(Command):
+    def to_fields(self) -> Dict[str, Any]:
+        return {"reset": True}
+
+class ConfirmCommand(Command):
+    def __init__(self, confirmed: bool):
+        self.confirmed = confirmed
+    
+    def to_fields(self) -> Dict[str, Any]:
+        return {"yes_confirm": True} if self.confirmed else {"no_confirm": True}
+
+class FieldCommand(Command):
+    """Values for report fields: a string for scalar fields, a list of entries for list
+    fields, and "" or [] to empty a field"""
+    def __init__(self, values: Dict[str, Union[str, List[str]]]):
+        self.values = values
+    
+    def to_fields(self) -> Dict[str, Any]:
+        fields = {}
+        for field, value in self.values.items():
+            if field in DICT_LIST_ITEM_FIELDS:
+                key = next(iter(DICT_LIST_ITEM_FIELDS[field]))
+                fields[field] = [{key: item} for item in value]
+            else:
+                fields[field] = value
+        return fields
+
+class RoleCommand(Command):
+    def __init__(self, assignments: List[Tuple[str, str]]):
+        self.assignments = assignments
+    
+    def to_fields(self) -> Dict[str, Any]:
+        return {"people": [name for name, _ in self.assignments],
+                "roles": [{"name": name, "role": role} for name, role in self.assignments]}
+
+class CorrectionCommand(Command):
+    def __init__(self, old: str, new: str):
+        self.old = old
+        self.new = new
+    
+    def to_fields(self) -> Dict[str, Any]:
+        return {"correct": [{"field": correction_field_from_suffix(self.old, self.new), "old": self.old, "new": self.new}]}
+
+class DeleteCommand(Command):
+    """Delete a value (from a field, or wherever merge_data finds it) or a whole field"""
+    def __init__(self, value: Optional[str], category: Optional[str]):
+        self.value = value
+        self.category = category
+    
+    def to_fields(self) -> Dict[str, Any]:
+        return {"delete": {"category": self.category, "value": self.value}}
+
+class CommandParser:
+    """Recursive-descent parser for the grammar above.
+    
+    Rules match the utterance's lowercased tokens; values are sliced from its text with
+    their spelling and spacing intact. Every rule either consumes the whole text or
+    gives up, and parse returns None when none does.
+    """
+    def __init__(self, text: str):
+        self.text = as_utterance(text)
+        self.tokens = self.text.tokens
+        # Drop trailing sentence punctuation once, so rules can treat the end as fixed
+        end = len(self.tokens)
+        while end and self.tokens[end - 1] in COMMAND_END_PUNCTUATION:
+            end -= 1
+        self.end = end
+    
+    def words(self, start: int, end: int) -> List[str]:
+        return self.tokens[start:end]
+    
+    def span(self, start: int, end: int) -> str:
+        """Original text of tokens start..end"""
+        if start >= end:
+            return ""
+        starts = self.text.token_starts
+        return self.text[starts[start]:starts[end - 1] + len(self.tokens[end - 1])]
+    
+    def find(self, word: str, start: int) -> int:
+        """Index of the first token equal to word at or after start, or -1"""
+        try:
+            return self.tokens.index(word, start, self.end)
+        except ValueError:
+            return -1
+    
+    # Rule for each leading word; field keywords lead an entry
+    RULES = {
+        **{word: "entry" for word in COMMAND_FIELD_KEYWORDS},
+        "new": "reset", "reset": "reset", "start": "reset", "clear": "reset",
+        "correct": "correction",
+        "add": "entry", "insert": "entry",
+        "role": "assignment", "roles": "assignment", "supervisor": "assignment", "supervisors": "assignment",
+        "delete": "deletion", "remove": "deletion", "empty": "deletion",
+        "update": "update", "change": "update", "set": "update", "modify": "update",
+        **{word: "confirm" for word in COMMAND_YES_WORDS | COMMAND_NO_WORDS},
+    }
+    RESET_PHRASES = (["new"], ["new", "report"], ["reset"], ["start", "over"], ["clear", "report"])
+    
+    def parse(self) -> Optional[Command]:
+        if not self.end:
+            return None
+        rule = self.RULES.get(self.tokens[0])
+        return getattr(self, rule)() if rule else None
+    
+    def reset(self) -> Optional[Command]:
+        if self.words(0, self.end) in self.RESET_PHRASES:
+            return ResetCommand()
+        if self.tokens[0] in ("reset", "clear"):
+            return self.deletion()  # "clear issues"
+        return None
+    
+    def confirm(self) -> Optional[Command]:
+        words = self.words(0, self.end)
+        word, rest = words[0], words[1:]
+        if word in COMMAND_YES_WORDS and (not rest or (word == "yes" and rest == ["please"])):
+            return ConfirmCommand(True)
+        if word in COMMAND_NO_WORDS and (not rest or (word == "no" and rest == ["thanks"])):
+            return ConfirmCommand(False)
+        return None
+    
+    def correction(self) -> Optional[Command]:
+        if self.words(0, 2) != ["correct", "spelling"]:
+            return None
+        start = 3 if self.words(2, 3) == ["of"] else 2
+        to = self.find("to", start + 1)
+        if to < 0 or to + 1 >= self.end:
+            return None
+        return CorrectionCommand(self.span(start, to), self.span(to + 1, self.end))
+    
+    def is_name(self, start: int, end: int, max_words: int) -> bool:
+        """Whether tokens start..end are one to max_words words of letters"""
+        words = self.words(start, end)
+        return 0 < len(words) <= max_words and all(
+            word.replace("-", "").replace("'", "").isalpha() and word not in COMMAND_NON_NAME_WORDS for word in words)
+    
+    def assignment(self) -> Optional[Command]:
+        first = self.tokens[0]
+        if first == "add":
+            # add NAME as ROLE
+            as_index = self.find("as", 1)
+            if as_index < 0 or not self.is_name(1, as_index, 2) or not self.is_name(as_index + 1, self.end, 4):
+                return None
+            name = clean_value(self.span(1, as_index), "people")
+            return RoleCommand([(name, clean_value(self.span(as_index + 1, self.end), "roles"))])
+        if first in ("role", "roles"):
+            # roles: NAME (ROLE)
+            index = 2 if self.words(1, 2) == [":"] else 1
+            open_index = self.find("(", index)
+            if open_index < 0 or not self.is_name(index, open_index, 3) or self.words(self.end - 1, self.end) != [")"] \
+                    or not self.is_name(open_index + 1, self.end - 1, 4):
+                return None
+            name = clean_value(self.span(index, open_index), "people")
+            return RoleCommand([(name, clean_value(self.span(open_index + 1, self.end - 1), "roles"))])
+        # supervisors: NAMES
+        index = 1
+        if index < self.end and (self.tokens[index] == ":" or self.tokens[index] in COMMAND_COPULAS):
+            index += 1
+        names, name_start = [], index
+        for position in range(index, self.end + 1):
+            if position == self.end or self.tokens[position] in (",", "and"):
+                if not self.is_name(name_start, position, 3):
+                    return None
+                names.append(clean_value(self.span(name_start, position), "people"))
+                name_start = position + 1
+        return RoleCommand([(name, "Supervisor") for name in names])
+    
+    def deletion(self) -> Optional[Command]:
+        verb = self.tokens[0]
+        index = 1 + (self.words(1, 2) in (["entire"], ["all"]))
+        if index + 1 == self.end and self.tokens[index] in COMMAND_FIELD_KEYWORDS:
+            return DeleteCommand(None, COMMAND_FIELD_KEYWORDS[self.tokens[index]])
+        if verb not in ("delete", "remove") or index != 1 or self.end < 2:
+            return None
+        from_index = self.find("from", 2)
+        if from_index > 0 and from_index + 2 == self.end and self.tokens[from_index + 1] in COMMAND_FIELD_KEYWORDS:
+            return DeleteCommand(self.span(1, from_index), COMMAND_FIELD_KEYWORDS[self.tokens[from_index + 1]])
+        if from_index > 0 or self.find(",", 1) > 0:
+            return None
+        return DeleteCommand(self.span(1, self.end), None)
+    
+    def update(self) -> Optional[Command]:
+        if self.end < 4 or self.tokens[1] not in COMMAND_FIELD_KEYWORDS or self.tokens[2] not in ("to", "with"):
+            return None
+        return self.field_values(COMMAND_FIELD_KEYWORDS[self.tokens[1]], 3)
+    
+    def entry(self) -> Optional[Command]:
+        index = 1 if self.tokens[0] in ("add", "insert") else 0
+        if index >= self.end:
+            return None
+        keyword = self.tokens[index]
+        if keyword not in COMMAND_FIELD_KEYWORDS:
+            # add NAME as ROLE; "add it to ..." refers back to the conversation
+            return self.assignment() if keyword not in CONTEXT_PRONOUNS else None
+        field = COMMAND_FIELD_KEYWORDS[keyword]
+        if field == "roles":
+            return None  # "add role ..." is left to the role patterns
+        index += 1
+        if self.words(index, index + 1) in ([":"], [","]):
+            index += 1
+        if index < self.end and self.tokens[index] in COMMAND_COPULAS:
+            index += 1
+        return self.field_values(field, index)
+    
+    def field_values(self, field: str, index: int) -> Optional[Command]:
+        if index >= self.end:
+            return None
+        if index + 1 == self.end and self.tokens[index] in COMMAND_EMPTY_WORDS:
+            return FieldCommand({field: [] if field in LIST_FIELDS else ""})
+        words = self.words(index, self.end)
+        category = self.find("category", index + 1) if field == "segment" else -1
+        # The name ends where a category begins; a lone word is a name even when it
+        # spells an article: "segment A category safety"
+        names = self.words(index, category) if category >= 0 else words
+        if field in COMMAND_NAME_FIELDS and len(names) > 1 and not COMMAND_NON_NAME_WORDS.isdisjoint(names):
+            return None  # "project is delayed due to rain", "section 5 is finished"
+        if field not in COMMAND_FREE_TEXT_FIELDS and not COMMAND_CLAUSE_WORDS.isdisjoint(words):
+            return None  # "time was short because ...", "tools ... were broken so ..."
+        if field in LIST_FIELDS:
+            if any(COMMAND_FIELD_KEYWORDS.get(word, field) != field for word in words):
+                return None  # "activities ..., issues ...": several fields in one sentence
+            if field == "people" and self.find("as", index) >= 0:
+                return None  # people with roles: the voice_people_roles pattern
+            items = self.items(index, self.end, COMMAND_LIST_SEPARATORS[field], field)
+            return FieldCommand({field: items}) if items else None
+        # A comma or semicolon starts another clause the grammar doesn't cover
+        if "," in self.tokens[index:self.end] or ";" in self.tokens[index:self.end]:
+            return None
+        if category < 0:
+            return FieldCommand({field: clean_value(self.span(index, self.end), field)})
+        if category + 1 >= self.end:
+            return None
+        return FieldCommand({"segment": clean_value(self.span(index, category), "segment"),
+                             "category": clean_value(self.span(category + 1, self.end), "category")})
+    
+    def items(self, start: int, end: int, separators: Set[str], field: str) -> List[str]:
+        """Values between separators (";" always separates), cleaned for field.
+        
+        With both "," and "and" as separators, an "and" before the last comma is part of
+        a name ("Smith and Sons, Ernst and Young"), so no split is trusted and none is made.
+        """
+        if {",", "and"} <= separators:
+            words = self.words(start, end)
+            if "," in words and "and" in words[:len(words) - words[::-1].index(",")]:
+                return []
+        items, item_start = [], start
+        for index in range(start, end + 1):
+            if index == end or self.tokens[index] in separators or self.tokens[index] == ";":
+                if index > item_start:
+                    items.append(clean_value(self.span(item_start, index), field))
+                item_start = index + 1
+        return [item for item in items if item]
+
+def parse_command(text: str) -> Optional[Command]:
+    """The command text is written in, or None to fall back to FIELD_PATTERNS"""
+    if not CONFIG["ENABLE_COMMAND_GRAMMAR"]:
+        return None
+    utterance = as_utterance(text)
+    # Most free-form reports are turned away by their first word, before tokenizing
+    if utterance.first_word not in CommandParser.RULES:
+        return None
+    return CommandParser(utterance).parse()
+
+# --- Utterance ---
+TRAILING_SENTENCE_MARK_PATTERN = re.compile(r'[.!?]\s*$')
+SENTENCE_MARKS_PATTERN = re.compile(r'[.!?]+')
+CHAINED_COMMAND_PATTERN = re.compile(r'(?<!\d)\.\s+[A-Za-z]')
+CHAINED_COMMAND_SPLIT_PATTERN = re.compile(r'(?<!\d)[;.]\s+')
+
+class lazy_attribute:
+    """functools.cached_property without the lock it takes on every first access before
+    Python 3.12, which costs more than most forms Utterance computes. The value is stored
+    in the instance __dict__, where later lookups find it directly; two threads may both
+    compute it, which is harmless for pure forms.
+    """
+    def __init__(self, func: Callable):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+    
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+class Utterance(str):
+    """The text of one message with the forms and features the pipeline reads from it,
+    each computed on first use and shared by every later stage.
+    
+    It is a str, so it passes through any stage unchanged. A stage that may receive a
+    plain string wraps it with as_utterance. Strings derived from it (strip, slices,
+    re.sub) are plain strings again.
+    """
+    @lazy_attribute
+    def lowered(self) -> str:
+        return self.lower()
+    
+    @lazy_attribute
+    def words(self) -> List[str]:
+        return self.split()
+    
+    @lazy_attribute
+    def normalized(self) -> "Utterance":
+        """Stripped and without a trailing sentence mark, the form commands are read in"""
+        normalized = TRAILING_SENTENCE_MARK_PATTERN.sub('', self.strip())
+        return self if normalized == self else Utterance(normalized)
+    
+    @lazy_attribute
+    def _token_source(self) -> str:
+        # Lowercasing that changes the length (İ) would misplace the spans; such a text
+        # keeps its case, matches no keyword, and is left to FIELD_PATTERNS
+        return self.lowered if len(self.lowered) == len(self) else str(self)
+    
+    @lazy_attribute
+    def first_word(self) -> Optional[str]:
+        """First token, lowercased, found without tokenizing or lowering the rest"""
+        match = COMMAND_TOKEN_PATTERN.search(self)
+        return match.group().lower() if match else None
+    
+    @lazy_attribute
+    def tokens(self) -> List[str]:
+        """Lowercased word and punctuation tokens"""
+        return COMMAND_TOKEN_PATTERN.findall(self._token_source)
+    
+    @lazy_attribute
+    def token_starts(self) -> List[int]:
+        """Offset of each token, found from the tokens instead of tokenizing again: only
+        whitespace separates them, so each is the next occurrence after the one before"""
+        source, starts, position = self._token_source, [], 0
+        for token in self.tokens:
+            position = source.find(token, position)
+            starts.append(position)
+            position += len(token)
+        return starts
+    
+    @lazy_attribute
+    def field_keywords(self) -> Set[str]:
+        """Report fields named by a keyword token, e.g. {"companies"} for "firms ..." """
+        return {COMMAND_FIELD_KEYWORDS[token] for token in self.tokens if token in COMMAND_FIELD_KEYWORDS}
+    
+    @lazy_attribute
+    def sentence_boundaries(self) -> List[int]:
+        """Offsets just past each run of sentence marks"""
+        return [match.end() for match in SENTENCE_MARKS_PATTERN.finditer(self)]
+    
+    @lazy_attribute
+    def is_chained(self) -> bool:
+        """Whether the message holds several commands separated by ";" or ". " """
+        return ";" in self or CHAINED_COMMAND_PATTERN.search(self) is not None
+    
+    @lazy_attribute
+    def clauses(self) -> List["Utterance"]:
+        """The commands of a chained message"""
+        return [Utterance(clause) for clause in CHAINED_COMMAND_SPLIT_PATTERN.split(self)]
+    
+    @lazy_attribute
+    def command(self) -> Optional[Command]:
+        return parse_command(self)
+
+def as_utterance(text: str) -> Utterance:
+    return text if isinstance(text, Utterance) else Utterance(text)
+
 def extract_single_command(cmd: str) -> Dict[str, Any]:
     """Extract structured data from a single command with enhanced error handling"""
     try:
         log_event("extract_single_command", input=cmd)
         result = {}
         
+        # The grammar answers the commands it covers; the patterns below handle the rest
+        command = as_utterance(cmd).command
+        if command is not None:
+            log_event("command_parsed", command=type(command).__name__)
+            return command.to_fields()
+        
         # Check for reset/new commands
-        reset_match = re.match(FIELD_PATTERNS["reset"], cmd, re.IGNORECASE)
+        reset_match = FIELD_PATTERN_REGISTRY.match("reset", cmd)
         if reset_match:
             return {"reset": True}
         
@@ -2670,14 +5852,11 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
             if correct_match:
                 old_value = correct_match.group(1).strip()
                 new_value = correct_match.group(2).strip()
-                # Determine field based on suffixes
-                if any(suffix in old_value.upper() or suffix in new_value.upper() 
-                       for suffix in ['AG', 'GMBH', 'LTD', 'INC', 'LLC', 'CORP']):
-                    return {"correct": [{"field": "companies", "old": old_value, "new": new_value}]}
-                return {"correct": [{"field": "people", "old": old_value, "new": new_value}]}
+                field = correction_field_from_suffix(old_value, new_value)
+                return {"correct": [{"field": field, "old": old_value, "new": new_value}]}
         # Check add_person_role pattern early (before generic patterns)
-        if "add_person_role" in FIELD_PATTERNS:
-            match = re.match(FIELD_PATTERNS["add_person_role"], cmd, re.IGNORECASE)
+        if "add_person_role" in FIELD_PATTERN_REGISTRY:
+            match = FIELD_PATTERN_REGISTRY.match("add_person_role", cmd)
             if match:
                 name = match.group(1).strip()
                 role = match.group(2).strip()
@@ -2688,16 +5867,16 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
                     return result
             
         # Check for yes/no confirmations
-        yes_match = re.match(FIELD_PATTERNS["yes_confirm"], cmd, re.IGNORECASE)
+        yes_match = FIELD_PATTERN_REGISTRY.match("yes_confirm", cmd)
         if yes_match:
             return {"yes_confirm": True}
             
-        no_match = re.match(FIELD_PATTERNS["no_confirm"], cmd, re.IGNORECASE)
+        no_match = FIELD_PATTERN_REGISTRY.match("no_confirm", cmd)
         if no_match:
             return {"no_confirm": True}
             
-        # Check for field-specific patterns
-        for raw_field, pattern in FIELD_PATTERNS.items():
+        # Check for field-specific patterns that can match this command
+        for raw_field, pattern in FIELD_PATTERN_REGISTRY.candidates(cmd):
             # Skip non-field patterns
             if raw_field in ["reset", "delete", "correct", "clear", "help", "add_person_role",
                         "undo_last", "context_add", "summary", "detailed", 
@@ -2709,7 +5888,7 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
                         "correct_simple"]:
                 continue
                 
-            match = re.match(pattern, cmd, re.IGNORECASE)
+            match = pattern.match(cmd)
             if not match:
                 continue
                 
@@ -2866,7 +6045,7 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
             return result
         
         # Check for deletion commands
-        delete_match = re.match(FIELD_PATTERNS["delete"], cmd, re.IGNORECASE)
+        delete_match = FIELD_PATTERN_REGISTRY.match("delete", cmd)
         if delete_match:
             groups = delete_match.groups()
             category = None
@@ -2880,14 +6059,14 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
             return {"delete": {"category": category, "value": value}}
         
         # Check for delete entire category
-        delete_entire_match = re.match(FIELD_PATTERNS["delete_entire"], cmd, re.IGNORECASE)
+        delete_entire_match = FIELD_PATTERN_REGISTRY.match("delete_entire", cmd)
         if delete_entire_match:
             field = delete_entire_match.group(1).lower()
             mapped_field = FIELD_MAPPING.get(field, field)
             return {mapped_field: {"delete": True}}
         
         # Check for correction commands
-        correct_match = re.match(FIELD_PATTERNS["correct"], cmd, re.IGNORECASE)
+        correct_match = FIELD_PATTERN_REGISTRY.match("correct", cmd)
         if correct_match:
             raw_field = correct_match.group(1).lower() if correct_match.group(1) else None
             old_value = correct_match.group(2).strip() if correct_match.group(2) else None
@@ -2909,7 +6088,7 @@ def extract_single_command(cmd: str) -> Dict[str, Any]:
         return {}
     
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
-def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
+def extract_fields(text: str, chat_id: str = None, use_nlp: bool = True) -> Dict[str, Any]:
     """Extract fields from text input with enhanced error handling and field validation"""
     try:
         # Print marker to confirm this function is being used
@@ -2917,16 +6096,28 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
         log_event("extract_fields_real", input=text[:100])
         
         result: Dict[str, Any] = {}
-        normalized_text = re.sub(r'[.!?]\s*$', '', text.strip())
+        normalized_text = as_utterance(text).normalized
+        
+        wants_nlp = use_nlp and CONFIG.get("ENABLE_NLP_EXTRACTION", False) and segment_uses_nlp(text)
+        
+        # Commands the grammar covers need neither NLP nor the patterns below, but only
+        # for texts that would not go to the LLM anyway: a free-form sentence can open
+        # like a command. Corrections and pronouns are resolved against the report and
+        # conversation further down.
+        command = None if wants_nlp else normalized_text.command
+        if command is not None and not isinstance(command, CorrectionCommand) \
+                and not re.search(r'\b(it|this|that|him|her|he|she|they|them)\b', normalized_text, re.IGNORECASE):
+            log_event("command_parsed", command=type(command).__name__)
+            return command.to_fields()
         
         # CHECK FOR CORRECTIONS FIRST - BEFORE NLP!
         if re.match(r'^correct\s+spelling', normalized_text, re.IGNORECASE):
             print(f"DEBUG: Correction command detected, skipping NLP")
             # Skip NLP entirely for correction commands
         # Try NLP extraction if enabled and text doesn't look like a command
-        elif CONFIG.get("ENABLE_NLP_EXTRACTION", False):
-            # Skip NLP for obvious commands (now including "correct")
-            if not re.match(r'^(?:yes|no|help|new|reset|undo|export|summarize|detailed|delete|clear)\b', normalized_text.lower()):
+        elif use_nlp and CONFIG.get("ENABLE_NLP_EXTRACTION", False):
+            # Skip NLP for obvious commands (now including "correct") and inputs the intent classifier routes to regex
+            if wants_nlp:
                 nlp_data, confidence = extract_with_nlp(text)
                 if confidence >= CONFIG.get("NLP_EXTRACTION_CONFIDENCE_THRESHOLD", 0.7):
                     log_event("using_nlp_extraction", confidence=confidence, fields=list(nlp_data.keys()))
@@ -3006,7 +6197,7 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
         
         # Handle simple delete commands FIRST - before any pattern matching
         delete_value_pattern = r'^delete\s+(.+?)$'
-        delete_match = re.match(delete_value_pattern, normalized_text.lower())
+        delete_match = re.match(delete_value_pattern, normalized_text.lowered)
         if delete_match:
             value = delete_match.group(1).strip()
             
@@ -3019,7 +6210,7 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
         
         # Also handle "clear" as delete
         clear_category_pattern = r'^clear\s+(services|tools|companies|people|activities|issues|roles|segment|category|weather|time|impression|comments)$'
-        clear_match = re.match(clear_category_pattern, normalized_text.lower())
+        clear_match = re.match(clear_category_pattern, normalized_text.lowered)
         if clear_match:
             category = clear_match.group(1)
             return {"delete": {"value": None, "category": category}}
@@ -3348,7 +6539,7 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
             return {"reset": True}
         
         # Handle update/change/set commands
-        update_match = re.match(FIELD_PATTERNS.get("update_field", ""), normalized_text, re.IGNORECASE)
+        update_match = FIELD_PATTERN_REGISTRY.match("update_field", normalized_text)
         if update_match:
             field_name = update_match.group(1).lower()
             new_value = update_match.group(2).strip()
@@ -3375,19 +6566,19 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
         
         # Try FIELD_PATTERNS first for structured commands
         # If NLP already extracted data successfully, return it
-        if CONFIG.get("ENABLE_NLP_EXTRACTION", False) and nlp_data:
+        if use_nlp and CONFIG.get("ENABLE_NLP_EXTRACTION", False) and nlp_data:
             return nlp_data
             
         # Try FIELD_PATTERNS first for structured commands
-        for field, pattern in FIELD_PATTERNS.items():
-            match = re.match(pattern, normalized_text, re.IGNORECASE)
+        for field, pattern in FIELD_PATTERN_REGISTRY.candidates(normalized_text):
+            match = pattern.match(normalized_text)
             if match:
                 if field == "site_name":
                     result["site_name"] = match.group(1).strip()
                     return result
                 elif field == "segment":
-                    if re.match(FIELD_PATTERNS["segment_category"], normalized_text, re.IGNORECASE):
-                        match = re.match(FIELD_PATTERNS["segment_category"], normalized_text, re.IGNORECASE)
+                    if FIELD_PATTERN_REGISTRY.match("segment_category", normalized_text):
+                        match = FIELD_PATTERN_REGISTRY.match("segment_category", normalized_text)
                         result["segment"] = match.group(1).strip()
                         result["category"] = match.group(2).strip()
                     else:
@@ -3806,7 +6997,7 @@ def extract_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
             log_event("detected_free_form_report", length=len(text))
             
             # Use NLP for free-form extraction
-            if CONFIG.get("ENABLE_NLP_EXTRACTION", False):
+            if use_nlp and CONFIG.get("ENABLE_NLP_EXTRACTION", False):
                 nlp_data, confidence = extract_with_nlp(text)
                 if confidence >= 0.5:  # Lower threshold for free-form text
                     log_event("free_form_nlp_extraction", confidence=confidence, fields=list(nlp_data.keys()))
@@ -3853,12 +7044,11 @@ def extract_fields_with_regex(text: str, chat_id: str = None) -> Dict[str, Any]:
     """Extract fields using regex patterns only"""
     try:
         result: Dict[str, Any] = {}
-        normalized_text = re.sub(r'[.!?]\s*$', '', text.strip())
+        normalized_text = as_utterance(text).normalized
         
         # First check for correction commands to prioritize them
-        correct_pattern = FIELD_PATTERNS.get("correct")
-        if correct_pattern:
-            match = re.match(correct_pattern, normalized_text, re.IGNORECASE)
+        if "correct" in FIELD_PATTERN_REGISTRY:
+            match = FIELD_PATTERN_REGISTRY.match("correct", normalized_text)
             if match:
                 old_value = match.group(1).strip()
                 field_name = match.group(2).strip()
@@ -3866,10 +7056,10 @@ def extract_fields_with_regex(text: str, chat_id: str = None) -> Dict[str, Any]:
                 result["correct"] = [{"field": FIELD_MAPPING.get(field_name, field_name), "old": old_value, "new": new_value}]
                 return result
 
-        for field, pattern in FIELD_PATTERNS.items():
+        for field, pattern in FIELD_PATTERN_REGISTRY.candidates(normalized_text):
             if field == "correct":  # Skip since we checked it first
                 continue
-            match = re.match(pattern, normalized_text, re.IGNORECASE)
+            match = pattern.match(normalized_text)
             if match:
                 if field in ["site_name", "segment", "category", "impression", "weather", "time", "comments"]:
                     result[field] = match.group(1).strip()
@@ -3894,6 +7084,63 @@ def extract_fields_with_regex(text: str, chat_id: str = None) -> Dict[str, Any]:
         log_event("extract_fields_regex_error", error=str(e))
         return {}
 
+# --- Speculative Extraction ---
+_speculative_executor = ThreadPoolExecutor(max_workers=CONFIG["SPECULATIVE_NLP_WORKERS"], thread_name_prefix="speculative-nlp")
+_extraction_path_lock = threading.Lock()
+extraction_path_counts: Dict[str, int] = defaultdict(int)
+
+def _record_extraction_path(path: str, started: float, text: str) -> None:
+    with _extraction_path_lock:
+        extraction_path_counts[path] += 1
+    log_event("speculative_extraction", winner=path, elapsed_ms=round((time() - started) * 1000, 1),
+              text_length=len(text))
+
+def extract_fields_speculative(text: str, chat_id: str = None) -> Dict[str, Any]:
+    """Run the deterministic parser and the NLP call concurrently; the first confident result wins.
+    
+    A match from extract_single_command is returned at once. Otherwise the NLP result is
+    awaited for what is left of NLP_LATENCY_BUDGET, and if it is missing, late or not
+    confident the regex-only extract_fields pipeline answers instead.
+    """
+    started = time()
+    nlp_future = None
+    if CONFIG.get("ENABLE_NLP_EXTRACTION", False) and segment_uses_nlp(text):
+        # Run in a copy of this context so the call is attributed to the current chat
+        nlp_future = _speculative_executor.submit(contextvars.copy_context().run, extract_with_nlp, text)
+    
+    regex_result = extract_single_command(as_utterance(text).normalized)
+    if regex_result:
+        if nlp_future is not None:
+            # A call that already started finishes in the background and still fills the NLP cache
+            nlp_future.cancel()
+        _record_extraction_path("regex", started, text)
+        return regex_result
+    
+    if nlp_future is not None:
+        remaining = max(0.0, CONFIG["NLP_LATENCY_BUDGET"] - (time() - started))
+        try:
+            _, confidence = nlp_future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            _record_extraction_path("nlp_timeout", started, text)
+        else:
+            threshold = 0.5 if len(text) > 50 else CONFIG.get("NLP_EXTRACTION_CONFIDENCE_THRESHOLD", 0.7)
+            if confidence >= threshold:
+                # The result is in the NLP cache now, so this returns it without another request
+                result = extract_fields(text, chat_id)
+                _record_extraction_path("nlp", started, text)
+                return result
+            _record_extraction_path("nlp_low_confidence", started, text)
+    else:
+        _record_extraction_path("regex_only", started, text)
+    
+    return extract_fields(text, chat_id, use_nlp=False)
+
+def extract_fields_for_mode(text: str, chat_id: str = None) -> Dict[str, Any]:
+    """Extract fields with the configured EXTRACTION_MODE"""
+    if CONFIG["EXTRACTION_MODE"] == "speculative":
+        return extract_fields_speculative(text, chat_id)
+    return extract_fields(text, chat_id)
+
 def hybrid_field_extraction(text: str, chat_id: str = None) -> Dict[str, Any]:
     """Use hybrid approach combining regex and NLP"""
     result = {}
@@ -4777,13 +8024,41 @@ def handle_export(chat_id: str, session: Dict[str, Any]) -> None:
     pdf_buffer = generate_pdf(session["structured_data"], report_type, photos, chat_id)
 
     if pdf_buffer:
+        # Keep exported reports for the weekly digest
+        archive_report(chat_id, session["structured_data"])
         if send_pdf(chat_id, pdf_buffer, report_type):
             send_message(chat_id, "PDF report sent successfully!")
         else:
             send_message(chat_id, "⚠️ Failed to send PDF report. Please try again.")
+        save_session(session_data)
     else:
         send_message(chat_id, "⚠️ Failed to generate PDF report. Please check your report data.")
 
+@command("digest")
+@command("weekly digest")
+def handle_digest(chat_id: str, session: Dict[str, Any]) -> None:
+    """Handle digest command: one PDF with every report exported in the last days"""
+    days = CONFIG["DIGEST_DAYS"]
+    since = get_berlin_time() - timedelta(days=days)
+    site = session.get("structured_data", {}).get("site_name") or None
+    reports = iter_archived_reports(chat_id, since=since, site=site)
+    
+    title = f"Site Digest – {site}" if site else "Site Digest"
+    subtitle = f"{since.strftime('%d-%m-%Y')} to {get_berlin_time().strftime('%d-%m-%Y')}"
+    digest_file = generate_digest_pdf(reports, title=title, subtitle=subtitle)
+    if digest_file is None:
+        send_message(chat_id, f"No exported reports found for the last {days} days. Reports are added to the digest when you export them.")
+        return
+    
+    with digest_file:
+        site_slug = (site or "all_sites").lower().replace(" ", "_")
+        filename = f"{datetime.now().strftime('%d%m%Y')}_{site_slug}_digest.pdf"
+        if send_pdf(chat_id, digest_file, "digest", filename=filename):
+            send_message(chat_id, "Digest sent successfully!")
+        else:
+            send_message(chat_id, "⚠️ Failed to send the digest. Please try again.")
+    save_session(session_data)
+
 
 @command("summary")
 def handle_summary(chat_id: str, session: Dict[str, Any]) -> None:
@@ -4829,6 +8104,7 @@ def handle_help(chat_id: str, session: Dict[str, Any], topic: str = "general") -
             "• Delete information: 'delete John from people' or 'tools: none'\n"
             "• Correct information: 'correct site Central Plaza to Downtown Project'\n"
             "• Export report: 'export pdf' or 'export report'\n"
+            "• Weekly digest: 'digest' (one PDF of your recently exported reports)\n"
             "• Reset report: 'reset' or 'new report'\n"
             "• Undo changes: 'undo' or 'undo last'\n"
             "• Get status: 'status'\n\n"
@@ -4858,6 +8134,7 @@ def handle_help(chat_id: str, session: Dict[str, Any], topic: str = "general") -
             "• undo - Revert last major change\n"
             "• undo last - Revert last field change\n"
             "• export/export pdf/export report - Generate PDF report\n"
+            "• digest/weekly digest - PDF digest of recently exported reports\n"
             "• summary - Generate summary report\n"
             "• detailed - Generate detailed report\n"
             "• help - Show this help\n"
@@ -4947,6 +8224,7 @@ COMMAND_HANDLERS["/reset"] = handle_reset
 COMMAND_HANDLERS["/status"] = handle_status
 COMMAND_HANDLERS["/undo"] = handle_undo
 COMMAND_HANDLERS["/export"] = handle_export
+COMMAND_HANDLERS["/digest"] = handle_digest
 COMMAND_HANDLERS["export report"] = handle_export
 COMMAND_HANDLERS["/help"] = handle_help
 COMMAND_HANDLERS["undo last change"] = handle_undo_last
@@ -4961,11 +8239,12 @@ def recognize_intent(text: str) -> Dict[str, Any]:
         "begin a new report", "start over", "start fresh"
     ]
     
+    text_lower = as_utterance(text).lowered
     for phrase in reset_phrases:
-        if phrase in text.lower():
+        if phrase in text_lower:
             return {"reset": True}
     
-    delete_match = re.search(r"delete\s+(.+?)(?:\s+from\s+(.+))?", text.lower())
+    delete_match = re.search(r"delete\s+(.+?)(?:\s+from\s+(.+))?", text_lower)
     if delete_match:
         category = delete_match.group(2)
         value = delete_match.group(1)
@@ -4984,6 +8263,10 @@ def extract_multiple_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
     # Split by commas but preserve commands
     parts = re.split(r',\s*(?=add\s|delete\s|remove\s)', text)
     
+    # One request for all parts; extract_fields then reuses confident results from the request memo
+    if CONFIG.get("ENABLE_NLP_EXTRACTION", False):
+        extract_batch_with_nlp([part.strip() for part in parts if part.strip()])
+    
     for part in parts:
         part = part.strip()
         if not part:
@@ -5026,16 +8309,19 @@ def extract_multiple_fields(text: str, chat_id: str = None) -> Dict[str, Any]:
 
 # Part 12 Handle Commands 
 @rate_limit(max_calls=30, time_window=60)  # 30 commands per minute
+@with_chat_lock
 def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[str, int]:
     """Process user command and update session data"""
     try:
+        text = as_utterance(text)
         # Update last interaction time
         session["last_interaction"] = time()
+        intent_router.record_message()
         
         # Handle confirmation for reset command
         if session.get("awaiting_reset_confirmation", False):
             # Normalize the text for confirmation
-            confirm_text = text.lower().strip()
+            confirm_text = text.lowered.strip()
             if confirm_text in ["yes", "y", "ya", "yeah", "yep", "yup", "sure", "ok", "okay"]:
                 # User confirmed - perform the reset HERE
                 session["awaiting_reset_confirmation"] = False
@@ -5052,7 +8338,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                 send_message(chat_id, f"**Report reset**\n\n{summary}\n\nSpeak or type your first category (e.g., 'site Downtown Project').")
                 return "ok", 200
 
-            elif text.lower() in ["no", "n", "nope", "nah"]:
+            elif text.lowered in ["no", "n", "nope", "nah"]:
                 session["awaiting_reset_confirmation"] = False
                 save_session(session_data)
                 send_message(chat_id, "Reset cancelled. Your report was not changed.")
@@ -5062,8 +8348,8 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                 return "ok", 200
         
         # Handle conversational intents
-        if re.match(FIELD_PATTERNS["conversation"], text, re.IGNORECASE):
-            conversation_match = re.match(FIELD_PATTERNS["conversation"], text, re.IGNORECASE)
+        if FIELD_PATTERN_REGISTRY.match("conversation", text):
+            conversation_match = FIELD_PATTERN_REGISTRY.match("conversation", text)
             intent_text = conversation_match.group(1)
             intent = recognize_intent(intent_text)
             if intent:
@@ -5102,7 +8388,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                 send_message(chat_id, f"✅ Corrected {field} from '{old_value}' to '{new_value}'.\n\n{summary}")
                 return "ok", 200
             # Check for yes confirmation
-            elif re.match(FIELD_PATTERNS["yes_confirm"], text, re.IGNORECASE):
+            elif FIELD_PATTERN_REGISTRY.match("yes_confirm", text):
                 field = session["awaiting_spelling_correction"]["field"]
                 old_value = session["awaiting_spelling_correction"]["old_value"]
                 session["awaiting_spelling_correction"] = {
@@ -5115,7 +8401,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                 send_message(chat_id, f"Please enter the correct spelling for '{old_value}' in {field}:")
                 return "ok", 200
             # Check for no confirmation
-            elif re.match(FIELD_PATTERNS["no_confirm"], text, re.IGNORECASE):
+            elif FIELD_PATTERN_REGISTRY.match("no_confirm", text):
                 session["awaiting_spelling_correction"] = {"active": False, "field": None, "old_value": None}
                 save_session(session_data)
                 send_message(chat_id, "Correction cancelled.")
@@ -5126,7 +8412,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                 return "ok", 200
                 
         # Check for exact command matches
-        clean_text = text.lower().strip()
+        clean_text = text.lowered.strip()
         if clean_text in COMMAND_HANDLERS:
             COMMAND_HANDLERS[clean_text](chat_id, session)
             return "ok", 200
@@ -5135,8 +8421,16 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
         # For free-form reports, make sure to use NLP extraction ONLY if no structured command
         if CONFIG["ENABLE_NLP_EXTRACTION"] and len(text) > 50:
             # Skip NLP for obvious commands
-            if not any(text.lower().startswith(cmd) for cmd in ["add", "delete", "correct", "export", "help", "status", "new", "reset"]):
-                nlp_data, confidence = extract_with_nlp(text)
+            if not any(text.lowered.startswith(cmd) for cmd in ["add", "delete", "correct", "export", "help", "status", "new", "reset"]):
+                if CONFIG["NLP_STREAMING"]:
+                    progress = ProgressiveSummary(chat_id, session["structured_data"])
+                    nlp_data, confidence = stream_extract_with_nlp(text, on_field=progress.add_field)
+                    if confidence >= CONFIG["NLP_EXTRACTION_CONFIDENCE_THRESHOLD"]:
+                        progress.flush()
+                    else:
+                        progress.discard()
+                else:
+                    nlp_data, confidence = extract_with_nlp(text)
                 if confidence >= CONFIG["NLP_EXTRACTION_CONFIDENCE_THRESHOLD"]:
                     log_event("free_form_nlp_extraction", confidence=confidence)
                     session_data[chat_id]["command_history"].append(session_data[chat_id]["structured_data"].copy())
@@ -5152,10 +8446,9 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
 
         # For complex commands with multiple fields (especially from voice)
         # Check if this looks like multiple commands in one
-        if len(text) > 50 and "," in text and text.lower().startswith("add"):
-            # Count how many field keywords are in the text
-            field_keywords = ["company", "companies", "people", "person", "activities", "issue", "tool", "service"]
-            keyword_count = sum(1 for keyword in field_keywords if keyword in text.lower())
+        if len(text) > 50 and "," in text and text.lowered.startswith("add"):
+            # Count how many fields are named by a keyword in the text
+            keyword_count = len(text.field_keywords & {"companies", "people", "activities", "issues", "tools", "services"})
             
             # If multiple field keywords found, use multi-field extraction
             if keyword_count >= 2:
@@ -5171,7 +8464,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
                     return "ok", 200
         
         # Special handling for multiple company corrections
-        if "correct spelling" in text.lower() and text.count(" to ") == 2:
+        if "correct spelling" in text.lowered and text.count(" to ") == 2:
             # Pattern: "correct spelling X to Y and A to B"
             parts = text.split(" and ")
             if len(parts) == 2:
@@ -5229,7 +8522,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
         
         
         # Extract fields from input (single command processing)
-        extracted = extract_fields(text, chat_id)
+        extracted = extract_fields_for_mode(text, chat_id)
         
         # Log what was extracted for debugging
         log_event("extracted_data", data=extracted)
@@ -5240,7 +8533,7 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
             suggestions = []
             
             # Check what might have been intended
-            text_lower = text.lower()
+            text_lower = text.lowered
             if any(field in text_lower for field in ["site", "segment", "category", "weather", "time", "impression"]):
                 suggestions.append("Try format: 'weather: rainy' or 'weather rainy'")
             elif any(field in text_lower for field in ["company", "companies", "firm"]):
@@ -5385,7 +8678,11 @@ def handle_command(chat_id: str, text: str, session: Dict[str, Any]) -> tuple[st
 def process_chained_commands(text: str, chat_id: str) -> List[Dict[str, Any]]:
     """Process multiple commands in a single message"""
     # Split text on semicolons and periods that aren't part of numbers
-    command_texts = re.split(r'(?<!\d)[;.]\s+', text)
+    command_texts = as_utterance(text).clauses
+    
+    # One request for all commands; extract_fields then reuses confident results from the request memo
+    if CONFIG.get("ENABLE_NLP_EXTRACTION", False):
+        extract_batch_with_nlp([cmd_text for cmd_text in command_texts if cmd_text.strip()])
     
     results = []
     for cmd_text in command_texts:
@@ -5402,6 +8699,7 @@ def process_chained_commands(text: str, chat_id: str) -> List[Dict[str, Any]]:
 # Part 13 Construction Site Report Bot
 
 @app.route("/webhook", methods=["POST"])
+@request_scoped
 def webhook() -> tuple[str, int]:
     """Handle incoming webhook from Telegram"""
     try:
@@ -5429,48 +8727,69 @@ def webhook() -> tuple[str, int]:
             return "ok", 200
             
         chat_id = str(message["chat"]["id"])
+        current_chat_id.set(chat_id)
         
         # Initialize session if not exists
-        # Initialize session if not exists
-        if chat_id not in session_data:
-            session_data[chat_id] = {
-                "structured_data": blank_report(),
-                "command_history": deque(maxlen=CONFIG["MAX_HISTORY"]),
-                "last_change_history": [],
-                "last_interaction": time(),
-                "context": {
-                    "last_mentioned_person": None,
-                    "last_mentioned_item": None,
-                    "last_field": None,
-                },
-                "report_format": CONFIG["REPORT_FORMAT"],
-                "awaiting_reset_confirmation": False,
-                "awaiting_spelling_correction": {
-                    "active": False,
-                    "field": None,
-                    "old_value": None
-                },
-                "photos": [],
-            }
-            save_session(session_data)
+        with chat_lock(chat_id):
+            if chat_id not in session_data:
+                session_data[chat_id] = {
+                    "structured_data": blank_report(),
+                    "command_history": deque(maxlen=CONFIG["MAX_HISTORY"]),
+                    "last_change_history": [],
+                    "last_interaction": time(),
+                    "context": {
+                        "last_mentioned_person": None,
+                        "last_mentioned_item": None,
+                        "last_field": None,
+                    },
+                    "report_format": CONFIG["REPORT_FORMAT"],
+                    "awaiting_reset_confirmation": False,
+                    "awaiting_spelling_correction": {
+                        "active": False,
+                        "field": None,
+                        "old_value": None
+                    },
+                    "photos": [],
+                }
+                save_session(session_data)
             
         
     
         # Handle voice messages
         if "voice" in message:
+            pipeline = VoicePipeline(chat_id, message["voice"])
+            outcome = "error"
             try:
-                file_id = message["voice"]["file_id"]
-                if message["voice"].get("duration", 0) > 20:  # If longer than 20 seconds
-                    send_message(chat_id, "I'm processing your detailed report. This may take a moment...")
-                text, confidence = transcribe_voice(file_id)
+                if pipeline.duration > CONFIG["MAX_VOICE_SECONDS"] or pipeline.file_size > CONFIG["MAX_VOICE_BYTES"]:
+                    log_event("voice_rejected_too_large", chat_id=chat_id, duration=pipeline.duration,
+                              file_size=pipeline.file_size)
+                    send_message(chat_id, f"⚠️ That voice message is too long for me. Please keep voice reports under "
+                                          f"{CONFIG['MAX_VOICE_SECONDS'] // 60} minutes, or split them into several messages.")
+                    outcome = "too_large"
+                    return "ok", 200
+                backend = select_transcription_backend(chat_id, pipeline.file_size or None)
+                if not backend.available() and not cached_transcription(pipeline.file_unique_id, backend.name):
+                    log_event("voice_rejected_degraded", chat_id=chat_id)
+                    send_message(chat_id, "⚠️ Voice transcription is temporarily unavailable because our speech service is not responding. "
+                                          "Please type your update for now - text commands still work.")
+                    outcome = "degraded"
+                    return "ok", 200
+                transcription = pipeline.transcribe()
+                if pipeline.duration > 20:  # If longer than 20 seconds
+                    pipeline.acknowledge("I'm processing your detailed report. This may take a moment...")
+                text, confidence = transcription.result()
                 
                 # Normalize company names that were incorrectly split by voice transcription
-                text = normalize_voice_companies(text)
+                with timed_stage(pipeline.timings, "normalize_companies"):
+                    text = Utterance(normalize_voice_companies(text))
                 log_event("voice_normalized", original=text, normalized=text)
+                pipeline.wait_for_acknowledgment()
+                # The session is read and changed from here on
+                pipeline.lock_session()
 
                 # Special handling for number responses (for photo assignment)
                 # Handle both with and without period
-                text_cleaned = text.strip().lower().rstrip('.')
+                text_cleaned = text.lowered.strip().rstrip('.')
                 number_map = {
                     'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
                     'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
@@ -5498,25 +8817,27 @@ def webhook() -> tuple[str, int]:
                                 break
                         send_message(chat_id, f"📸 Photo attached to issue {issue_index + 1}")
                         save_session(session_data)
+                        outcome = "photo_assignment"
                         return "ok", 200
                     else:
                         send_message(chat_id, f"Issue {text} not found. Please enter a valid issue number.")
+                        outcome = "photo_assignment"
                         return "ok", 200
                 
                 # For short commands (less than 5 words), lower the threshold
-                if len(text.split()) < 5 and any(cmd in text.lower() for cmd in ["delete", "add", "category", "reset", "export", "segment", "site", "new", "yes", "no"]):
+                if len(text.words) < 5 and any(cmd in text.lowered for cmd in ["delete", "add", "category", "reset", "export", "segment", "site", "new", "yes", "no"]):
                     confidence_threshold = 0.3
                 # For field-based inputs with multiple keywords, also lower threshold
-                elif any(keyword in text.lower() for keyword in ["category", "companies", "segment", "people", "tools", "services", "activities", "issues", "firms", "westfield", "plaza", "commercial"]):
+                elif any(keyword in text.lowered for keyword in ["category", "companies", "segment", "people", "tools", "services", "activities", "issues", "firms", "westfield", "plaza", "commercial"]):
                     confidence_threshold = 0.35
                 # For messages containing "add" and "site"
-                elif "add" in text.lower() and "site" in text.lower():
+                elif "add" in text.lowered and "site" in text.lowered:
                     confidence_threshold = 0.4
                 else:
                     confidence_threshold = 0.45  # Lowered from 0.5
 
                 # Force process short confirmations even if low confidence
-                if len(text.split()) < 3 and text.lower() in ['yes', 'no', 'new', 'reset']:
+                if len(text.words) < 3 and text.lowered in ['yes', 'no', 'new', 'reset']:
                     confidence = 1.0  # Override for critical short commands
                 
                 if not text or confidence < confidence_threshold:
@@ -5527,208 +8848,220 @@ def webhook() -> tuple[str, int]:
                         
                     error_message += "\n\nWhen recording, try to:\n• Speak clearly and slowly\n• Reduce background noise\n• Keep the phone close to your mouth"
                     send_message(chat_id, error_message)
+                    outcome = "low_confidence"
                     return "ok", 200
                     
-                if CONFIG["ENABLE_FREEFORM_EXTRACTION"] and is_free_form_report(text):
-                    send_message(chat_id, "Processing your detailed report...")
+                # Long notes were acknowledged already
+                if pipeline.acknowledged is None and CONFIG["ENABLE_FREEFORM_EXTRACTION"] and is_free_form_report(text):
+                    with timed_stage(pipeline.timings, "acknowledge"):
+                        send_message(chat_id, "Processing your detailed report...")
                     
                 log_event("processing_voice_command", text=text, confidence=confidence)
-                return handle_command(chat_id, text, session_data[chat_id])
+                with timed_stage(pipeline.timings, "handle_command"):
+                    response = handle_command(chat_id, text, session_data[chat_id])
+                outcome = "handled"
+                return response
 
             except Exception as e:
                 log_event("voice_processing_error", error=str(e))
                 send_message(chat_id, "⚠️ There was an error processing your voice message. Please try again or type your message.")
                 return "ok", 200
+            finally:
+                pipeline.unlock_session()
+                pipeline.report(outcome)
 
         # Handle photo messages
         if "photo" in message:
-            try:
-                # Get the largest photo
-                photo = message["photo"][-1]
-                file_id = photo["file_id"]
+            with chat_lock(chat_id):
+                try:
+                    # Get the largest size the PDF export is allowed to download
+                    photo = next((size for size in reversed(message["photo"])
+                                  if size.get("file_size", 0) <= CONFIG["MAX_PHOTO_BYTES"]), message["photo"][0])
+                    file_id = photo["file_id"]
                 
-                # Check if there's a caption
-                caption = message.get("caption", "")
+                    # Check if there's a caption
+                    caption = message.get("caption", "")
                 
-                # Store photo reference in session
-                if "photos" not in session_data[chat_id]:
-                    session_data[chat_id]["photos"] = []
+                    # Store photo reference in session
+                    if "photos" not in session_data[chat_id]:
+                        session_data[chat_id]["photos"] = []
                 
-                # If caption mentions an issue, link it automatically
-                # Convert word numbers to digits for photo assignment
-                number_words = {
-                    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
-                    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
-                    'first': '1', 'second': '2', 'third': '3', 'fourth': '4', 'fifth': '5'
-                }
+                    # If caption mentions an issue, link it automatically
+                    # Convert word numbers to digits for photo assignment
+                    number_words = {
+                        'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+                        'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+                        'first': '1', 'second': '2', 'third': '3', 'fourth': '4', 'fifth': '5'
+                    }
                 
-                # Only process if caption exists and looks like a number word
-                if caption:
-                    caption_lower = caption.lower().strip().rstrip('.')
-                    if caption_lower in number_words:
-                        caption = number_words[caption_lower]
+                    # Only process if caption exists and looks like a number word
+                    if caption:
+                        caption_lower = caption.lower().strip().rstrip('.')
+                        if caption_lower in number_words:
+                            caption = number_words[caption_lower]
                 
-                # Check if this is a response to a photo question
-                pending_photos = [p for p in session_data[chat_id].get("photos", []) if p.get("pending")]
+                    # Check if this is a response to a photo question
+                    pending_photos = [p for p in session_data[chat_id].get("photos", []) if p.get("pending")]
                 
-                if pending_photos and caption and caption.strip().isdigit():
-                    issue_index = int(caption.strip()) - 1
-                    issue_index = int(text.strip()) - 1
-                    issues = session_data[chat_id]["structured_data"].get("issues", [])
-                    if 0 <= issue_index < len(issues):
-                        # Update the pending photo
-                        for photo in session_data[chat_id]["photos"]:
-                            if photo.get("pending"):
-                                photo["pending"] = False
-                                photo["issue_ref"] = str(issue_index + 1)
-                                photo["caption"] = f"Photo for issue {issue_index + 1}"
-                                # Mark this issue as having a photo
-                                issues[issue_index]["has_photo"] = True
-                                break
-                        send_message(chat_id, f"📸 Photo attached to issue {issue_index + 1}")
-                        save_session(session_data)
-                        return "ok", 200
+                    if pending_photos and caption and caption.strip().isdigit():
+                        issue_index = int(caption.strip()) - 1
+                        issue_index = int(text.strip()) - 1
+                        issues = session_data[chat_id]["structured_data"].get("issues", [])
+                        if 0 <= issue_index < len(issues):
+                            # Update the pending photo
+                            for photo in session_data[chat_id]["photos"]:
+                                if photo.get("pending"):
+                                    photo["pending"] = False
+                                    photo["issue_ref"] = str(issue_index + 1)
+                                    photo["caption"] = f"Photo for issue {issue_index + 1}"
+                                    # Mark this issue as having a photo
+                                    issues[issue_index]["has_photo"] = True
+                                    break
+                            send_message(chat_id, f"📸 Photo attached to issue {issue_index + 1}")
+                            save_session(session_data)
+                            return "ok", 200
             
                 
-                # If caption mentions an issue, link it automatically
-                if caption:
-                    # Try to extract issue reference from caption
-                    issue_patterns = [
-                        r'issue\s*#?(\d+)',  # "issue 1" or "issue #1"
-                        r'problem\s*#?(\d+)',  # "problem 1"
-                        r'for\s+(.+)',  # "for crack in wall"
-                    ]
+                    # If caption mentions an issue, link it automatically
+                    if caption:
+                        # Try to extract issue reference from caption
+                        issue_patterns = [
+                            r'issue\s*#?(\d+)',  # "issue 1" or "issue #1"
+                            r'problem\s*#?(\d+)',  # "problem 1"
+                            r'for\s+(.+)',  # "for crack in wall"
+                        ]
+                    
+                        matched = False
+                        for pattern in issue_patterns:
+                            match = re.search(pattern, caption, re.IGNORECASE)
+                            if match:
+                                # Store photo with issue reference
+                                session_data[chat_id]["photos"].append({
+                                    "file_id": file_id,
+                                    "issue_ref": match.group(1),
+                                    "caption": caption
+                                })
+                                matched = True
+                                send_message(chat_id, f"📸 Photo attached to: {match.group(1)}")
+                                break
                     
-                    matched = False
-                    for pattern in issue_patterns:
-                        match = re.search(pattern, caption, re.IGNORECASE)
-                        if match:
-                            # Store photo with issue reference
+                        if not matched:
+                            # Just store with caption
                             session_data[chat_id]["photos"].append({
                                 "file_id": file_id,
-                                "issue_ref": match.group(1),
                                 "caption": caption
                             })
-                            matched = True
-                            send_message(chat_id, f"📸 Photo attached to: {match.group(1)}")
-                            break
-                    
-                    if not matched:
-                        # Just store with caption
+                            send_message(chat_id, "📸 Photo saved with caption: " + caption)
+                    else:
+                        # No caption, store as pending
                         session_data[chat_id]["photos"].append({
                             "file_id": file_id,
-                            "caption": caption
+                            "pending": True
                         })
-                        send_message(chat_id, "📸 Photo saved with caption: " + caption)
-                else:
-                    # No caption, store as pending
-                    session_data[chat_id]["photos"].append({
-                        "file_id": file_id,
-                        "pending": True
-                    })
                     
-                    # Check if there are any issues in the report
-                    issues = session_data[chat_id]["structured_data"].get("issues", [])
-                    if issues:
-                        issue_list = "\n".join([f"{i+1}. {issue.get('description', '')}" 
-                                               for i, issue in enumerate(issues)])
-                        send_message(chat_id, 
-                            f"📸 Photo received! Which issue does this belong to?\n\n{issue_list}\n\n"
-                            "Reply with the issue number (e.g., '1') or add a new issue with the photo.")
-                    else:
-                        send_message(chat_id, 
-                            "📸 Photo received! Add an issue description for this photo "
-                            "(e.g., 'issue: crack in wall on 3rd floor')")
+                        # Check if there are any issues in the report
+                        issues = session_data[chat_id]["structured_data"].get("issues", [])
+                        if issues:
+                            issue_list = "\n".join([f"{i+1}. {issue.get('description', '')}" 
+                                                   for i, issue in enumerate(issues)])
+                            send_message(chat_id, 
+                                f"📸 Photo received! Which issue does this belong to?\n\n{issue_list}\n\n"
+                                "Reply with the issue number (e.g., '1') or add a new issue with the photo.")
+                        else:
+                            send_message(chat_id, 
+                                "📸 Photo received! Add an issue description for this photo "
+                                "(e.g., 'issue: crack in wall on 3rd floor')")
                 
-                save_session(session_data)
-                return "ok", 200
-            except Exception as e:
-                log_event("photo_processing_error", error=str(e))
-                send_message(chat_id, "⚠️ Error processing photo. Please try again.")
-                return "ok", 200
+                    save_session(session_data)
+                    return "ok", 200
+                except Exception as e:
+                    log_event("photo_processing_error", error=str(e))
+                    send_message(chat_id, "⚠️ Error processing photo. Please try again.")
+                    return "ok", 200
                 
-                # Store photo reference in session
-                if "photos" not in session_data[chat_id]:
-                    session_data[chat_id]["photos"] = {}
+                    # Store photo reference in session
+                    if "photos" not in session_data[chat_id]:
+                        session_data[chat_id]["photos"] = {}
                 
-                # Ask which issue this photo belongs to
-                send_message(chat_id, "📸 Photo received! Which issue does this photo belong to? Reply with the issue number or description.")
-                session_data[chat_id]["pending_photo"] = file_id
-                save_session(session_data)
-                return "ok", 200
-            except Exception as e:
-                log_event("photo_processing_error", error=str(e))
-                send_message(chat_id, "⚠️ Error processing photo. Please try again.")
-                return "ok", 200    
+                    # Ask which issue this photo belongs to
+                    send_message(chat_id, "📸 Photo received! Which issue does this photo belong to? Reply with the issue number or description.")
+                    session_data[chat_id]["pending_photo"] = file_id
+                    save_session(session_data)
+                    return "ok", 200
+                except Exception as e:
+                    log_event("photo_processing_error", error=str(e))
+                    send_message(chat_id, "⚠️ Error processing photo. Please try again.")
+                    return "ok", 200    
         # Handle text messages
         if "text" in message:
-            text = message["text"].strip()
+            text = Utterance(message["text"].strip())
+            # Pending photo replies, reset confirmation and chained commands change the session too
+            with chat_lock(chat_id):
+                # Check if this is a response to a photo question
+                pending_photos = [p for p in session_data[chat_id].get("photos", []) if p.get("pending")]
             
-            # Check if this is a response to a photo question
-            pending_photos = [p for p in session_data[chat_id].get("photos", []) if p.get("pending")]
+                if pending_photos and text.strip().isdigit():
+                    issue_index = int(text.strip()) - 1
+                    issues = session_data[chat_id]["structured_data"].get("issues", [])
+                    if 0 <= issue_index < len(issues):
+                        # Update the pending photo
+                        for photo in session_data[chat_id]["photos"]:
+                            if photo.get("pending"):
+                                photo["pending"] = False
+                                photo["issue_ref"] = str(issue_index + 1)
+                                photo["caption"] = f"Photo for issue {issue_index + 1}"
+                                # Mark this issue as having a photo
+                                issues[issue_index]["has_photo"] = True
+                                break
+                        send_message(chat_id, f"📸 Photo attached to issue {issue_index + 1}")
+                        save_session(session_data)
+                        return "ok", 200
             
-            if pending_photos and text.strip().isdigit():
-                issue_index = int(text.strip()) - 1
-                issues = session_data[chat_id]["structured_data"].get("issues", [])
-                if 0 <= issue_index < len(issues):
-                    # Update the pending photo
-                    for photo in session_data[chat_id]["photos"]:
-                        if photo.get("pending"):
-                            photo["pending"] = False
-                            photo["issue_ref"] = str(issue_index + 1)
-                            photo["caption"] = f"Photo for issue {issue_index + 1}"
-                            # Mark this issue as having a photo
-                            issues[issue_index]["has_photo"] = True
-                            break
-                    send_message(chat_id, f"📸 Photo attached to issue {issue_index + 1}")
-                    save_session(session_data)
+                # Handle reset confirmation
+                if session_data[chat_id].get("awaiting_reset_confirmation", False):
+                    if text.lowered in ['yes', 'yeah', 'ok', 'sure', 'confirm', 'ja', 'jep', 'yes please']:
+                        handle_reset(chat_id, session_data[chat_id])
+                        session_data[chat_id]["awaiting_reset_confirmation"] = False
+                        save_session(session_data)
+                    elif text.lowered in ['no', 'nope', 'nah', 'negative', 'nein', 'nee', 'no thanks']:
+                        session_data[chat_id]["awaiting_reset_confirmation"] = False
+                        save_session(session_data)
+                        send_message(chat_id, "Reset cancelled. Your report was not changed.")
+                    else:
+                        send_message(chat_id, "Please reply with yes or no to confirm reset.")
                     return "ok", 200
             
-            # Handle reset confirmation
-            if session_data[chat_id].get("awaiting_reset_confirmation", False):
-                if text.lower() in ['yes', 'yeah', 'ok', 'sure', 'confirm', 'ja', 'jep', 'yes please']:
-                    handle_reset(chat_id, session_data[chat_id])
-                    session_data[chat_id]["awaiting_reset_confirmation"] = False
-                    save_session(session_data)
-                elif text.lower() in ['no', 'nope', 'nah', 'negative', 'nein', 'nee', 'no thanks']:
-                    session_data[chat_id]["awaiting_reset_confirmation"] = False
-                    save_session(session_data)
-                    send_message(chat_id, "Reset cancelled. Your report was not changed.")
-                else:
-                    send_message(chat_id, "Please reply with yes or no to confirm reset.")
-                return "ok", 200
-            
-            # Handle spelling correction
-            if session_data[chat_id].get("awaiting_spelling_correction", {}).get("active", False):
-                # ... keep existing spelling correction code ...
-                return "ok", 200
+                # Handle spelling correction
+                if session_data[chat_id].get("awaiting_spelling_correction", {}).get("active", False):
+                    # ... keep existing spelling correction code ...
+                    return "ok", 200
             
-            # Check for command chaining
-            if ";" in text or re.search(r'(?<!\d)\.\s+[A-Za-z]', text):
-                chained_commands = process_chained_commands(text, chat_id)
+                # Check for command chaining
+                if text.is_chained:
+                    chained_commands = process_chained_commands(text, chat_id)
                 
-                if chained_commands:
-                    # Process each command
-                    for i, extracted in enumerate(chained_commands):
-                        # Skip the first save_state to avoid duplicating
-                        if i == 0:
-                            session_data[chat_id]["command_history"].append(session_data[chat_id]["structured_data"].copy())
+                    if chained_commands:
+                        # Process each command
+                        for i, extracted in enumerate(chained_commands):
+                            # Skip the first save_state to avoid duplicating
+                            if i == 0:
+                                session_data[chat_id]["command_history"].append(session_data[chat_id]["structured_data"].copy())
                         
-                        session_data[chat_id]["structured_data"] = merge_data(
-                            session_data[chat_id]["structured_data"], 
-                            extracted, 
-                            chat_id
-                        )
+                            session_data[chat_id]["structured_data"] = merge_data(
+                                session_data[chat_id]["structured_data"], 
+                                extracted, 
+                                chat_id
+                            )
                     
-                    session_data[chat_id]["structured_data"] = enrich_date(session_data[chat_id]["structured_data"])
-                    save_session(session_data)
+                        session_data[chat_id]["structured_data"] = enrich_date(session_data[chat_id]["structured_data"])
+                        save_session(session_data)
                     
-                    send_message(chat_id, f"✅ Processed {len(chained_commands)} commands.\n\n{summarize_report(session_data[chat_id]['structured_data'])}")
-                    return "ok", 200
+                        send_message(chat_id, f"✅ Processed {len(chained_commands)} commands.\n\n{summarize_report(session_data[chat_id]['structured_data'])}")
+                        return "ok", 200
             
-            # Regular single command processing
-            log_event("processing_text_command", text=text)
-            return handle_command(chat_id, text, session_data[chat_id])
+                # Regular single command processing
+                log_event("processing_text_command", text=text)
+                return handle_command(chat_id, text, session_data[chat_id])
         
         # Handle other types of messages
         send_message(chat_id, "⚠️ I can only process text and voice messages. Please try again.")
@@ -5755,6 +9088,17 @@ def health_check():
         "telegram_connected": bool(TELEGRAM_TOKEN),
         "openai_connected": bool(OPENAI_API_KEY),
         "free_form_extraction": CONFIG["ENABLE_FREEFORM_EXTRACTION"],
+        "pdf_cache": pdf_render_cache.stats(),
+        "nlp_cache": nlp_result_cache.stats(),
+        "transcription_cache": transcription_cache.stats(),
+        "extraction_mode": CONFIG["EXTRACTION_MODE"],
+        "extraction_paths": dict(extraction_path_counts),
+        "prompt_pruning": prompt_pruning_summary(),
+        "request_memo": dict(request_memo_stats),
+        "intent_routing": intent_router.stats(),
+        "degraded_mode": not all(openai_available(operation) for operation in openai_breakers),
+        "circuit_breakers": {operation: breaker.snapshot() for operation, breaker in openai_breakers.items()},
+        "openai_usage": openai_usage.summary(),
         "bug_fixes": [
             "added confirmation for 'new report' command",
             "fixed deletion of people and items",
@@ -5764,6 +9108,16 @@ def health_check():
         ]
     }), 200
 
+@app.route("/admin/usage", methods=["GET"])
+def admin_usage():
+    """OpenAI usage per operation, model, chat and time window (requires ADMIN_TOKEN)"""
+    # Header only: a token in the query string would end up in access logs
+    token = request.headers.get("X-Admin-Token", "")
+    if not CONFIG["ADMIN_TOKEN"] or not hmac.compare_digest(token, CONFIG["ADMIN_TOKEN"]):
+        return jsonify({"error": "forbidden"}), 403
+    top = request.args.get("top", default=20, type=int)
+    return jsonify(openai_usage.report(chat_id=request.args.get("chat_id"), top=top)), 200
+
 @app.route("/keepalive", methods=["GET"])
 def keepalive():
     """Keepalive endpoint to prevent service shutdown"""
@@ -5783,7 +9137,62 @@ def index():
 
     }), 200
 
+def train_intent_cli(argv: List[str]) -> int:
+    """Train and calibrate the intent classifier on the built-in corpus and write the model artifact.
+    
+    Reports routing quality on the test split, whose templates neither fit nor
+    calibration saw, at INTENT_MIN_CONFIDENCE and a few other thresholds.
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="app.py train-intent", description=train_intent_cli.__doc__)
+    parser.add_argument("-o", "--output", default=CONFIG["INTENT_MODEL_PATH"])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+    
+    model = train_intent_classifier(args.seed)
+    test = split_intent_corpus(args.seed)["test"]
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+    print(f"{args.output}: {len(model.vocabulary)} features, temperature {model.temperature:.2f}")
+    for threshold in sorted({0.5, 0.7, CONFIG["INTENT_MIN_CONFIDENCE"], 0.9, 0.97}):
+        print(f"test split at {threshold:.2f}: {model.evaluate(test, threshold)}")
+    return 0
+
+def digest_cli(argv: List[str]) -> int:
+    """Write a digest PDF from a chat's report archive or an exported JSON file"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="app.py digest", description=digest_cli.__doc__)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--chat", help="chat id whose report archive to read")
+    source.add_argument("--input", help="JSON list, JSON lines, archive or session file with reports")
+    parser.add_argument("--days", type=int, default=CONFIG["DIGEST_DAYS"], help="only archived reports from the last N days (0 for all)")
+    parser.add_argument("--site", help="only reports for this site")
+    parser.add_argument("--title", default="Site Digest")
+    parser.add_argument("-o", "--output", default="digest.pdf")
+    args = parser.parse_args(argv)
+    
+    if args.input:
+        reports = iter_reports_from_json(args.input, site=args.site)
+    else:
+        since = get_berlin_time() - timedelta(days=args.days) if args.days > 0 else None
+        reports = iter_archived_reports(args.chat, since=since, site=args.site)
+    
+    digest_file = generate_digest_pdf(reports, title=args.title, subtitle=args.site or "")
+    if digest_file is None:
+        print("No reports found", file=sys.stderr)
+        return 1
+    with digest_file, open(args.output, "wb") as f:
+        shutil.copyfileobj(digest_file, f)
+    print(args.output)
+    return 0
+
 # Start Flask server if running directly
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "digest":
+        sys.exit(digest_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "train-intent":
+        sys.exit(train_intent_cli(sys.argv[2:]))
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,882 @@
+"""Benchmarks for the construction site report bot.
+
+Run ``python benchmarks.py <name>`` (or ``all``). Results are printed as JSON
+so they can be stored and compared between deploys: pass ``--baseline`` with
+an earlier ``--output`` file and the exit status is 1 if any wall time, peak
+memory, output size or prompt size grew by more than ``--tolerance``. No
+Telegram or OpenAI requests are made: photos come from locally generated
+sample images, prompt sizes are estimated locally and transcription uses
+synthetic audio with a stand-in for whisper-1; downloads come from a local
+file server.
+"""
+import os
+import io
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import http.server
+import tempfile
+import statistics
+import tracemalloc
+from typing import Dict, Any, List, Callable
+
+# app.py refuses to import without credentials; benchmarks never use them
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("SESSION_FILE", "/tmp/benchmark_session.json")
+
+import app  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+app.logger.setLevel(logging.WARNING)
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Dict[str, Any]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    """Decorator for registering benchmarks"""
+    def decorator(func: Callable) -> Callable:
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+# --- Synthetic data ---
+def sample_photo_bytes(width: int = 800, height: int = 600) -> bytes:
+    """Create a local JPEG standing in for a Telegram photo"""
+    from PIL import Image as PILImage
+
+    image = PILImage.new("RGB", (width, height))
+    pixels = image.load()
+    for x in range(0, width, 4):
+        for y in range(0, height, 4):
+            pixels[x, y] = (x % 256, y % 256, (x + y) % 256)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def synthetic_report(issues: int = 5, photos: int = 0, people: int = 5,
+                     activities: int = 5) -> Dict[str, Any]:
+    """Build a report with the given number of entries per field"""
+    report = app.blank_report()
+    report.update({
+        "site_name": "Central Plaza",
+        "segment": "5",
+        "category": "Progress",
+        "companies": [{"name": f"BuildRight {i} AG"} for i in range(max(1, people // 3))],
+        "people": [f"Worker {i}" for i in range(people)],
+        "roles": [{"name": f"Worker {i}", "role": "Site Manager"} for i in range(people)],
+        "tools": [{"item": f"tool {i}"} for i in range(max(1, activities // 2))],
+        "services": [{"task": f"service {i}"} for i in range(max(1, activities // 2))],
+        "activities": [f"pouring concrete section {i}" for i in range(activities)],
+        "issues": [
+            {"description": f"water leak in basement room {i}", "has_photo": i < photos}
+            for i in range(issues)
+        ],
+        "time": "full day",
+        "weather": "sunny with occasional clouds",
+        "impression": "productive despite setbacks",
+        "comments": "ensure safety protocols are reinforced",
+    })
+    return report
+
+
+def synthetic_photos(count: int) -> List[Dict[str, Any]]:
+    """Photo references matching the first ``count`` issues"""
+    return [{"file_id": f"photo-{i}", "issue_ref": str(i + 1), "caption": f"Photo for issue {i + 1}"}
+            for i in range(count)]
+
+
+def use_local_photos() -> None:
+    """Serve every photo request from a local sample image"""
+    photo = sample_photo_bytes()
+    app.get_photo_from_telegram = lambda file_id, chat_id: io.BytesIO(photo)
+
+
+def sample_logo_path() -> str:
+    """Write a PNG logo to a temp file and return its path"""
+    from PIL import Image as PILImage
+
+    path = os.path.join(tempfile.gettempdir(), "benchmark_logo.png")
+    if not os.path.exists(path):
+        PILImage.new("RGB", (1200, 400), (72, 91, 106)).save(path)
+    return path
+
+
+def mean_time(func: Callable[[], Any], iterations: int) -> float:
+    """Mean wall time of func in seconds"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.mean(timings), 6)
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+    return len(re.findall(rb"/Type /Page\b(?!s)", pdf_bytes))
+
+
+def measure(func: Callable[[], Any]) -> Dict[str, Any]:
+    """Run func once and record wall time and peak traced memory"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    wall_time = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"result": result, "wall_time_s": round(wall_time, 4), "peak_memory_bytes": peak}
+
+
+def render_uncached(report: Dict[str, Any], report_type: str, photos: List[Dict] = None) -> bytes:
+    """Render through generate_pdf with the render cache disabled"""
+    app.pdf_render_cache = app.PDFRenderCache(0)
+    buffer = app.generate_pdf(report, report_type, photos, "benchmark" if photos else None)
+    return buffer.getvalue() if buffer else b""
+
+
+# --- Benchmarks ---
+class SnapshotNumberedCanvas(canvas.Canvas):
+    """The previous page numbering canvas, kept for comparison"""
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self._saved_page_states = []
+
+    def showPage(self):
+        self._saved_page_states.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        num_pages = len(self._saved_page_states)
+        for state in self._saved_page_states:
+            self.__dict__.update(state)
+            self.draw_page_number(num_pages)
+            canvas.Canvas.showPage(self)
+        canvas.Canvas.save(self)
+
+    def draw_page_number(self, page_count):
+        self.setFont("Helvetica", 9)
+        self.drawRightString(app.letter[0] - 0.5 * app.inch, 0.5 * app.inch,
+                             f"Page {self._pageNumber} of {page_count}")
+
+
+@benchmark("page_numbering")
+def bench_page_numbering(args: argparse.Namespace) -> Dict[str, Any]:
+    """Peak memory of page numbering on ~N page text-only and photo-heavy reports"""
+    use_local_photos()
+    text_issues = args.pages * 36
+    photo_issues = args.pages * 2
+    scenarios = {
+        "text_only": (synthetic_report(issues=text_issues, people=10, activities=20), None),
+        "photo_heavy": (synthetic_report(issues=photo_issues, photos=photo_issues, people=10, activities=20),
+                        synthetic_photos(photo_issues)),
+    }
+
+    results = {}
+    current_canvas = app.NumberedCanvas
+    for scenario, (report, photos) in scenarios.items():
+        results[scenario] = {}
+        for label, canvas_class in (("snapshot_states", SnapshotNumberedCanvas),
+                                    ("deferred_forms", current_canvas)):
+            app.NumberedCanvas = canvas_class
+            try:
+                run = measure(lambda: render_uncached(report, "detailed", photos))
+            finally:
+                app.NumberedCanvas = current_canvas
+            pdf_bytes = run.pop("result")
+            run.update(pages=count_pages(pdf_bytes), output_bytes=len(pdf_bytes))
+            results[scenario][label] = run
+    return results
+
+
+@benchmark("pdf_template")
+def bench_pdf_template(args: argparse.Namespace) -> Dict[str, Any]:
+    """Per-export cost of the static PDF parts, rebuilt versus reused"""
+    app.CONFIG["PDF_LOGO_PATH"] = sample_logo_path()
+    report = synthetic_report()
+    template = app.get_pdf_template()
+
+    def copy_static_parts():
+        template.logo()
+        for name in ("title", "divider", "roles_label"):
+            template.static_flowable(name)
+        for key in app.PDF_SECTION_HEADINGS:
+            template.heading(key)
+
+    def export_rebuilding_template():
+        app._build_pdf_template.cache_clear()
+        render_uncached(report, "detailed")
+
+    iterations = args.iterations
+    results = {
+        "iterations": iterations,
+        "static_parts_rebuilt_s": mean_time(
+            lambda: app.PDFTemplate(app.CONFIG["PDF_LOGO_PATH"], app.CONFIG["PDF_LOGO_WIDTH"]), iterations),
+        "static_parts_reused_s": mean_time(copy_static_parts, iterations),
+        "export_rebuilding_template_s": mean_time(export_rebuilding_template, iterations),
+        "export_with_template_s": mean_time(lambda: render_uncached(report, "detailed"), iterations),
+    }
+    results["per_export_saving_s"] = round(
+        results["export_rebuilding_template_s"] - results["export_with_template_s"], 6)
+    return results
+
+
+PDF_SIZE_TIERS = {
+    "small": {"issues": 3, "photos": 0, "people": 3, "activities": 3},
+    "medium": {"issues": 15, "photos": 3, "people": 10, "activities": 15},
+    "large": {"issues": 60, "photos": 10, "people": 30, "activities": 60},
+    "xlarge": {"issues": 200, "photos": 25, "people": 80, "activities": 200},
+}
+
+
+@benchmark("pdf_scaling")
+def bench_pdf_scaling(args: argparse.Namespace) -> Dict[str, Any]:
+    """Wall time, peak memory and output size of generate_pdf per size tier and report type"""
+    use_local_photos()
+    tiers = args.tiers.split(",") if args.tiers else list(PDF_SIZE_TIERS)
+    results = {}
+    for tier in tiers:
+        sizes = PDF_SIZE_TIERS[tier]
+        report = synthetic_report(**sizes)
+        photos = synthetic_photos(sizes["photos"]) or None
+        results[tier] = {"sizes": sizes}
+        for report_type in ("summary", "detailed"):
+            # Peak memory comes from one traced run; tracing slows rendering, so time untraced runs
+            run = measure(lambda: render_uncached(report, report_type, photos))
+            pdf_bytes = run.pop("result")
+            timings = []
+            for _ in range(max(1, args.repeat)):
+                started = time.perf_counter()
+                render_uncached(report, report_type, photos)
+                timings.append(time.perf_counter() - started)
+            run["wall_time_s"] = round(statistics.median(timings), 4)
+            run.update(pages=count_pages(pdf_bytes), output_bytes=len(pdf_bytes))
+            results[tier][report_type] = run
+    return results
+
+
+PROMPT_SAMPLES = {
+    "command": "yes",
+    "site": "site Downtown Project",
+    "people": "people Lisa Miller as co-worker",
+    "companies": "companies Implenia AG and KIBAG AG",
+    "correction": "correct spelling KeyBag AG to KIBAG AG",
+    "free_form": ("Today at the Zurich Bike Tunnel site we were pouring concrete and installing windows, "
+                  "Stefan was laying the electrical wiring and Lisa Malone was a safety officer. "
+                  "Companies Implenia AG and KIBAG AG were on site, weather sunny with occasional clouds "
+                  "time full day eight hours, issues water leak in basement and delayed material delivery."),
+}
+
+
+@benchmark("prompt_pruning")
+def bench_prompt_pruning(args: argparse.Namespace) -> Dict[str, Any]:
+    """Estimated system-prompt and completion-budget tokens, full prompt versus pruned, per sample input"""
+    results = {}
+    for name, text in PROMPT_SAMPLES.items():
+        prompt = app.build_nlp_prompt(text)
+        results[name] = {
+            "fragments": app.select_prompt_fragments(text),
+            "full_prompt_tokens": app.NLP_FULL_PROMPT_TOKENS,
+            "prompt_tokens": app.estimate_token_count(prompt),
+            "full_max_tokens": app.CONFIG["NLP_MAX_TOKENS"],
+            "max_tokens": app.nlp_max_tokens(text),
+        }
+    full_total = sum(sample["full_prompt_tokens"] for sample in results.values())
+    pruned_total = sum(sample["prompt_tokens"] for sample in results.values())
+    results["prefix_tokens"] = app.NLP_PREFIX_PROMPT_TOKENS
+    results["saved_pct"] = round(100 * (1 - pruned_total / full_total), 1)
+    return results
+
+
+# --- Command matching ---
+def command_corpus() -> List[str]:
+    """Command texts in the forms FIELD_PATTERNS accepts, plus free-form reports"""
+    return [text for text, _ in app.intent_training_examples()] + list(PROMPT_SAMPLES.values())
+
+
+@benchmark("pattern_matching")
+def bench_pattern_matching(args: argparse.Namespace) -> Dict[str, Any]:
+    """Matches per second over FIELD_PATTERNS: uncompiled re.match over every entry (as before)
+    versus the compiled registry's candidate subset, plus extract_single_command end to end"""
+    texts = command_corpus()
+    registry = app.FIELD_PATTERN_REGISTRY
+
+    def legacy_scan():
+        return [[field for field, pattern in app.FIELD_PATTERNS.items() if re.match(pattern, text, re.IGNORECASE)]
+                for text in texts]
+
+    def registry_scan():
+        return [[field for field, pattern in registry.candidates(text) if pattern.match(text)] for text in texts]
+
+    assert legacy_scan() == registry_scan(), "registry candidates disagree with a full scan"
+    results = {"texts": len(texts),
+               "candidates_per_text": round(statistics.mean(len(registry.candidates(text)) for text in texts), 1),
+               **registry.stats()}
+    for label, scan in (("legacy", legacy_scan), ("registry", registry_scan)):
+        wall_time = mean_time(scan, args.iterations)
+        results[label] = {"wall_time_s": wall_time, "texts_per_s": round(len(texts) / wall_time)}
+
+    def extract_all():
+        for text in texts:
+            app.extract_single_command(text)
+
+    # The command grammar would answer most of the corpus before the patterns are reached
+    full_scan = list(registry.compiled.items())
+    registry.candidates = lambda text: full_scan
+    app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = False
+    try:
+        results["extract_single_command_full_scan"] = {"wall_time_s": mean_time(extract_all, args.iterations)}
+        del registry.candidates
+        results["extract_single_command_indexed"] = {"wall_time_s": mean_time(extract_all, args.iterations)}
+    finally:
+        registry.__dict__.pop("candidates", None)
+        app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = True
+    return results
+
+
+
+# Texts and the fields the grammar reads from them; None where it must leave the text
+# to the patterns or the LLM because it is a sentence, not a command
+GOLDEN_COMMANDS = [
+    ("Project is delayed due to rain and the crane broke down", None),
+    ("People Anna and Tobias worked with the crane all day", None),
+    ("Section 5 is finished", None),
+    ("Companies Smith and Sons, Ernst and Young", None),
+    ("Activities pouring concrete and installing windows, issues crane broken", None),
+    ("supervisor is on leave", None),
+    ("time was short because Swiss Steel Ltd arrived late", None),
+    ("Tools drill and excavator were broken so Lisa called Keller Bau", None),
+    ("add site Central Plaza", {"site_name": "Central Plaza"}),
+    ("site is Central Plaza", {"site_name": "Central Plaza"}),
+    ("people Anna and Tobias", {"people": ["Anna", "Tobias"]}),
+    ("Companies BuildCorp, TechSolutions GmbH, and Electric Ltd",
+     {"companies": [{"name": "Buildcorp"}, {"name": "Techsolutions Gmbh"}, {"name": "Electric Ltd"}]}),
+    ("segment A category safety", {"segment": "A", "category": "safety"}),
+    ("segment 5 category safety", {"segment": "5", "category": "safety"}),
+    ("issues delay in delivery", {"issues": [{"description": "delay in delivery"}]}),
+    ("tools crane and drill", {"tools": [{"item": "crane"}, {"item": "drill"}]}),
+]
+
+
+@benchmark("command_parsing")
+def bench_command_parsing(args: argparse.Namespace) -> Dict[str, Any]:
+    """Golden cases, then coverage and latency of the command grammar against the
+    FIELD_PATTERNS path of extract_single_command, over the command corpus and split
+    into the texts the grammar parses and those it leaves to the patterns"""
+    for text, expected in GOLDEN_COMMANDS:
+        command = app.parse_command(text)
+        assert (command.to_fields() if command else None) == expected, (text, command)
+
+    texts = command_corpus()
+
+    def extract_all(subset=texts):
+        return [app.extract_single_command(text) for text in subset]
+
+    def regex_time(subset):
+        app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = False
+        try:
+            return mean_time(lambda: extract_all(subset), args.iterations)
+        finally:
+            app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = True
+
+    app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = False
+    try:
+        regex_results = extract_all()
+    finally:
+        app.CONFIG["ENABLE_COMMAND_GRAMMAR"] = True
+    commands = [app.parse_command(text) for text in texts]
+    parsed = [(index, command.to_fields()) for index, command in enumerate(commands) if command is not None]
+    differing = [index for index, fields in parsed if fields != regex_results[index]]
+    results = {
+        "texts": len(texts),
+        "parsed": len(parsed),
+        "coverage_pct": round(100 * len(parsed) / len(texts), 1),
+        # Texts the patterns extracted something from, and how many of those the grammar parses
+        "regex_matched": sum(1 for fields in regex_results if fields),
+        "regex_matched_parsed": sum(1 for index, _ in parsed if regex_results[index]),
+        "same_as_regex": len(parsed) - len(differing),
+        "differs_from_regex": len(differing),
+        "differences": [{"text": texts[index], "regex": regex_results[index], "grammar": commands[index].to_fields()}
+                        for index in differing[:args.examples]],
+    }
+    parse_time = mean_time(lambda: [app.parse_command(text) for text in texts], args.iterations)
+    for label, wall_time in (("grammar_parse", parse_time), ("extract_single_command_regex", regex_time(texts)),
+                             ("extract_single_command_grammar", mean_time(extract_all, args.iterations))):
+        results[label] = {"wall_time_s": wall_time, "us_per_text": round(1e6 * wall_time / len(texts), 1)}
+    # The grammar saves the patterns on texts it parses and adds its own work to the rest
+    parsed_texts = [texts[index] for index, _ in parsed]
+    rejected_texts = [text for text, command in zip(texts, commands) if command is None]
+    for label, subset in (("parsed_texts", parsed_texts), ("rejected_texts", rejected_texts)):
+        results[label] = {
+            "texts": len(subset),
+            "regex_us_per_text": round(1e6 * regex_time(subset) / len(subset), 1),
+            "grammar_us_per_text": round(1e6 * mean_time(lambda: extract_all(subset), args.iterations) / len(subset), 1),
+        }
+    return results
+
+
+# The per-message stages as they were before Utterance: each derives its own forms from a
+# plain string. The grammar and the patterns behind extract_single_command are the current ones.
+LEGACY_REPORT_INDICATORS = [pattern.pattern for pattern in app.FREEFORM_REPORT_INDICATORS]
+
+
+def legacy_is_free_form_report(text: str) -> bool:
+    if len(text) < 150:
+        return False
+    if len(text) > 500:
+        return True
+    if re.match(r'^(?:add|insert|delete|remove|category|site|segment|people|companies|roles|tools|services|activities|issues|weather|time|impression|correct)\b', text.lower()):
+        return False
+    indicator_count = sum(1 for pattern in LEGACY_REPORT_INDICATORS if re.search(pattern, text, re.IGNORECASE))
+    sentence_count = len(re.findall(r'[.!?]+', text))
+    comma_count = len(re.findall(r',', text))
+    word_count = len(text.split())
+    structure_score = min(1.0, (sentence_count / 5) * 0.5 + (comma_count / 8) * 0.3 + (word_count / 100) * 0.2)
+    indicator_score = min(1.0, indicator_count * 0.25)
+    report_confidence = (structure_score * 0.6) + (indicator_score * 0.4)
+    app.log_event("free_form_detection", length=len(text), sentence_count=sentence_count,
+                  indicator_count=indicator_count, structure_score=structure_score,
+                  indicator_score=indicator_score, report_confidence=report_confidence)
+    return report_confidence > 0.65
+
+
+def legacy_calculate_enhanced_confidence(text: str, audio_size: int) -> float:
+    confidence = 0.5
+    text_lower = text.lower()
+    words = text.split()
+    if 3 <= len(words) <= 100:
+        confidence += 0.2
+    elif len(words) > 100:
+        confidence += 0.15
+    construction_terms = {
+        'site', 'concrete', 'scaffold', 'safety', 'contractor',
+        'building', 'foundation', 'equipment', 'supervisor', 'worker',
+        'segment', 'plaza', 'commercial', 'westfield', 'add', 'construction',
+        'axis', 'premier', 'electric', 'electrician', 'crane', 'operator',
+        'project', 'manager', 'companies', 'people', 'miller', 'wilson', 'brown'
+    }
+    if re.search(r"add\s+(?:the\s+)?.*?\s+site", text_lower):
+        confidence += 0.3
+    if "segment" in text_lower and "category" in text_lower:
+        confidence += 0.25
+    if "companies" in text_lower or "people" in text_lower:
+        confidence += 0.2
+    term_matches = sum(1 for term in construction_terms if term in text_lower)
+    confidence += min(0.3, term_matches * 0.05)
+    if re.search(r'(\w)\1{4,}', text):
+        confidence -= 0.2
+    if len(set(words)) < len(words) * 0.3:
+        confidence -= 0.1
+    return max(0.1, min(1.0, confidence))
+
+
+def legacy_segment_uses_nlp(text: str) -> bool:
+    normalized_text = re.sub(r'[.!?]\s*$', '', text.strip())
+    if not normalized_text or re.match(r'^correct\s+spelling', normalized_text, re.IGNORECASE):
+        return False
+    if re.match(app.NLP_SKIP_PATTERN.pattern, normalized_text.lower()):
+        return False
+    if not app.openai_available("nlp_extraction"):
+        return False
+    return not app.CONFIG["ENABLE_INTENT_CLASSIFIER"] or app.route_intent(normalized_text) == "llm"
+
+
+@benchmark("utterance_pipeline")
+def bench_utterance_pipeline(args: argparse.Namespace) -> Dict[str, Any]:
+    """The per-message stages over the command corpus as they were before Utterance, each
+    on a plain string, versus the current stages sharing one Utterance"""
+    texts = command_corpus()
+
+    def legacy_stages(text):
+        results = (legacy_is_free_form_report(text), legacy_calculate_enhanced_confidence(text, 0),
+                   bool(";" in text or re.search(r'(?<!\d)\.\s+[A-Za-z]', text)), legacy_segment_uses_nlp(text))
+        # extract_single_command gets a plain string, as before, and tokenizes it itself
+        return results + (app.extract_single_command(re.sub(r'[.!?]\s*$', '', text.strip())),)
+
+    def shared_stages(text):
+        utterance = app.Utterance(text)
+        return (app.is_free_form_report(utterance), app.calculate_enhanced_confidence(utterance, 0),
+                utterance.is_chained, app.segment_uses_nlp(utterance), app.extract_single_command(utterance.normalized))
+
+    def legacy():
+        return [legacy_stages(str(text)) for text in texts]
+
+    def shared():
+        return [shared_stages(text) for text in texts]
+
+    assert legacy() == shared(), "a shared Utterance changed a stage result"
+    results = {"texts": len(texts)}
+    for label, run in (("legacy", legacy), ("shared", shared)):
+        wall_time = mean_time(run, args.iterations)
+        results[label] = {"wall_time_s": wall_time, "us_per_text": round(1e6 * wall_time / len(texts), 1)}
+    results["saved_pct"] = round(100 * (1 - results["shared"]["wall_time_s"] / results["legacy"]["wall_time_s"]), 1)
+    return results
+
+# --- Transcription normalization ---
+# Raw transcripts and their normalized form, recorded from the per-rule re.sub implementation
+GOLDEN_TRANSCRIPTIONS = [
+    ("Side build a with con crete and ad the two by four", "site builder with concrete and add the 2x4"),
+    ("add the side plaza, segment 5, category Mängelerfassung", "add the site plaza, segment 5, category Mängelerfassung"),
+    ("Dell eat the scaffold ink from tools", "delete the scaffolding from tools"),
+    ("Weather sunny, rein force meant delivered, heavy coupe meant on site",
+     "Weather sunny, reinforcement delivered, heavy equipment on site"),
+    ("new.", "new"),
+    ("New report!", "new report"),
+    ("да", "yes"),
+    ("Kategorie Abnahme", "category Abnahme"),
+    ("We had a power out edge and a tool box talk about safe tea", "We had a power outage and a toolbox talk about safety"),
+    ("some mary please", "summary please"),
+    ("expoart pdf", "export pdf"),
+    ("reset", "reset"),
+    ("Inspect shun by the reg you late shuns officer at ten", "inspection by the regulations officer add ten"),
+    ("side A and side B", "site A and site B"),
+    ("Companies Kybak are gay and makhti ageet", "Companies Kybak are gay and makhti ageet"),
+    ("  two  by  four timber and four by four posts  ", "2x4 timber and 4x4 posts"),
+]
+GOLDEN_VOICE_COMPANIES = [
+    ("Company's Kybak are gay and makhti ageet", "Companies KIBAG AG and Marti AG"),
+    ("Electro Maya Game Bearer, Implenier", "Elektro-Meier GmbH, Implenia"),
+    ("Build, Tech AG and Electric Solutions, Ltd", "BuildTech AG and Electric Solutions Ltd"),
+    ("Construction, Bro, GmbH", "ConstructionBro GmbH"),
+    ("people Maya as foreman", "people Meier as foreman"),
+    ("Elektromaya, Kieback and Marti, AG", "Elektro-MeierKIB AG and Marti AG"),
+    ("no commas here AG", "no commas here AG"),
+    ("Acme, Inc, Foo, S.A. bar", "Acme, Inc, Foo, S.A. bar"),
+]
+
+
+def sequential_voice_companies(text: str) -> str:
+    """normalize_voice_companies as before: every rule and every suffix fix as its own re.sub"""
+    text = app.voice_company_replacements.apply_sequential(text)
+    for _, rules in app.COMPANY_SUFFIX_RULES:
+        for pattern, replacement in rules:
+            text = pattern.sub(replacement, text)
+    return text
+
+
+@benchmark("transcription_normalization")
+def bench_transcription_normalization(args: argparse.Namespace) -> Dict[str, Any]:
+    """Golden cases, then throughput of one re.sub per rule versus the merged single-pass stages"""
+    for raw, expected in GOLDEN_TRANSCRIPTIONS:
+        assert app.normalize_transcription(raw) == expected, (raw, app.normalize_transcription(raw))
+    for raw, expected in GOLDEN_VOICE_COMPANIES:
+        assert app.normalize_voice_companies(raw) == expected, (raw, app.normalize_voice_companies(raw))
+
+    texts = ([raw for raw, _ in GOLDEN_TRANSCRIPTIONS + GOLDEN_VOICE_COMPANIES] + command_corpus()
+             + [report for report in PROMPT_SAMPLES.values()])
+    engines = {"transcription": app.transcription_replacements, "voice_companies": app.voice_company_replacements}
+    cases = {
+        "transcription": (app.transcription_replacements.apply_sequential, app.transcription_replacements.apply),
+        "voice_companies": (sequential_voice_companies, app.normalize_voice_companies),
+    }
+    results = {"texts": len(texts)}
+    for name, (sequential, single_pass) in cases.items():
+        assert [sequential(text) for text in texts] == [single_pass(text) for text in texts], name
+        results[name] = engines[name].stats()
+        for label, func in (("sequential", sequential), ("single_pass", single_pass)):
+            wall_time = mean_time(lambda: [func(text) for text in texts], args.iterations)
+            results[name][label] = {"wall_time_s": wall_time, "texts_per_s": round(len(texts) / wall_time)}
+    return results
+
+
+# --- Voice transcription ---
+# Stand-in for whisper-1: a fixed request latency plus time proportional to the audio
+STANDIN_REQUEST_LATENCY_S = 0.3
+STANDIN_SECONDS_PER_AUDIO_SECOND = 0.01
+
+
+def synthetic_voice_wav(seconds: float, rate: int = 16000) -> bytes:
+    """Mono 16-bit WAV alternating 1-4 s of tone "speech" with 0.3-0.8 s pauses"""
+    import math
+    import random
+    import wave
+    from array import array
+
+    rng = random.Random(42)
+    burst = array("h", (int(8000 * math.sin(2 * math.pi * 220 * i / rate) + rng.randint(-2000, 2000))
+                        for i in range(rate)))
+    samples = array("h")
+    total = int(seconds * rate)
+    while len(samples) < total:
+        for _ in range(rng.randint(1, 4)):
+            samples.extend(burst)
+        samples.extend(array("h", [0]) * int(rate * rng.uniform(0.3, 0.8)))
+    del samples[total:]
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return output.getvalue()
+
+
+class StandinTranscriptionBackend(app.TranscriptionBackend):
+    """Local stand-in for the OpenAI backend; returns two words per audio second"""
+    name = "standin"
+
+    def transcribe(self, filename: str, audio: bytes, mime_type: str, seconds: float) -> str:
+        time.sleep(STANDIN_REQUEST_LATENCY_S + STANDIN_SECONDS_PER_AUDIO_SECOND * seconds)
+        return " ".join(["concrete"] * int(seconds * 2))
+
+
+@benchmark("chunked_transcription")
+def bench_chunked_transcription(args: argparse.Namespace) -> Dict[str, Any]:
+    """Wall time of transcribe_audio for long voice reports, single request versus parallel chunks"""
+    results = {}
+    backend = StandinTranscriptionBackend()
+    chunk_min = app.CONFIG["TRANSCRIPTION_CHUNK_MIN_SECONDS"]
+    for seconds in (float(value) for value in args.audio_seconds.split(",")):
+        audio = synthetic_voice_wav(seconds)
+        started = time.perf_counter()
+        chunks = app.split_audio_at_silences(audio)
+        split_time = time.perf_counter() - started
+
+        app.CONFIG["TRANSCRIPTION_CHUNK_MIN_SECONDS"] = float("inf")
+        try:
+            started = time.perf_counter()
+            app.transcribe_audio(audio, seconds, backend)
+            single_time = time.perf_counter() - started
+        finally:
+            app.CONFIG["TRANSCRIPTION_CHUNK_MIN_SECONDS"] = chunk_min
+
+        started = time.perf_counter()
+        app.transcribe_audio(audio, seconds, backend)
+        chunked_time = time.perf_counter() - started
+
+        results[f"{int(seconds)}s"] = {
+            "chunks": len(chunks),
+            "chunk_seconds": [round(chunk_seconds, 1) for _, chunk_seconds in chunks],
+            "split_wall_time_s": round(split_time, 4),
+            "single": {"wall_time_s": round(single_time, 4)},
+            "chunked": {"wall_time_s": round(chunked_time, 4)},
+            "speedup": round(single_time / chunked_time, 2),
+        }
+    return results
+
+
+VOICE_LOAD_PHRASES = [
+    "add site Central Plaza",
+    "people Lisa Miller as co-worker",
+    "tools hammer, drill and mobile crane",
+    "issues water leak in basement",
+    "weather sunny time full day",
+]
+
+
+@benchmark("voice_load")
+def bench_voice_load(args: argparse.Namespace) -> Dict[str, Any]:
+    """Voice updates through the webhook with the fixture transcription backend, sequential and concurrent"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    clips = {f"voice-{index}": synthetic_voice_wav(2 + index % 5) for index in range(args.iterations)}
+    fixture = app.FixtureTranscriptionBackend(path="")
+    for index, audio in enumerate(clips.values()):
+        fixture.add(audio, VOICE_LOAD_PHRASES[index % len(VOICE_LOAD_PHRASES)])
+    app.transcription_backends["fixture"] = fixture
+    app.CONFIG.update(TRANSCRIPTION_BACKEND="fixture", ENABLE_NLP_EXTRACTION=False)
+    app.transcription_cache = app.NLPResultCache(0, 0)
+    app.fetch_voice_audio = lambda file_id, timings=None: app.TelegramDownload.from_bytes(clips[file_id])
+    app.send_message = lambda chat_id, text: 1
+    client = app.app.test_client()
+
+    def post(index: int) -> float:
+        file_id = f"voice-{index}"
+        update = {"message": {"chat": {"id": 9000 + index % 8},
+                              "voice": {"file_id": file_id, "file_unique_id": file_id, "duration": 2 + index % 5}}}
+        started = time.perf_counter()
+        response = client.post("/webhook", json=update)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - started
+
+    results = {"updates": args.iterations}
+    for label, workers in (("sequential", 1), ("concurrent", 8)):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = sorted(pool.map(post, range(args.iterations)))
+        wall_time = time.perf_counter() - started
+        results[label] = {
+            "wall_time_s": round(wall_time, 4),
+            "updates_per_s": round(args.iterations / wall_time, 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        }
+    return results
+
+
+def serve_sized_files() -> http.server.ThreadingHTTPServer:
+    """Local file server: GET /<n> returns n bytes with a Content-Length, like the Telegram file server"""
+    block = b"\x00" * (1024 * 1024)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            size = int(self.path.strip("/"))
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            for start in range(0, size, len(block)):
+                self.wfile.write(block[:min(len(block), size - start)])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss_growth(func: Callable[[], Any]) -> int:
+    """Growth of the process's peak resident set size while func runs, in bytes (Linux)"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # reset VmHWM to the current RSS
+
+    def status_kb(field: str) -> int:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+    baseline = status_kb("VmRSS:")
+    func()
+    return (status_kb("VmHWM:") - baseline) * 1024
+
+
+def download_rss_worker(variant: str, url: str, concurrency: int, results) -> None:
+    """Child process body for download_memory: download url (a local path for "mapped")
+    concurrently and report peak RSS growth"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def buffered():
+        # What get_photo_from_telegram and fetch_voice_audio did before streaming
+        response = app.requests.get(url, timeout=app.CONFIG["DOWNLOAD_TIMEOUT"])
+        response.raise_for_status()
+        return io.BytesIO(response.content)
+
+    def streamed():
+        return app.download_telegram_file(url, app.CONFIG["MAX_VOICE_BYTES"]).file
+
+    app.CONFIG["TELEGRAM_LOCAL_MODE"] = variant == "mapped"
+    download = buffered if variant == "buffered" else streamed
+
+    def run():
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            files = list(pool.map(lambda _: download(), range(concurrency)))
+        for file in files:
+            file.close()
+
+    started = time.perf_counter()
+    peak = peak_rss_growth(run)
+    results.put({"wall_time_s": round(time.perf_counter() - started, 4), "peak_rss_bytes": peak})
+
+
+@benchmark("download_memory")
+def bench_download_memory(args: argparse.Namespace) -> Dict[str, Any]:
+    """Peak RSS of concurrent Telegram file downloads: buffered with .content, streamed to a spool
+    and memory-mapped from a local-mode Bot API server's disk.
+
+    Mapped pages are shared with the page cache and count towards RSS while mapped,
+    but the kernel can drop them under memory pressure, unlike the buffered copies.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    server = serve_sized_files()
+    concurrency = 4
+    results = {"concurrency": concurrency, "spool_max_bytes": app.CONFIG["DOWNLOAD_SPOOL_MAX_BYTES"]}
+    try:
+        for megabytes in (int(value) for value in args.download_mb.split(",")):
+            url = f"http://127.0.0.1:{server.server_address[1]}/{megabytes * 1024 * 1024}"
+            local_file = tempfile.NamedTemporaryFile(suffix=".oga")
+            local_file.write(b"\x00" * (megabytes * 1024 * 1024))
+            local_file.flush()
+            tier = {}
+            for variant, location in (("buffered", url), ("streamed", url), ("mapped", local_file.name)):
+                # A fresh process per variant, so none inherits another's high-water mark
+                queue = context.Queue()
+                worker = context.Process(target=download_rss_worker, args=(variant, location, concurrency, queue))
+                worker.start()
+                tier[variant] = queue.get(timeout=300)
+                worker.join()
+            local_file.close()
+            results[f"{megabytes}mb"] = tier
+    finally:
+        server.shutdown()
+    return results
+
+
+# --- Regression check ---
+REGRESSION_METRICS = ("wall_time_s", "peak_memory_bytes", "peak_rss_bytes", "output_bytes", "prompt_tokens")
+
+
+def flatten_metrics(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Map dotted paths to the numeric metrics that are compared between runs"""
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, path))
+        elif key in REGRESSION_METRICS and isinstance(value, (int, float)):
+            metrics[path] = value
+    return metrics
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Metrics that grew by more than tolerance (a fraction) relative to the baseline"""
+    current = flatten_metrics(results)
+    regressions = []
+    for path, old_value in flatten_metrics(baseline).items():
+        new_value = current.get(path)
+        if new_value is None or old_value <= 0:
+            continue
+        change = (new_value - old_value) / old_value
+        if change > tolerance:
+            regressions.append({"metric": path, "baseline": old_value, "current": new_value,
+                                "change": round(change, 3)})
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("name", choices=sorted(BENCHMARKS) + ["all"])
+    parser.add_argument("--pages", type=int, default=50, help="target page count for page_numbering")
+    parser.add_argument("--iterations", type=int, default=20, help="repetitions for timing benchmarks")
+    parser.add_argument("--tiers", help="comma separated size tiers for pdf_scaling (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case for pdf_scaling (median is kept)")
+    parser.add_argument("--audio-seconds", default="60,180,300",
+                        help="comma separated voice note lengths for chunked_transcription")
+    parser.add_argument("--download-mb", default="5,20",
+                        help="comma separated file sizes in MB for download_memory")
+    parser.add_argument("--examples", type=int, default=10,
+                        help="differences from the regex path to list for command_parsing")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative growth of a metric before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    names = sorted(BENCHMARKS) if args.name == "all" else [args.name]
+    results = {name: BENCHMARKS[name](args) for name in names}
+    payload = json.dumps(results, indent=2)
+    print(payload)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, {name: baseline[name] for name in names if name in baseline},
+                                       args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"(+{regression['change']:.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())